@@ -2,85 +2,503 @@
 Google Tasks API integration module for the Todo application.
 This module provides functions to interact with Google Tasks API for managing tasks.
 """
-from googleapiclient.discovery import build
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
+from functools import wraps
+from datetime import datetime, timezone
+import json
+import logging
+import os
+import random
+import threading
+import time
+import weakref
 
-# TODO for all these API methods - creds could be expired, need to check this and re-auth in that case. May need to store creds as a global or session variable.
+import requests
+from google.auth.exceptions import TransportError
+from google.auth.transport.requests import Request
+from googleapiclient.discovery import build_from_document
+from googleapiclient.errors import HttpError
 
-def get_tasks(creds):
+import timing
+
+logger = logging.getLogger(__name__)
+
+# Bundled copy of the Tasks v1 discovery document, parsed once at import so building a service never has to fetch or re-parse it
+DISCOVERY_PATH = os.path.join(os.path.dirname(__file__), 'discovery', 'tasks.v1.json')
+with open(DISCOVERY_PATH) as discovery_file:
+    _discovery_doc = json.load(discovery_file)
+
+# Google's alias for the user's default task list, used for tasks that aren't tagged with a list yet
+DEFAULT_TASKLIST = '@default'
+
+# Most task lists fetched at once by get_all_tasklists_tasks
+FETCH_WORKERS = int(os.environ.get('FETCH_WORKERS', 4))
+
+# Retries of a failed request, and the base delay of the exponential backoff between them
+MAX_RETRIES = int(os.environ.get('API_MAX_RETRIES', 4))
+RETRY_DELAY_SECONDS = float(os.environ.get('API_RETRY_DELAY', 0.5))
+MAX_RETRY_DELAY_SECONDS = 32
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# Per-user request rate, with bursts of up to API_BURST requests
+RATE_PER_SECOND = float(os.environ.get('API_RATE_PER_SECOND', 5))
+BURST = int(os.environ.get('API_BURST', 10))
+MAX_RATE_LIMITERS = 1000
+
+# Token refreshes share a pooled HTTP session, rather than each opening a new connection
+auth_request = Request(requests.Session())
+
+# creds -> {thread -> (token, service)}. Weak keys so entries go away with the session's creds object,
+# and per-thread services because the underlying httplib2 transport isn't thread safe
+_service_cache = weakref.WeakKeyDictionary()
+_service_cache_lock = threading.Lock()
+
+def _build_service(creds):
+    return build_from_document(_discovery_doc, credentials=creds)
+
+def get_service(creds):
+    """
+    Get a Tasks API service for these credentials, reusing a cached one where possible.
+
+    The cached service is rebuilt when the creds' token changes (i.e. they were refreshed).
+    Creds that can't be weakly referenced (e.g. plain dicts) just get a fresh service.
+
+    Args:
+        creds: Google API credentials
+
+    Returns:
+        Google Tasks API service resource
+    """
+    token = getattr(creds, 'token', None)
+    thread = threading.current_thread()
+    try:
+        with _service_cache_lock:
+            services = _service_cache.setdefault(creds, weakref.WeakKeyDictionary())
+            cached = services.get(thread)
+    except TypeError:
+        return _build_service(creds)
+
+    if cached and cached[0] == token:
+        return cached[1]
+
+    service = _build_service(creds)
+    with _service_cache_lock:
+        services[thread] = (token, service)
+    return service
+
+def evict_service(creds):
+    """
+    Drop any cached services for these credentials, e.g. when the session ends.
+
+    Args:
+        creds: Google API credentials
+    """
+    try:
+        with _service_cache_lock:
+            _service_cache.pop(creds, None)
+    except TypeError:
+        pass
+
+class TokenBucket:
+    """Rate limiter allowing bursts of up to capacity requests, refilled at rate per second"""
+    def __init__(self, rate=RATE_PER_SECOND, capacity=BURST, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self.tokens = capacity
+        self.updated = clock()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """Take a token, returning how many seconds to wait before it can be used"""
+        with self._lock:
+            now = self.clock()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+def user_key(creds):
+    """Identifies the user across copies of their creds: by refresh token, since each request may load a new copy"""
+    key = getattr(creds, 'refresh_token', None) or getattr(creds, 'token', None)
+    return key if isinstance(key, str) else None
+
+# One bucket per user
+_rate_limiters = OrderedDict()
+_rate_limiters_lock = threading.Lock()
+
+def _rate_limiter(creds):
+    key = user_key(creds)
+    if key is None:
+        return None
+    with _rate_limiters_lock:
+        bucket = _rate_limiters.get(key)
+        if bucket is None:
+            bucket = _rate_limiters[key] = TokenBucket(RATE_PER_SECOND, BURST)
+            while len(_rate_limiters) > MAX_RATE_LIMITERS:
+                _rate_limiters.popitem(last=False)
+        else:
+            _rate_limiters.move_to_end(key)
+        return bucket
+
+def _retry_after(error):
+    """Seconds the response's Retry-After header asks us to wait, if it has one"""
+    value = error.resp.get('retry-after') if isinstance(error, HttpError) else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+def is_transient_error(error):
+    """Whether an error from an API call is one that may well pass, like rate limiting or a server or network error"""
+    if isinstance(error, HttpError):
+        return error.resp.status in RETRY_STATUSES
+    return isinstance(error, (TransportError, OSError))
+
+def _backoff(attempt):
+    # Full jitter, so clients that failed together don't all retry together
+    return random.uniform(0, min(MAX_RETRY_DELAY_SECONDS, RETRY_DELAY_SECONDS * 2 ** attempt))
+
+_sleep = time.sleep
+
+def execute(request, creds=None):
+    """
+    Execute an API request, waiting for the user's rate limit and retrying failures that may pass.
+
+    Rate limited (429) and server (5xx) errors, and network errors, are retried with jittered
+    exponential backoff, or after the delay in a Retry-After header. A Retry-After longer than the
+    longest backoff is given up on. A 401 refreshes the creds and tries once more.
+
+    Args:
+        request: Unexecuted API request (or batch request)
+        creds: Google API credentials the request was built with
+
+    Returns:
+        The response from the API
+    """
+    bucket = _rate_limiter(creds)
+    refreshed = False
+    attempt = 0
+    while True:
+        if bucket is not None:
+            wait = bucket.reserve()
+            if wait:
+                _sleep(wait)
+        try:
+            return request.execute()
+        except HttpError as error:
+            status = error.resp.status
+            if status == 401 and not refreshed and getattr(creds, 'refresh_token', None):
+                logger.info("Refreshing creds after a 401")
+                creds.refresh(auth_request)
+                refreshed = True
+                continue
+            if not is_transient_error(error) or attempt >= MAX_RETRIES:
+                raise
+            delay = _retry_after(error)
+            if delay is not None and delay > MAX_RETRY_DELAY_SECONDS:
+                # Longer than we'd ever back off for, and not worth holding a request thread for
+                logger.warning("Giving up on request: asked to retry in %.0fs", delay)
+                raise
+        except (TransportError, OSError) as error:
+            if attempt >= MAX_RETRIES:
+                raise
+            delay = None
+        delay = _backoff(attempt) if delay is None else delay
+        attempt += 1
+        logger.info("Retrying request in %.1fs (attempt %d of %d)", delay, attempt, MAX_RETRIES)
+        _sleep(delay)
+
+@timing.timed('api.get_tasklists')
+def get_tasklists(creds):
+    """
+    Retrieve the ids of all of the user's task lists. Google returns the default list first.
+
+    Args:
+        creds: Google API credentials
+
+    Returns:
+        List of task list ids
+    """
+    tasklist_resource = get_service(creds).tasklists()
+    tasklist_ids = []
+    request = tasklist_resource.list(maxResults=100)
+    while request is not None:
+        result = execute(request, creds)
+        tasklist_ids.extend(item['id'] for item in result.get('items', []))
+        request = tasklist_resource.list_next(request, result)
+    return tasklist_ids
+
+@timing.timed('api.get_tasks')
+def get_tasks(creds, tasklist_id=DEFAULT_TASKLIST):
     """
     Retrieve a list of incomplete tasks from Google Tasks API.
     
     Args:
         creds: Google API credentials
+        tasklist_id: ID of the task list to read
         
     Returns:
         Dictionary containing task data
     """
-    return build("tasks", "v1", credentials=creds).tasks().list(
-        tasklist="MDk5NzIwMDMyNTExNzU4MzkzMjI6MDow",
+    return execute(get_service(creds).tasks().list(
+        tasklist=tasklist_id,
         showCompleted=False,
         maxResults=100
-    ).execute()
+    ), creds)
 
-def get_all_tasks(creds):
+@timing.timed('api.get_all_tasks')
+def get_all_tasks(creds, updated_min=None, tasklist_id=DEFAULT_TASKLIST, cached_pages=None):
     """
     Retrieve all incomplete tasks from Google Tasks API with pagination support.
+
+    With updated_min, only tasks changed since then are returned - including completed,
+    deleted and hidden ones, so the caller can drop them from its cached list.
+
+    Given the pages of the caller's last full listing of the list, each page is requested
+    conditionally on the ETag it had then. Pages Google reports unchanged are returned as the
+    given page objects, so callers can reuse anything they worked out from them. Only each cached
+    page's 'etag' and 'nextPageToken' are needed.
     
     Args:
         creds: Google API credentials
+        updated_min: Optional RFC 3339 timestamp to only fetch tasks updated since
+        tasklist_id: ID of the task list to read
+        cached_pages: Optional pages of the last full listing, when updated_min isn't given
         
     Returns:
         List of dictionaries containing task data
     """
-    task_resource = build("tasks", "v1", credentials=creds).tasks()
+    task_resource = get_service(creds).tasks()
     results = []
-    request = task_resource.list(
-        tasklist="MDk5NzIwMDMyNTExNzU4MzkzMjI6MDow",
-        showCompleted=False,
-        maxResults=100
-    )
+    if updated_min:
+        cached_pages = None
+        request = task_resource.list(
+            tasklist=tasklist_id,
+            updatedMin=updated_min,
+            showCompleted=True,
+            showDeleted=True,
+            showHidden=True,
+            maxResults=100
+        )
+    else:
+        request = task_resource.list(
+            tasklist=tasklist_id,
+            showCompleted=False,
+            maxResults=100
+        )
+    unchanged = 0
     while request is not None:
-        result = request.execute() # can throw RefreshError, need to get new creds
+        cached = cached_pages[len(results)] if cached_pages and len(results) < len(cached_pages) else None
+        _set_if_none_match(request, cached and cached.get('etag'))
+        with timing.timer('fetch_page'):
+            try:
+                result = execute(request, creds) # can throw RefreshError, need to get new creds
+            except HttpError as error:
+                if error.resp.status != 304 or cached is None:
+                    raise
+                result = cached
+        if cached is not None and result.get('etag') and result.get('etag') == cached.get('etag'):
+            result = cached
+            unchanged += 1
         results.append(result)
         request = task_resource.list_next(request, result) # this is how google tasks API does pagination
+    if cached_pages:
+        logger.debug("%d of %d pages of list %s unchanged", unchanged, len(results), tasklist_id)
     return results
 
-# TODO error handling
-# TODO move this to TaskList object and do OOP?
-def patch_task(creds, task):
+def _set_if_none_match(request, etag):
+    # Each page's request is a shallow copy of the last, so give it its own headers rather than editing shared ones
+    headers = {name: value for name, value in request.headers.items() if name.lower() != 'if-none-match'}
+    if etag:
+        headers['If-None-Match'] = etag
+    request.headers = headers
+
+# Shared by every reload, so its threads (and the services get_service caches for them) are reused
+_fetch_executor = ThreadPoolExecutor(max_workers=FETCH_WORKERS, thread_name_prefix='fetch')
+
+def get_all_tasklists_tasks(creds, updated_min=None, tasklist_ids=None, cached_listings=None):
+    """
+    Retrieve the tasks of all the user's task lists, fetching the lists concurrently.
+
+    Each list's pages have to be fetched in turn (every page holds the next page's token), but the
+    lists themselves are independent, so they're fetched on a bounded thread pool shared by all
+    requests. Each pool thread keeps its own service and connection from get_service.
+
+    Args:
+        creds: Google API credentials
+        updated_min: Optional RFC 3339 timestamp to only fetch tasks updated since
+        tasklist_ids: IDs of the lists to fetch, or None to fetch all of them
+        cached_listings: Optional dictionary of task list id -> pages of its last full listing, for get_all_tasks
+
+    Returns:
+        Dictionary of task list id -> list of response pages, in task list order
+    """
+    if tasklist_ids is None:
+        tasklist_ids = get_tasklists(creds)
+    cached_listings = cached_listings or {}
+    if len(tasklist_ids) <= 1:
+        return {tasklist_id: get_all_tasks(creds, updated_min, tasklist_id, cached_listings.get(tasklist_id))
+                for tasklist_id in tasklist_ids}
+    fetch = timing.bind(get_all_tasks)
+    futures = [_fetch_executor.submit(fetch, creds, updated_min, tasklist_id, cached_listings.get(tasklist_id))
+               for tasklist_id in tasklist_ids]
+    return {tasklist_id: future.result() for tasklist_id, future in zip(tasklist_ids, futures)}
+
+class Batch:
+    """
+    Collects task mutations and sends them to Google as a single batch HTTP request.
+
+    Use as a context manager (the batch is sent on exit) or call execute() directly. Responses
+    are mapped back to the Task each request was made for, so inserted tasks get their new id.
+    """
+    def __init__(self, creds):
+        self.creds = creds
+        # (response, error) of each request sent by the last execute(), in the order they were added
+        self.results = []
+        self._request = None
+        self._tasks = []
+        self._on_created = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is None:
+            self.execute()
+
+    def __len__(self):
+        return len(self._tasks)
+
+    def add(self, request, task=None):
+        """
+        Queue a request, optionally for a Task that should receive the response's id.
+
+        Args:
+            request: Unexecuted API request
+            task: Task object the request was built for
+        """
+        if self._request is None:
+            self._request = get_service(self.creds).new_batch_http_request(callback=self._on_response)
+        request_id = str(len(self._tasks))
+        self._tasks.append(task)
+        self._request.add(request, request_id=request_id)
+
+    def on_created(self, task, callback):
+        """
+        Have callback(task, task_id) give a task inserted through the batch its new id, once the batch is
+        sent, rather than it just being set on the task. E.g. so a TaskList the task's in can index it.
+        """
+        self._on_created.append((task, callback))
+
+    def _on_response(self, request_id, response, exception):
+        index = int(request_id)
+        self.results[index] = (response, exception)
+        task = self._tasks[index]
+        if exception is None and task is not None and not task.id and response:
+            callback = next((callback for created, callback in self._on_created if created is task), None)
+            if callback is not None:
+                callback(task, response['id'])
+            else:
+                task.id = response['id']
+
+    @timing.timed('api.batch')
+    def execute(self, raise_errors=True):
+        """
+        Send all queued requests in one round trip. A failure of the batch request as a whole
+        (after execute's retries) is always raised.
+
+        Args:
+            raise_errors: Whether to raise the first sub-request error, rather than only leaving it in results
+        """
+        if self._request is None:
+            return
+        request, self._request = self._request, None
+        self.results = [(None, None)] * len(self._tasks)
+        try:
+            execute(request, self.creds)
+        except Exception as error:
+            self.results = [(None, error)] * len(self._tasks)
+            raise
+        finally:
+            self._tasks = []
+            self._on_created = []
+        errors = [error for _, error in self.results if error is not None]
+        if errors and raise_errors:
+            raise errors[0]
+
+def _deferrable(f):
+    """
+    Let a mutation be deferred: given a write-behind queue's Outbox, the call itself is handed
+    over to be made later, instead of a request being built now.
+    """
+    @wraps(f)
+    def wrapper(creds, *args, outbox=None, **kwargs):
+        if outbox is not None:
+            return outbox.defer(f, creds, *args, **kwargs)
+        return f(creds, *args, **kwargs)
+    return wrapper
+
+def _execute(creds, request, batch=None, task=None):
+    """Run a request now, or queue it on the batch if there is one."""
+    if batch is None:
+        return execute(request, creds)
+    batch.add(request, task)
+    return None
+
+@_deferrable
+@timing.timed('api.patch_task')
+def patch_task(creds, task, batch=None):
     """
     Update an existing task in Google Tasks.
     
     Args:
         creds: Google API credentials
         task: Task object to be updated
+        batch: Optional Batch to queue the request on instead of sending it
+        outbox: Optional writeback.Outbox to defer the call to instead
         
     Returns:
-        Updated task data from the API
+        Updated task data from the API, or None if batched or deferred
     """
-    return build("tasks", "v1", credentials=creds).tasks().patch(
-        tasklist="MDk5NzIwMDMyNTExNzU4MzkzMjI6MDow",
+    return _execute(creds, get_service(creds).tasks().patch(
+        tasklist=task.tasklist_id or DEFAULT_TASKLIST,
         task=task.id,
         body=task.to_api_format()
-    ).execute()
+    ), batch)
 
-def insert_task(creds, task):
+@_deferrable
+@timing.timed('api.insert_task')
+def insert_task(creds, task, batch=None):
     """
-    Create a new task in Google Tasks.
+    Create a new task in Google Tasks, nested under its parent if it has one.
     
     Args:
         creds: Google API credentials
         task: Task object to be created
+        batch: Optional Batch to queue the request on instead of sending it
+        outbox: Optional writeback.Outbox to defer the call to instead
         
     Returns:
-        Newly created task data from the API
+        Newly created task data from the API, or None if batched (task.id is set when the batch runs) or deferred
     """
-    return build("tasks", "v1", credentials=creds).tasks().insert(
-        tasklist="MDk5NzIwMDMyNTExNzU4MzkzMjI6MDow",
+    return _execute(creds, get_service(creds).tasks().insert(
+        tasklist=task.tasklist_id or DEFAULT_TASKLIST,
+        parent=task.parent_id or None,
         body=task.to_api_format()
-    ).execute()
+    ), batch, task)
 
-def move_task(creds, task_id, parent_id, previous_id=None):
+@_deferrable
+@timing.timed('api.move_task')
+def move_task(creds, task_id, parent_id, previous_id=None, batch=None, tasklist_id=DEFAULT_TASKLIST):
     """
     Move a task to a different position in the task hierarchy.
     
@@ -89,31 +507,36 @@ def move_task(creds, task_id, parent_id, previous_id=None):
         task_id: ID of the task to move
         parent_id: ID of the new parent task
         previous_id: ID of the task that should come before this one
+        batch: Optional Batch to queue the request on instead of sending it
+        outbox: Optional writeback.Outbox to defer the call to instead
+        tasklist_id: ID of the task list the task is in
         
     Returns:
-        Updated task data from the API
+        Updated task data from the API, or None if batched or deferred
     """
-    service = build("tasks", "v1", credentials=creds)
-    result = service.tasks().move(
-        tasklist="MDk5NzIwMDMyNTExNzU4MzkzMjI6MDow",
+    return _execute(creds, get_service(creds).tasks().move(
+        tasklist=tasklist_id,
         task=task_id,
         parent=parent_id,
         previous=previous_id
-    ).execute()
-    return result
+    ), batch)
 
-def delete_task(creds, task):
+@_deferrable
+@timing.timed('api.delete_task')
+def delete_task(creds, task, batch=None):
     """
     Delete a task from Google Tasks.
     
     Args:
         creds: Google API credentials
         task: Task object to be deleted
+        batch: Optional Batch to queue the request on instead of sending it
+        outbox: Optional writeback.Outbox to defer the call to instead
         
     Returns:
-        Response from the API
+        Response from the API, or None if batched or deferred
     """
-    return build("tasks", "v1", credentials=creds).tasks().patch(
-        tasklist="MDk5NzIwMDMyNTExNzU4MzkzMjI6MDow",
+    return _execute(creds, get_service(creds).tasks().patch(
+        tasklist=task.tasklist_id or DEFAULT_TASKLIST,
         task=task.id
-    ).execute()
\ No newline at end of file
+    ), batch)
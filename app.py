@@ -1,61 +1,99 @@
 """Flask application for managing todo tasks."""
 import os
 
-from flask import Flask, render_template, request, redirect
-from sort import get_sorted_tasks
+from flask import Flask, render_template, request, redirect, abort
+from sort import get_top_tasks
 from task import Task
 from filter_args import FilterArgs
 from auth import get_session_creds, auth_bp
+import api
 import tasklist
+import fragments
 import summary
-from filter import filter_tasks
-from session import get_user_data, set_user_data, require_auth
+import timing
+import session
+from writeback import Outbox, write_queue
+from filter import iter_filtered_tasks
+from session import get_session_id, get_user_data, set_user_data, require_auth
 from markupsafe import Markup
-from reorder import reposition_updated_task
 
 app = Flask(__name__)
 app.secret_key = os.environ.get('SECRET_KEY', 'dev-secret-key-change-in-production')
 app.register_blueprint(auth_bp)
+timing.init_app(app)
+session.init_app(app)
+
+def get_tasks(creds=None):
+    """
+    The session's TaskList, holding the given creds, with the real ids of any tasks created since it was saved.
+
+    Returns:
+        Tuple of the TaskList and whether it changed from the stored one
+    """
+    tasks = get_user_data('tasks', [])
+    converted = not isinstance(tasks, tasklist.TaskList)
+    if converted:
+        # Sessions stored before TaskList existed hold a plain list
+        tasks = tasklist.TaskList(tasks)
+    tasks.creds = creds
+    return tasks, write_queue.resolve_ids(tasks, get_session_id()) or converted
 
 @app.route('/')
 @require_auth
 def index():
     """Render the main page with filtered and sorted tasks."""
-    tasks = get_user_data('tasks', [])
+    tasks, changed = get_tasks()
+    if changed:
+        set_user_data('tasks', tasks)
     summary_stats = summary.get_stats(tasks)
 
     filter_args = FilterArgs(request.args)
-    filtered_tasks = filter_tasks(tasks, filter_args)
-    sorted_tasks = get_sorted_tasks(filtered_tasks)
+    # Stream the filtered tasks straight into a top-N selection rather than sorting them all
+    filtered_tasks = iter_filtered_tasks(tasks, filter_args)
+    display_tasks = get_top_tasks(filtered_tasks, filter_args.count)
 
-    for task in sorted_tasks:
-        task.children = [{}]
-        for potential_child in tasks:
-            if potential_child.parent_id == task.id:
-                task.children.append(potential_child)
+    # Only look up children for the tasks we're actually rendering. The empty dict is the blank 'new subtask' form
+    for task in display_tasks:
+        task.children = [{}] + tasks.children_of(task.id)
 
-    tasks_to_show = filter_args.count
-    display_tasks = [Task()] + sorted_tasks[:tasks_to_show]
+    display_tasks = [Task()] + display_tasks
 
-    return render_template(
-        'index.html',
-        tasks=display_tasks,
-        stats=summary_stats,
-        filter_args=filter_args
-    )
+    with timing.timer('render_template'):
+        return render_template(
+            'index.html',
+            tasks=display_tasks,
+            stats=summary_stats,
+            filter_args=filter_args,
+            pending_writes=write_queue.pending(get_session_id()),
+            write_failures=write_queue.pop_failures(get_session_id())
+        )
+
+def _save_task(tasks, task, batch=None, outbox=None):
+    tasks.upsert(task, batch, outbox)
+
+    if not task.parent_id and not task.completed:
+        # TODO this isn't working as expected on the google list, need to debug
+        tasks.reposition(task, batch, outbox)
 
 @app.route('/update', methods=['POST'])
 @require_auth
 def update_task():
     """Update a task based on form submission."""
-    creds = get_session_creds(get_user_data('creds'))
-    tasks = get_user_data('tasks', [])
+    tasks, _ = get_tasks(get_session_creds(get_user_data('creds')))
     task = Task.from_form_submission(request.form)
-    tasklist.upsert_task(creds, tasks, task)
-    
-    if not task.parent_id and not task.completed:
-        # TODO this isn't working as expected on the google list, need to debug
-        reposition_updated_task(creds, tasks, task)
+    # The form may be for a task created before its insert went through
+    task.id = write_queue.resolve_id(task.id)
+    task.parent_id = write_queue.resolve_id(task.parent_id)
+
+    if session.session_store.shared:
+        # The write-behind queue, and the temporary ids it gives new tasks, only live in this process,
+        # so when other processes share the sessions the changes are sent to Google straight away, in one batch
+        with api.Batch(tasks.creds) as batch:
+            _save_task(tasks, task, batch=batch)
+    else:
+        # Update the local list now, and leave sending the changes to Google to the write-behind queue
+        with Outbox(tasks.creds, get_session_id()) as outbox:
+            _save_task(tasks, task, outbox=outbox)
 
     set_user_data('tasks', tasks)
 
@@ -66,15 +104,31 @@ def update_task():
 def reload_tasks():
     """Reload tasks from the API."""
     creds = get_session_creds(get_user_data('creds'))
-    tasks = tasklist.from_api(creds)
+    tasks = get_user_data('tasks')
+    if tasks:
+        write_queue.resolve_ids(tasks, get_session_id())
+    with timing.collect() as timings:
+        tasks, synced_at = tasklist.sync(creds, tasks, get_user_data('synced_at'))
     set_user_data('tasks', tasks)
+    set_user_data('synced_at', synced_at)
+    if timings is not None:
+        set_user_data('reload_timings', timings)
     return redirect('/')
 
+@app.route('/debug/timings')
+@require_auth
+def debug_timings():
+    """Per-stage timings of this session's last reload. Only available when timing is enabled."""
+    if not timing.enabled:
+        abort(404)
+    timings = get_user_data('reload_timings', [])
+    return {'reload': [{'stage': stage, 'ms': round(seconds * 1000, 2)} for stage, seconds in timings]}
+
 @app.context_processor
 def add_to_context__render_template():
     def render_template_safe(template_name, **kwargs):
         return Markup(render_template(template_name, **kwargs))
-    return dict(template=render_template_safe)
+    return dict(template=render_template_safe, task_card=fragments.task_card, child_task=fragments.child_task)
 
 if __name__ == '__main__':
     app.run(debug=True, port=5001, ssl_context='adhoc')
@@ -1,21 +1,120 @@
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+import logging
+import threading
+import time
+
 from flask import Blueprint, redirect, session, request
 from session import get_user_data, set_user_data, clear_user_data
 import api
 import tasklist
-from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import Flow
 from google.auth.exceptions import RefreshError
 
+logger = logging.getLogger(__name__)
+
 # If modifying these scopes, delete the file token.json.
 SCOPES = ["https://www.googleapis.com/auth/tasks"]
 
 # Temporary storage for OAuth flows (in production, use Redis or similar)
 _oauth_flows = {}
 
+# Tokens are renewed this long before they expire, checking every REFRESH_INTERVAL_SECONDS.
+# Creds unused for CREDS_IDLE_SECONDS stop being kept fresh and are dropped
+REFRESH_MARGIN = timedelta(minutes=5)
+REFRESH_INTERVAL_SECONDS = 60
+CREDS_IDLE_SECONDS = 60 * 60
+MAX_CACHED_CREDS = 1000
+
+class CredsCache:
+    """
+    Credentials objects kept per user (by refresh token), so requests reuse one object instead of
+    rebuilding it each time. A background thread refreshes the cached creds shortly before their
+    tokens expire, so requests don't have to wait on a refresh.
+    """
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self._creds = OrderedDict()
+        self._lock = threading.Lock()
+        self._refresher = None
+
+    def get(self, refresh_token):
+        """The cached creds for this refresh token, if any"""
+        if not isinstance(refresh_token, str):
+            return None
+        with self._lock:
+            entry = self._creds.get(refresh_token)
+            if entry is None:
+                return None
+            entry[1] = self.clock()
+            self._creds.move_to_end(refresh_token)
+            return entry[0]
+
+    def put(self, creds):
+        """Cache these creds and keep them fresh"""
+        refresh_token = getattr(creds, 'refresh_token', None)
+        if not isinstance(refresh_token, str):
+            return
+        with self._lock:
+            self._creds[refresh_token] = [creds, self.clock()]
+            self._creds.move_to_end(refresh_token)
+            while len(self._creds) > MAX_CACHED_CREDS:
+                self._creds.popitem(last=False)
+            if self._refresher is None or not self._refresher.is_alive():
+                self._refresher = threading.Thread(target=self._run, name='creds-refresher', daemon=True)
+                self._refresher.start()
+
+    def evict(self, creds):
+        refresh_token = creds.get('refresh_token') if isinstance(creds, dict) else getattr(creds, 'refresh_token', None)
+        with self._lock:
+            self._creds.pop(refresh_token, None)
+
+    def clear(self):
+        with self._lock:
+            self._creds.clear()
+
+    def refresh_due(self):
+        """Refresh the cached creds expiring within REFRESH_MARGIN, and drop idle ones. Returns how many were refreshed."""
+        now = self.clock()
+        # Credentials.expiry is naive UTC
+        refresh_before = datetime.now(timezone.utc).replace(tzinfo=None) + REFRESH_MARGIN
+        with self._lock:
+            for refresh_token, (creds, last_used) in list(self._creds.items()):
+                if now - last_used > CREDS_IDLE_SECONDS:
+                    del self._creds[refresh_token]
+            due = [(refresh_token, creds) for refresh_token, (creds, _) in self._creds.items()
+                   if creds.expiry is None or creds.expiry <= refresh_before]
+        refreshed = 0
+        for refresh_token, creds in due:
+            try:
+                creds.refresh(api.auth_request)
+                refreshed += 1
+            except RefreshError:
+                # The refresh token is no good any more; the user will have to sign in again
+                logger.info("Dropping creds that can no longer be refreshed")
+                self.evict(creds)
+            except Exception:
+                # Probably a network problem, so leave them to try again next time
+                logger.warning("Couldn't refresh creds", exc_info=True)
+        return refreshed
+
+    def _run(self):
+        while True:
+            time.sleep(REFRESH_INTERVAL_SECONDS)
+            self.refresh_due()
+
+creds_cache = CredsCache()
+
 def get_session_creds(existing_creds=None):
     """Gets credentials for session-based authentication (no file storage)."""
     creds = existing_creds
+
+    # Reuse the cached creds for this user, which the refresher keeps up to date
+    refresh_token = existing_creds.get('refresh_token') if isinstance(existing_creds, dict) else getattr(existing_creds, 'refresh_token', None)
+    cached = creds_cache.get(refresh_token)
+    if cached is not None and cached.valid:
+        return cached
     
     # If existing_creds is a dict (from session), convert to Credentials object
     if isinstance(existing_creds, dict):
@@ -29,7 +128,7 @@ def get_session_creds(existing_creds=None):
         # If we can, just use the refresh token to get new creds
         if creds and creds.expired and creds.refresh_token:
             try:
-                creds.refresh(Request())
+                creds.refresh(api.auth_request)
                 should_reauth = False
             except RefreshError:
                 # If there was a problem with the refresh token (e.g. it expired) we'll have to just get new creds
@@ -51,6 +150,7 @@ def get_session_creds(existing_creds=None):
             # Return auth_url and state so the caller can redirect the user
             return {"auth_url": auth_url, "state": state}
 
+    creds_cache.put(creds)
     return creds
 
 def complete_oauth_flow(state, authorization_response):
@@ -60,8 +160,17 @@ def complete_oauth_flow(state, authorization_response):
     
     flow = _oauth_flows.pop(state)  # Remove from storage after use
     flow.fetch_token(authorization_response=authorization_response)
+    creds_cache.put(flow.credentials)
     return flow.credentials
 
+def end_session():
+    """Clear the user's session data along with any creds, API services and task listings cached for them."""
+    creds = get_user_data('creds')
+    creds_cache.evict(creds)
+    api.evict_service(creds)
+    tasklist.evict_listings(creds)
+    clear_user_data()
+
 auth_bp = Blueprint('auth', __name__)
 
 @auth_bp.route('/auth')
@@ -76,11 +185,15 @@ def auth():
         
         creds = result
         set_user_data('creds', creds)
-        tasks = tasklist.from_api(creds)
+        tasks, synced_at = tasklist.sync(creds)
         set_user_data('tasks', tasks)
+        set_user_data('synced_at', synced_at)
         return redirect('/')
     except Exception as e:
-        clear_user_data()
+        if api.is_transient_error(e):
+            # Google is struggling even after retries, but the creds are fine, so don't log the user out
+            return f"Couldn't reach Google Tasks, please try again: {str(e)}", 503
+        end_session()
         return f"Authentication failed: {str(e)}", 500
 
 @auth_bp.route('/oauth/callback')
@@ -98,13 +211,17 @@ def oauth_callback():
         creds = complete_oauth_flow(stored_state, authorization_response)
         
         set_user_data('creds', creds)
-        tasks = tasklist.from_api(creds)
+        tasks, synced_at = tasklist.sync(creds)
         set_user_data('tasks', tasks)
+        set_user_data('synced_at', synced_at)
         
         session.pop('oauth_state', None)
         
         return redirect('/')
     except Exception as e:
-        clear_user_data()
         session.pop('oauth_state', None)
+        if api.is_transient_error(e):
+            # The new creds are saved, so trying again from /auth won't need another sign in
+            return f"Couldn't reach Google Tasks, please try again: {str(e)}", 503
+        end_session()
         return f"OAuth callback failed: {str(e)}", 500
\ No newline at end of file
@@ -0,0 +1,273 @@
+"""
+In-process stand-in for the Google Tasks v1 API, for benchmarks.
+
+FakeTasksBackend answers HTTP requests the way httplib2 would, so the real discovery-built
+service (and everything in api.py on top of it) runs unchanged against it:
+
+    backend = FakeTasksBackend(latency=0.02)
+    backend.load(synthetic.generate_tasklists(1000))
+    with backend.installed():
+        tasks = tasklist.from_api(FakeCreds())
+
+It serves tasklists.list and tasks list/insert/patch/move/delete with pagination, position
+ordering of siblings, updatedMin/showCompleted/showDeleted/showHidden filtering and page
+etags (answering If-None-Match with 304). Like Google, tasks are listed by last update rather
+than position. Every request can be slowed
+down by a fixed latency, and fail at random (error_rate) or on demand (fail_next).
+Batch requests aren't supported.
+"""
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from urllib.parse import urlsplit, parse_qs, unquote
+import hashlib
+import json
+import random
+import threading
+import time
+
+import httplib2
+from googleapiclient.discovery import build_from_document
+
+import api
+import tasklist
+
+# Logical clock for 'updated' timestamps, so runs with the same data and calls are identical
+EPOCH = datetime(2025, 1, 1, tzinfo=timezone.utc)
+
+DEFAULT_MAX_RESULTS = 20
+MAX_RESULTS = 100
+
+class FakeCreds:
+    """Credentials to build services with. Never expire, and can be cached like real ones"""
+    token = 'fake-token'
+    refresh_token = None
+    valid = True
+
+def _timestamp(when):
+    return when.strftime('%Y-%m-%dT%H:%M:%S.') + f'{when.microsecond // 1000:03d}Z'
+
+class FakeTasksBackend:
+    """
+    The data and HTTP handling of the fake API. Thread safe, since lists are fetched concurrently.
+
+    Args:
+        latency: Seconds each request takes
+        error_rate: Chance of each request failing with error_status
+        error_status: HTTP status of the random failures
+        seed: Seed for the random failures and generated ids
+    """
+    def __init__(self, latency=0.0, error_rate=0.0, error_status=503, seed=0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._tick = 0
+        self._failures = []
+        self.tasklists = {} # tasklist id -> title
+        self.tasks = {} # tasklist id -> {task id -> item}
+        self._siblings = {} # (tasklist id, parent id or None) -> [task ids in position order]
+        self.request_counts = {}
+        self._listings = {}
+
+    # Data
+
+    def _now(self):
+        self._tick += 1
+        return _timestamp(EPOCH + timedelta(milliseconds=self._tick))
+
+    def add_tasklist(self, tasklist_id, title=None):
+        with self._lock:
+            self.tasklists.setdefault(tasklist_id, title or tasklist_id)
+            self.tasks.setdefault(tasklist_id, {})
+
+    def load(self, items_by_tasklist):
+        """
+        Add task items, given as {tasklist id: [item dicts]}. Each list's items are taken to be in
+        position order, with subtasks referring to their parent by 'parent' id.
+        """
+        for tasklist_id, items in items_by_tasklist.items():
+            self.add_tasklist(tasklist_id)
+            with self._lock:
+                for item in items:
+                    item = dict(item, kind='tasks#task', updated=self._now())
+                    self.tasks[tasklist_id][item['id']] = item
+                    self._siblings.setdefault((tasklist_id, item.get('parent')), []).append(item['id'])
+
+    def _position(self, tasklist_id, item):
+        return f"{self._siblings[(tasklist_id, item.get('parent'))].index(item['id']):020d}"
+
+    def _positions(self, tasklist_id):
+        """Position strings of all of a list's tasks, worked out in one go for listing"""
+        return {task_id: f'{index:020d}'
+                for (siblings_tasklist_id, _), siblings in self._siblings.items() if siblings_tasklist_id == tasklist_id
+                for index, task_id in enumerate(siblings)}
+
+    def _place(self, tasklist_id, task_id, parent, previous):
+        """Put the task under parent, right after previous (or first if there's no previous)"""
+        siblings = self._siblings.setdefault((tasklist_id, parent), [])
+        index = siblings.index(previous) + 1 if previous in siblings else 0
+        siblings.insert(index, task_id)
+
+    def _unplace(self, tasklist_id, item):
+        self._siblings[(tasklist_id, item.get('parent'))].remove(item['id'])
+
+    def _visible(self, item, params):
+        if item.get('deleted') and params.get('showDeleted') != 'true':
+            return False
+        if item.get('hidden') and params.get('showHidden') != 'true':
+            return False
+        if item.get('status') == 'completed' and params.get('showCompleted') == 'false':
+            return False
+        updated_min = params.get('updatedMin')
+        return not updated_min or item['updated'] >= updated_min
+
+    # Failures
+
+    def fail_next(self, status, count=1, retry_after=None):
+        """Make the next count requests fail with this status, optionally asking for a Retry-After delay"""
+        with self._lock:
+            self._failures.extend([(status, retry_after)] * count)
+
+    def _failure(self):
+        with self._lock:
+            if self._failures:
+                return self._failures.pop(0)
+            if self.error_rate and self._random.random() < self.error_rate:
+                return (self.error_status, None)
+        return None
+
+    # HTTP
+
+    def request(self, uri, method='GET', body=None, headers=None, redirections=1, connection_type=None):
+        """httplib2.Http.request, answered from the fake data"""
+        if self.latency:
+            time.sleep(self.latency)
+        failure = self._failure()
+        if failure is not None:
+            status, retry_after = failure
+            extra = {'retry-after': str(retry_after)} if retry_after is not None else {}
+            return self._respond(status, {'error': {'code': status, 'message': 'Injected failure'}}, extra)
+
+        url = urlsplit(uri)
+        path = [unquote(part) for part in url.path.split('/') if part]
+        params = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        data = json.loads(body) if body else {}
+        with self._lock:
+            status, result, name = self._route(method, path, params, data)
+            self.request_counts[name] = self.request_counts.get(name, 0) + 1
+            if_none_match = next((value for header, value in (headers or {}).items() if header.lower() == 'if-none-match'), None)
+            if status == 200 and if_none_match and isinstance(result, dict) and result.get('etag') == if_none_match:
+                self.request_counts['not_modified'] = self.request_counts.get('not_modified', 0) + 1
+                return self._respond(304, None)
+        return self._respond(status, result)
+
+    def _respond(self, status, result, headers=None):
+        response = httplib2.Response({'status': str(status), 'content-type': 'application/json', **(headers or {})})
+        return response, b'' if result is None else json.dumps(result).encode()
+
+    def _route(self, method, path, params, data):
+        # tasks/v1/users/@me/lists
+        if path[2:4] == ['users', '@me'] and len(path) == 5 and method == 'GET':
+            return self._list_tasklists(params)
+        # tasks/v1/lists/{tasklist}/tasks[/{task}[/move]]
+        if len(path) >= 5 and path[2] == 'lists' and path[4] == 'tasks':
+            tasklist_id = path[3]
+            if tasklist_id == '@default' and self.tasklists:
+                tasklist_id = next(iter(self.tasklists))
+            if tasklist_id not in self.tasks:
+                return 404, {'error': {'code': 404, 'message': 'Task list not found'}}, 'not_found'
+            if len(path) == 5:
+                if method == 'GET':
+                    return self._list_tasks(tasklist_id, params)
+                if method == 'POST':
+                    return self._insert(tasklist_id, params, data)
+            task = self.tasks[tasklist_id].get(path[5])
+            if task is None:
+                return 404, {'error': {'code': 404, 'message': 'Task not found'}}, 'not_found'
+            if len(path) == 7 and path[6] == 'move' and method == 'POST':
+                return self._move(tasklist_id, task, params)
+            if len(path) == 6 and method == 'PATCH':
+                return self._patch(tasklist_id, task, data)
+            if len(path) == 6 and method == 'DELETE':
+                return self._delete(task)
+        return 501, {'error': {'code': 501, 'message': f'{method} {"/".join(path)} not supported'}}, 'unsupported'
+
+    def _page(self, items, params, etags=None):
+        max_results = min(int(params.get('maxResults', DEFAULT_MAX_RESULTS)), MAX_RESULTS)
+        start = int(params.get('pageToken', 0))
+        page = {'items': items[start:start + max_results]}
+        if start + max_results < len(items):
+            page['nextPageToken'] = str(start + max_results)
+        if etags is not None:
+            # A page's etag only changes with its content
+            etag = etags.get((start, max_results))
+            if etag is None:
+                etag = etags[(start, max_results)] = '"' + hashlib.md5(json.dumps(page, sort_keys=True).encode()).hexdigest() + '"'
+            page['etag'] = etag
+        return page
+
+    def _list_tasklists(self, params):
+        items = [{'kind': 'tasks#taskList', 'id': tasklist_id, 'title': title} for tasklist_id, title in self.tasklists.items()]
+        return 200, dict(self._page(items, params), kind='tasks#taskLists'), 'tasklists.list'
+
+    def _list_tasks(self, tasklist_id, params):
+        # Each page of a listing would otherwise redo the whole listing, so it's kept until the data changes
+        key = (self._tick, tuple(sorted((name, value) for name, value in params.items() if name not in ('pageToken', 'maxResults'))))
+        listing = self._listings.get(tasklist_id)
+        if listing is None or listing[0] != key:
+            items = [item for item in self.tasks[tasklist_id].values() if self._visible(item, params)]
+            # Google doesn't list tasks in position order
+            items.sort(key=lambda item: (item['updated'], item['id']), reverse=True)
+            positions = self._positions(tasklist_id)
+            listing = self._listings[tasklist_id] = (key, [dict(item, position=positions[item['id']]) for item in items], {})
+        return 200, dict(self._page(listing[1], params, listing[2]), kind='tasks#tasks'), 'tasks.list'
+
+    def _insert(self, tasklist_id, params, data):
+        task_id = f'fake{self._random.getrandbits(48):012x}'
+        item = dict(data, kind='tasks#task', id=task_id, updated=self._now(), status=data.get('status', 'needsAction'))
+        if params.get('parent'):
+            item['parent'] = params['parent']
+        self.tasks[tasklist_id][task_id] = item
+        self._place(tasklist_id, task_id, item.get('parent'), params.get('previous'))
+        return 200, dict(item, position=self._position(tasklist_id, item)), 'tasks.insert'
+
+    def _patch(self, tasklist_id, task, data):
+        task.update({key: value for key, value in data.items() if key not in ('id', 'parent', 'position')})
+        task['updated'] = self._now()
+        return 200, dict(task, position=self._position(tasklist_id, task)), 'tasks.patch'
+
+    def _move(self, tasklist_id, task, params):
+        self._unplace(tasklist_id, task)
+        parent = params.get('parent') or None
+        if parent:
+            task['parent'] = parent
+        else:
+            task.pop('parent', None)
+        self._place(tasklist_id, task['id'], parent, params.get('previous'))
+        task['updated'] = self._now()
+        return 200, dict(task, position=self._position(tasklist_id, task)), 'tasks.move'
+
+    def _delete(self, task):
+        task['deleted'] = True
+        task['updated'] = self._now()
+        return 204, None, 'tasks.delete'
+
+    @contextmanager
+    def installed(self, rate_limited=False):
+        """
+        Point api.py at this backend instead of Google for the duration of the block.
+        There's no quota to protect, so api.py's rate limit is lifted unless rate_limited.
+        """
+        build_service, rate_limiter = api._build_service, api._rate_limiter
+        api._build_service = lambda creds: build_from_document(api._discovery_doc, http=self)
+        if not rate_limited:
+            api._rate_limiter = lambda creds: None
+        api._service_cache.clear()
+        tasklist._listings.clear()
+        try:
+            yield self
+        finally:
+            api._build_service, api._rate_limiter = build_service, rate_limiter
+            api._service_cache.clear()
+            tasklist._listings.clear()
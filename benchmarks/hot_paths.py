@@ -0,0 +1,193 @@
+"""
+Timing and memory report for the hot paths, over synthetic task lists of growing size served
+by the fake Tasks API. The data is seeded, so reports from different commits are comparable:
+
+    python -m benchmarks.hot_paths --json before.json
+    python -m benchmarks.hot_paths --baseline before.json   # exits 1 on any regression
+
+Times are the best (and median) of --repeat runs. Memory is the peak traced while loading
+the list with tasklist.from_api, and what the loaded list (and the caches of it) keep.
+"""
+from datetime import date
+from statistics import median
+import argparse
+import copy
+import gc
+import json
+import platform
+import sys
+import time
+import tracemalloc
+
+from benchmarks.fake_tasks_api import FakeTasksBackend, FakeCreds
+from benchmarks.synthetic import generate_tasklists
+
+import api
+import filter
+import reorder
+import sort
+import summary
+import tasklist
+from filter_args import FilterArgs
+
+SIZES = (100, 1000, 10000, 100000)
+
+def best_of(run, repeat):
+    """Seconds taken by each of repeat calls of run, with the garbage collector paused like timeit does"""
+    times = []
+    for _ in range(repeat):
+        gc.collect()
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            run()
+            times.append(time.perf_counter() - start)
+        finally:
+            gc.enable()
+    return times
+
+def index_page(tasks, creds):
+    """Render / for a session holding these tasks, returning a function that requests it again"""
+    import app
+    import session
+    app.app.config['TESTING'] = True
+    client = app.app.test_client()
+    with client.session_transaction() as sess:
+        sess['session_id'] = 'benchmark'
+    session.session_store.save('benchmark', {'creds': creds, 'tasks': tasks})
+
+    def get():
+        response = client.get('/?count=25')
+        assert response.status_code == 200, response.status_code
+    return get
+
+def bench_size(size, repeat, latency, error_rate, seed, rate_limited=False):
+    backend = FakeTasksBackend(latency=latency, error_rate=error_rate, seed=seed)
+    backend.load(generate_tasklists(size, seed=seed))
+    creds = FakeCreds()
+    results = {}
+    with backend.installed(rate_limited):
+        def cold_load():
+            tasklist._listings.clear()
+            return tasklist.from_api(creds)
+        results['tasklist.from_api'] = best_of(cold_load, repeat)
+        # Again, with every page unchanged since the last load
+        tasks = tasklist.from_api(creds)
+        results['tasklist.from_api (unchanged)'] = best_of(lambda: tasklist.from_api(creds), repeat)
+
+        default_filter = FilterArgs({})
+        search_filter = FilterArgs({'search': 'invoice', 'show_future': 'on'})
+        results['filter.filter_tasks'] = best_of(lambda: filter.filter_tasks(tasks, default_filter), repeat)
+        results['filter.filter_tasks (search)'] = best_of(lambda: filter.filter_tasks(tasks, search_filter), repeat)
+        results['sort.get_sorted_tasks'] = best_of(lambda: sort.get_sorted_tasks(tasks), repeat)
+        results['sort.get_top_tasks'] = best_of(
+            lambda: sort.get_top_tasks(filter.iter_filtered_tasks(tasks, default_filter), 25), repeat)
+
+        # Move the middle task each time, so every run has a fresh list version to bisect. It's a copy,
+        # like an edited task would be, since the tasks from the API are shared with later loads
+        moving = copy.copy(tasks[len(tasks) // 2])
+        tasks[len(tasks) // 2] = moving
+        def reposition():
+            moving.priority = (moving.priority + 1) % 4
+            reorder.reposition_updated_task(creds, tasks, moving)
+        results['reorder.reposition_updated_task'] = best_of(reposition, repeat)
+
+        plain = list(tasks)
+        results['summary.get_stats'] = best_of(lambda: summary.get_stats(plain), repeat)
+        results['summary.get_stats (cached)'] = best_of(lambda: summary.get_stats(tasks), repeat)
+
+        results['app.index'] = best_of(index_page(tasks, creds), repeat)
+
+        # Load once untraced, so the backend's cached listing isn't counted as the task list's
+        del tasks, plain, moving
+        tasklist.from_api(creds)
+        tasklist._listings.clear()
+        gc.collect()
+        tracemalloc.start()
+        loaded = tasklist.from_api(creds)
+        retained, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del loaded
+
+    report = [{'benchmark': name, 'size': size, 'best_ms': min(times) * 1000, 'median_ms': median(times) * 1000}
+              for name, times in results.items()]
+    report.append({'benchmark': 'tasklist.from_api memory', 'size': size, 'peak_kb': peak / 1024, 'retained_kb': retained / 1024})
+    return report, dict(backend.request_counts)
+
+def run(sizes=SIZES, repeat=5, latency=0.0, error_rate=0.0, seed=0, rate_limited=False):
+    results = []
+    requests = {}
+    for size in sizes:
+        report, counts = bench_size(size, repeat, latency, error_rate, seed, rate_limited)
+        results.extend(report)
+        requests[size] = counts
+    return {
+        'meta': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'date': date.today().isoformat(),
+            'sizes': list(sizes),
+            'repeat': repeat,
+            'latency': latency,
+            'error_rate': error_rate,
+            'seed': seed,
+            'rate_limited': rate_limited,
+            'requests': requests,
+        },
+        'results': results,
+    }
+
+def print_report(report, out=sys.stdout):
+    meta = report['meta']
+    print(f"python {meta['python']}, seed {meta['seed']}, best of {meta['repeat']}, "
+          f"{meta['latency'] * 1000:.0f}ms latency, {meta['error_rate']:.0%} errors", file=out)
+    print(f"{'benchmark':<36}{'tasks':>8}{'best ms':>12}{'median ms':>12}", file=out)
+    for result in report['results']:
+        if 'best_ms' in result:
+            print(f"{result['benchmark']:<36}{result['size']:>8}{result['best_ms']:>12.3f}{result['median_ms']:>12.3f}", file=out)
+        else:
+            print(f"{result['benchmark']:<36}{result['size']:>8}{'peak':>12}{result['peak_kb']:>9.0f} KB"
+                  f"  retained {result['retained_kb']:.0f} KB", file=out)
+
+def regressions(report, baseline, threshold):
+    """Results more than threshold (a fraction) slower or bigger than the same result in the baseline"""
+    previous = {(result['benchmark'], result['size']): result for result in baseline['results']}
+    found = []
+    for result in report['results']:
+        before = previous.get((result['benchmark'], result['size']))
+        if before is None:
+            continue
+        for measure in ('best_ms', 'peak_kb', 'retained_kb'):
+            if measure in result and before.get(measure) and result[measure] > before[measure] * (1 + threshold):
+                found.append(f"{result['benchmark']} ({result['size']} tasks): {measure} "
+                             f"{before[measure]:.3f} -> {result[measure]:.3f} (+{result[measure] / before[measure] - 1:.0%})")
+    return found
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds per fake API request')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='chance of each fake API request failing')
+    parser.add_argument('--rate-limit', action='store_true', help="keep api.py's per-user rate limit")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help='write the report to this file')
+    parser.add_argument('--baseline', help='report to compare against')
+    parser.add_argument('--threshold', type=float, default=0.2, help='slowdown counted as a regression')
+    args = parser.parse_args(argv)
+
+    report = run(args.sizes, args.repeat, args.latency, args.error_rate, args.seed, args.rate_limit)
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w') as out:
+            json.dump(report, out, indent=1)
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            found = regressions(report, json.load(baseline_file), args.threshold)
+        for regression in found:
+            print(f"REGRESSION {regression}")
+        return 1 if found else 0
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
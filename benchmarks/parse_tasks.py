@@ -0,0 +1,73 @@
+"""
+Micro-benchmark for Task.from_api_response on a page-sized batch of API items,
+compared against the previous multi-pass, strptime based parser.
+
+    python -m benchmarks.parse_tasks [item count]
+"""
+import sys
+import timeit
+from datetime import datetime
+
+from task import Task
+
+def make_item(i):
+    notes = [f'Description line for task {i}', 'Second line of notes']
+    notes.append(f'#P:{i % 4}')
+    if i % 3 == 0:
+        notes.append(f'#D:2025-{i % 12 + 1:02d}-{i % 28 + 1:02d}')
+    if i % 4 == 0:
+        notes.append(f'#S:2025-{i % 12 + 1:02d}-{i % 28 + 1:02d}')
+    if i % 10 == 0:
+        notes.append('#RS:* * * 7 C')
+    return {
+        'id': f'id{i:08d}',
+        'title': f'Task {i}',
+        'notes': '\n'.join(notes),
+        'status': 'needsAction',
+        'due': '2025-03-04T00:00:00.000Z' if i % 5 == 0 else '',
+    }
+
+def legacy_from_api_response(response_data):
+    """The parser from_api_response replaced, kept here as the baseline"""
+    task = Task()
+    task.id = response_data.get('id', '')
+    task.title = response_data.get('title', '')
+    task.notes = response_data.get('notes', '')
+    task.completed = response_data.get('completed', '')
+    task.status = response_data.get('status', '')
+    task.parent_id = response_data.get('parent', '')
+    desc_fields = [line.strip() for line in task.notes.splitlines() if line.strip().startswith('#')]
+    for field in desc_fields:
+        try:
+            if field.startswith('#P:'):
+                task.priority = int(field[3:].strip())
+            elif field.startswith('#D:'):
+                task.due_date = datetime.strptime(field[3:].strip(), '%Y-%m-%d').date()
+            elif field.startswith('#S:'):
+                task.start_date = datetime.strptime(field[3:].strip(), '%Y-%m-%d').date()
+            elif field.startswith('#R:'):
+                task.repeat_start = field[3:].strip()
+            elif field.startswith('#RS:'):
+                task.repeat_start = field[4:].strip()
+            elif field.startswith('#RD:'):
+                task.repeat_due = field[4:].strip()
+        except ValueError:
+            pass
+    task.description = '\n'.join([line.strip() for line in task.notes.splitlines() if not line.strip().startswith('#')])
+    due_str = response_data.get('due', '')
+    task.assigned_date = datetime.strptime(due_str, '%Y-%m-%dT%H:%M:%S.%fZ').date() if due_str else ''
+    return task
+
+def best_time(parse, items, repeat=5):
+    return min(timeit.repeat(lambda: [parse(item) for item in items], number=1, repeat=repeat))
+
+def main(count=5000):
+    items = [make_item(i) for i in range(count)]
+    legacy = best_time(legacy_from_api_response, items)
+    current = best_time(Task.from_api_response, items)
+    print(f"parse {count} API items")
+    print(f"  legacy parser:      {legacy * 1000:8.2f} ms ({legacy / count * 1e6:.2f} us/item)")
+    print(f"  from_api_response:  {current * 1000:8.2f} ms ({current / count * 1e6:.2f} us/item, {legacy / current:.1f}x faster)")
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:]))
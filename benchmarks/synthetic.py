@@ -0,0 +1,80 @@
+"""
+Synthetic task lists for benchmarks, shaped like a real user's: a spread of priorities,
+start/due/assigned dates around today, some repeating tasks and subtasks under other tasks.
+The same count and seed always give the same tasks (dates are relative to today).
+
+    python -m benchmarks.synthetic [task count] [seed]
+"""
+from datetime import date, timedelta
+import json
+import random
+import sys
+
+WORDS = ('call', 'email', 'review', 'plan', 'buy', 'fix', 'book', 'pay', 'write', 'read', 'clean', 'update',
+         'report', 'groceries', 'dentist', 'invoice', 'garden', 'taxes', 'car', 'slides', 'budget', 'trip')
+REPEATS = ('* * * 7 C', '* * * 1 S', '1 * * 0 S', '* * 1 0 S', '15 * * 0 C', '* * 0-4 0 S', '1,15 * * 0 S', '* * * 30 C')
+
+# Share of tasks that are subtasks, and the most subtasks one task gets
+SUBTASK_SHARE = 0.2
+MAX_CHILDREN = 5
+
+def _day(today, rng, low, high):
+    return (today + timedelta(days=rng.randint(low, high))).isoformat()
+
+def make_item(rng, index, today):
+    """One API task item with notes metadata"""
+    notes = []
+    if rng.random() < 0.4:
+        notes.append(' '.join(rng.choice(WORDS) for _ in range(rng.randint(3, 12))))
+    notes.append(f'#P:{rng.choices((0, 1, 2, 3), weights=(2, 4, 3, 1))[0]}')
+    if rng.random() < 0.3:
+        notes.append(f'#S:{_day(today, rng, -30, 30)}')
+    if rng.random() < 0.35:
+        notes.append(f'#D:{_day(today, rng, -14, 60)}')
+    if rng.random() < 0.1:
+        notes.append(f'#RS:{rng.choice(REPEATS)}')
+    if rng.random() < 0.05:
+        notes.append(f'#RD:{rng.choice(REPEATS)}')
+    item = {
+        'id': f'task{index:07d}',
+        'title': ' '.join(rng.choice(WORDS) for _ in range(rng.randint(2, 6))).capitalize(),
+        'notes': '\n'.join(notes),
+        'status': 'needsAction',
+    }
+    if rng.random() < 0.15:
+        item['due'] = _day(today, rng, -7, 14) + 'T00:00:00.000Z'
+    return item
+
+def generate_tasklists(count, lists=3, seed=0, today=None):
+    """
+    Generate count task items spread over a number of task lists, most in the first (default) one.
+
+    Returns:
+        Dictionary of tasklist id -> items in position order, subtasks right after their parent
+    """
+    rng = random.Random(seed)
+    today = today or date.today()
+    tasklist_ids = [f'list{i}' for i in range(lists)]
+    items_by_tasklist = {tasklist_id: [] for tasklist_id in tasklist_ids}
+    weights = [lists] + [1] * (lists - 1)
+    index = 0
+    while index < count:
+        tasklist_id = rng.choices(tasklist_ids, weights=weights)[0]
+        parent = make_item(rng, index, today)
+        items = items_by_tasklist[tasklist_id]
+        items.append(parent)
+        index += 1
+        # Chance of a task getting children, so that about SUBTASK_SHARE of all tasks are subtasks
+        if rng.random() < SUBTASK_SHARE / (1 - SUBTASK_SHARE) / ((1 + MAX_CHILDREN) / 2):
+            for _ in range(min(rng.randint(1, MAX_CHILDREN), count - index)):
+                child = make_item(rng, index, today)
+                child['parent'] = parent['id']
+                items.append(child)
+                index += 1
+    return items_by_tasklist
+
+def main(count=100, seed=0):
+    json.dump(generate_tasklists(count, seed=seed), sys.stdout, indent=1)
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:]))
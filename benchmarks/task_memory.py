@@ -0,0 +1,57 @@
+"""
+Memory used by a user's cached task list, with the slotted Task compared to the
+plain __dict__ based layout it replaced.
+
+    python -m benchmarks.task_memory [task count]
+"""
+import sys
+import tracemalloc
+from datetime import date, timedelta
+
+from task import Task
+
+class DictTask:
+    """The old Task layout: a per-instance __dict__, date objects and an eagerly created children list"""
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+        self.notes = ''
+        self.children = []
+
+def make_fields(i):
+    today = date.today()
+    return dict(
+        title=f'Task {i}',
+        description=f'Notes for task {i}',
+        priority=i % 4,
+        due_date=today + timedelta(days=i % 60) if i % 3 == 0 else None,
+        start_date=today + timedelta(days=i % 30) if i % 4 == 0 else None,
+        assigned_date=today + timedelta(days=i % 10) if i % 5 == 0 else None,
+        repeat_start='* * * 7 C' if i % 10 == 0 else '',
+        repeat_due='',
+        completed='',
+        # Built at runtime like statuses parsed from API responses, so they aren't shared literals
+        status=''.join(['needs', 'Action']),
+        id=f'id{i:08d}',
+        parent_id=f'id{i - 1:08d}' if i % 7 == 0 else '',
+        deleted=False
+    )
+
+def measure(factory, count):
+    """Bytes allocated to build count tasks with factory"""
+    fields = [make_fields(i) for i in range(count)]
+    tracemalloc.start()
+    tasks = [factory(**f) for f in fields]
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del tasks
+    return size
+
+def main(count=10000):
+    slotted = measure(Task, count)
+    legacy = measure(DictTask, count)
+    print(f"{count} tasks")
+    print(f"  __dict__ Task: {legacy / count:8.1f} bytes/task")
+    print(f"  slotted Task:  {slotted / count:8.1f} bytes/task ({100 * (1 - slotted / legacy):.0f}% less)")
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:]))
@@ -1,23 +1,54 @@
-from task import Task
 from datetime import date
+import timing
 
+def compile_filter(filter_args):
+    """
+    Compile filter args into a single predicate that checks only the active filters,
+    cheapest first, so tasks can be filtered in one pass.
+    """
+    checks = []
+    if filter_args.hide_children:
+        checks.append(lambda task: not task.parent_id)
+    if filter_args.priority:
+        priority = filter_args.priority
+        checks.append(lambda task: task.priority == priority)
+    if not filter_args.show_future:
+        today = date.today().toordinal()
+        checks.append(lambda task: is_started(task, today))
+    if filter_args.search:
+        search_text = filter_args.search.lower()
+        checks.append(lambda task: search_text in task.search_text)
+
+    if not checks:
+        return lambda task: True
+    if len(checks) == 1:
+        return checks[0]
+
+    def matches(task):
+        for check in checks:
+            if not check(task):
+                return False
+        return True
+    return matches
+
+def iter_filtered_tasks(tasks, filter_args):
+    """Lazily yield the tasks matching the filter args"""
+    return filter(compile_filter(filter_args), tasks)
+
+@timing.timed('filter_tasks')
 def filter_tasks(tasks, filter_args):
-    tasks = filter_tasks_by_text(tasks, filter_args.search)
-    tasks = filter_tasks_by_children(tasks, filter_args.hide_children)
-    tasks = filter_tasks_by_start(tasks, filter_args.show_future)
-    tasks = filter_tasks_by_priority(tasks, filter_args.priority)
-    return tasks
+    return list(iter_filtered_tasks(tasks, filter_args))
+
+def is_started(task, today):
+    # today is an ordinal. Assigned date takes precedence over start date. Tasks with neither are always shown
+    return (task.assigned_day or task.start_day) <= today
 
 def filter_tasks_by_text(tasks, search_text):
     # Empty string or null search string does nothing
     if not search_text:
         return tasks
-    filtered = []
-    for task in tasks:
-        if (search_text.lower() in task.title.lower() or 
-            search_text.lower() in task.description.lower()):
-            filtered.append(task)
-    return filtered
+    search_text = search_text.lower()
+    return [task for task in tasks if search_text in task.search_text]
 
 def filter_tasks_by_children(tasks, hide_children):
     if not hide_children:
@@ -32,19 +63,8 @@ def filter_tasks_by_start(tasks, show_future):
     if show_future:
         return tasks
     
-    today = date.today()
-    
-    filtered = []
-    for task in tasks:
-        if task.assigned_date:
-            if task.assigned_date <= today:
-                filtered.append(task)
-        elif task.start_date:
-            if task.start_date <= today:
-                filtered.append(task)
-        else:
-            filtered.append(task)
-    return filtered
+    today = date.today().toordinal()
+    return [task for task in tasks if is_started(task, today)]
 
 def filter_tasks_by_priority(tasks, priority):
     if not priority:
@@ -54,5 +74,3 @@ def filter_tasks_by_priority(tasks, priority):
         if task.priority == priority:
             filtered.append(task)
     return filtered
-
-    
\ No newline at end of file
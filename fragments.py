@@ -0,0 +1,70 @@
+"""
+Cache of rendered task cards and subtask forms, so the index page only re-renders the ones
+whose tasks changed since they were last shown.
+
+A fragment's key is everything it's rendered from: the template, the saved fields of the
+task (and its subtasks, for a card) and the filter params its forms post back with. An edited
+task gets a new key rather than invalidating the old one, which ages out of the LRU instead.
+Fragments hold nothing but what's in their key, so sessions with the same tasks share them.
+Set MAX_CACHED_FRAGMENTS to 0 to turn the cache off, e.g. while editing the templates.
+"""
+from collections import OrderedDict
+import os
+import threading
+
+from flask import render_template
+from markupsafe import Markup
+
+from task import Task
+
+MAX_CACHED_FRAGMENTS = int(os.environ.get('MAX_CACHED_FRAGMENTS', 5000))
+
+class FragmentCache:
+    """Rendered templates by key, evicting the least recently used past max_size"""
+    def __init__(self, max_size=MAX_CACHED_FRAGMENTS):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._fragments = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._fragments)
+
+    def render(self, key, template_name, **context):
+        """The template rendered with context, from the cache if it's been rendered under key before"""
+        with self._lock:
+            fragment = self._fragments.get(key)
+            if fragment is not None:
+                self._fragments.move_to_end(key)
+                self.hits += 1
+                return fragment
+            self.misses += 1
+        fragment = Markup(render_template(template_name, **context))
+        if self.max_size > 0:
+            with self._lock:
+                self._fragments[key] = fragment
+                while len(self._fragments) > self.max_size:
+                    self._fragments.popitem(last=False)
+        return fragment
+
+    def clear(self):
+        with self._lock:
+            self._fragments.clear()
+
+fragment_cache = FragmentCache()
+
+def _state(task):
+    # The blank 'new subtask' form is an empty dict
+    return task.__getstate__() if isinstance(task, Task) else None
+
+def task_card(task, filter_args):
+    """A task's card, with the forms for its subtasks in task.children"""
+    params = filter_args.to_url_params()
+    key = ('task.html', _state(task), tuple(_state(child) for child in task.children), params)
+    return fragment_cache.render(key, 'task.html', task=task, filter_args=filter_args)
+
+def child_task(task, child, filter_args):
+    """The form for one of a card's subtasks"""
+    key = ('child_task.html', task.id, task.tasklist_id, _state(child), filter_args.to_url_params())
+    return fragment_cache.render(key, 'child_task.html', task=task, child=child, filter_args=filter_args)
@@ -37,7 +37,13 @@ def main():
     service = build("tasks", "v1", credentials=creds)
 
     # Call the Tasks API
-    results = service.tasks().list(tasklist="MDk5NzIwMDMyNTExNzU4MzkzMjI6MDow", showCompleted=False, maxResults=100).execute()
+    tasklists = service.tasklists().list(maxResults=100).execute().get("items", [])
+    print("Task lists:")
+    for tasklist in tasklists:
+      print(f"{tasklist['title']} ({tasklist['id']})")
+
+    # Tasks in the user's default list
+    results = service.tasks().list(tasklist="@default", showCompleted=False, maxResults=100).execute()
     items = results.get("items", [])
 
     if not items:
@@ -1,63 +1,54 @@
-from sort import get_sorted_tasks
+from datetime import date
+import logging
+
+from sort import task_sort_key
 import api
 
-def reposition_updated_task(creds, tasks, updated_task):
+logger = logging.getLogger(__name__)
+
+def reposition_updated_task(creds, tasks, updated_task, batch=None, outbox=None):
     """
     Reposition an updated task within the tasks array to maintain proper sort order
     while preserving Google's original ordering for other tasks.
-    
+
+    The task goes in front of the first top-level task in its task list that sorts after it,
+    with its subtasks moving along with it. The list's top-level tasks (from the TaskList's parent
+    index) are scanned in order until that task is found, so the cost grows with how far down the
+    task goes rather than with the size of the list: tasks just worked on tend to go near the top.
+
     Args:
         creds: Google API credentials
-        tasks: List of tasks in Google's sort order
+        tasks: TaskList in Google's sort order
         updated_task: The task that was just updated and needs repositioning
-    
+        batch: Optional api.Batch to queue the move on
+        outbox: Optional writeback.Outbox to defer the move to
+
     Returns:
         None (modifies tasks array in place and calls API to reorder)
     """
-    # First, remove the updated task from the tasks array
-    tasks[:] = [task for task in tasks if task.id != updated_task.id]
-    
-    # Calculate the sorted order for all tasks including the updated one
-    all_tasks = tasks + [updated_task]
-    sorted_tasks = get_sorted_tasks(all_tasks)
-    
-    # Find the position of our updated task in the sorted order
-    updated_task_index = next((i for i, task in enumerate(sorted_tasks) if task.id == updated_task.id), -1)
-    
-    # TODO clean up this debugging later
-    print(f"this tasks sort index: {updated_task_index}")
-
-    if updated_task_index == -1:
-        # Should not happen, but fallback to appending at end
-        tasks.append(updated_task)
-        return
-    
-    # Find the correct insertion point in the original tasks array
-    # We need to find the first task in the tasks array that should come after
-    # our updated task according to the sorted order
-    insertion_index = len(tasks)  # Default to end of array
-    
-    for i, task in enumerate(tasks):
-        # Find this task's position in the sorted order
-        task_sorted_index = next((j for j, sorted_task in enumerate(sorted_tasks) if sorted_task.id == task.id), -1)
-        
-        print(f"{task.title} ({task_sorted_index})")
-        
-        # If this task should come after our updated task in sorted order,
-        # insert our updated task before it
-        if task_sorted_index > updated_task_index:
-            print(f"inserting before: {task.title} ({task_sorted_index})")
-            insertion_index = i
-            break
-    
-    # Insert the updated task at the correct position
-    tasks.insert(insertion_index, updated_task)
-    
-    # Call API to reorder the task in Google Tasks
-    # Find the task that should come immediately before our updated task
-    previous_task_id = None
-    if insertion_index > 0:
-        previous_task_id = tasks[insertion_index - 1].id
-    
+    tasklist_id = updated_task.tasklist_id
+    previous_task = _reposition(tasks, updated_task, date.today())
+    previous_task_id = previous_task.id if previous_task is not None else None
+
+    # A newly inserted task only gets its id once its insert has been sent
+    if batch is not None and not updated_task.id:
+        batch.execute()
+
     # Move the task in Google Tasks API
-    api.move_task(creds, updated_task.id, None, previous_task_id)
\ No newline at end of file
+    api.move_task(creds, updated_task.id, None, previous_task_id, batch=batch,
+                  tasklist_id=tasklist_id or api.DEFAULT_TASKLIST, outbox=outbox)
+
+def _reposition(tasks, updated_task, today):
+    """Move the task (and its subtasks) among the list's top-level tasks. Returns the task now before it."""
+    # A new task without an id yet can only be found as itself
+    old_task = tasks.get(updated_task.id) if updated_task.id else updated_task
+    moving = (tasks.take(old_task) if old_task is not None else []) or [updated_task]
+    # Subtasks move with their parent, so only the list's top-level tasks count. They aren't sorted by
+    # sort key (the user can reorder them in Google), so they're scanned up to the first that sorts after it
+    top_level = tasks.top_level(updated_task.tasklist_id)
+    key = task_sort_key(updated_task, today)
+    position = next((i for i, task in enumerate(top_level) if task_sort_key(task, today) > key), len(top_level))
+    previous_task = top_level[position - 1] if position > 0 else None
+    logger.debug("Repositioning %s (%s) after %s", updated_task.title, updated_task.id, previous_task.id if previous_task else None)
+    tasks.place(updated_task, previous_task, subtasks=moving[1:])
+    return previous_task
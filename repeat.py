@@ -1,7 +1,10 @@
 # Logic for validating and using repeating fields on tasks
 
+from calendar import monthrange
 from datetime import datetime, timedelta
-from repeat_validation import validate_repeat
+from functools import lru_cache
+from typing import NamedTuple
+from repeat_validation import parse_repeat
 from task import Task
 
 def matches_repeat_field(repeat_field, value):
@@ -22,42 +25,97 @@ def matches_repeat_field(repeat_field, value):
             
     return False
 
-# last_date should be a Date object not a string
-# last_date is the previous start date. Completion date is usually today's date
-def next_repeat_date(last_date, completion_date, repeat_str):
-    if not validate_repeat(repeat_str):
+def _field_bits(repeat_field, min_value, max_value):
+    """Bitset of the values in [min_value, max_value] that a single repeat field matches"""
+    return sum(1 << value for value in range(min_value, max_value + 1) if matches_repeat_field(repeat_field, value))
+
+class RepeatRule(NamedTuple):
+    """
+    A compiled repeat string. Day of month, month and day of week are bitsets (bit n set means
+    value n matches), so finding the next date can skip whole months without parsing anything.
+    """
+    days_of_month: int
+    months: int
+    days_of_week: int # crontab numbering, sunday=0
+    days: int
+    from_completion: bool
+
+    def next_date(self, last_date, completion_date):
+        """The first matching date on or after the base date plus the repeat's days, or None if none within 1000 days"""
+        next_date = completion_date if self.from_completion else last_date
+        next_date = next_date + timedelta(days=self.days)
+        # look ahead up to 1000 days in the future to find the next valid date that matches all criteria
+        last_allowed = next_date + timedelta(days=999)
+
+        while next_date <= last_allowed:
+            days_in_month = monthrange(next_date.year, next_date.month)[1]
+            remaining_days = self.days_of_month >> next_date.day & ((1 << (days_in_month - next_date.day + 1)) - 1)
+            if (self.months >> next_date.month) & 1 and remaining_days:
+                # Python gives us monday=0 but crontab standard has sunday=0
+                day_of_week = (next_date.weekday() + 1) % 7
+                for day in range(next_date.day, days_in_month + 1):
+                    if (remaining_days & 1) and (self.days_of_week >> day_of_week) & 1:
+                        match = next_date.replace(day=day)
+                        return match if match <= last_allowed else None
+                    remaining_days >>= 1
+                    day_of_week = (day_of_week + 1) % 7
+            # Nothing left in this month, jump to the first of the next one
+            if next_date.month == 12:
+                next_date = next_date.replace(year=next_date.year + 1, month=1, day=1)
+            else:
+                next_date = next_date.replace(month=next_date.month + 1, day=1)
+
         return None
 
-    parts = repeat_str.split()
-        
-    next_date = completion_date if parts[4] == 'C' else last_date
+def compile_repeat(repeat):
+    """Compile a repeat string (or its parsed RepeatFields) into a RepeatRule, or None if it isn't valid"""
+    return _compile_fields(parse_repeat(repeat) if isinstance(repeat, str) else repeat)
 
-    days_to_add = int(parts[3])
-    next_date = next_date + timedelta(days=days_to_add)
-    
-    # look ahead up to 1000 days in the future to find the next valid date that matches all criteria
-    for i in range(1000):
-        day_of_month = next_date.day
-        month_of_year = next_date.month
-        # Python gives us monday=0 but crontab standard has sunday=0
-        day_of_week = (next_date.weekday() + 1) % 7
+@lru_cache(maxsize=1024)
+def _compile_fields(fields):
+    if not fields.valid:
+        return None
+    return RepeatRule(
+        days_of_month=_field_bits(fields.day_of_month, 1, 31),
+        months=_field_bits(fields.month_of_year, 1, 12),
+        days_of_week=_field_bits(fields.day_of_week, 0, 6),
+        days=int(fields.days),
+        from_completion=fields.basis == 'C'
+    )
 
-        if (matches_repeat_field(parts[0], day_of_month) and
-            matches_repeat_field(parts[1], month_of_year) and
-            matches_repeat_field(parts[2], day_of_week)):
-            return next_date
+# last_date should be a Date object not a string
+# last_date is the previous start date. Completion date is usually today's date
+# repeat can be a repeat string or its parsed RepeatFields
+def next_repeat_date(last_date, completion_date, repeat):
+    rule = compile_repeat(repeat)
+    return rule.next_date(last_date, completion_date) if rule else None
 
-        next_date = next_date + timedelta(days=1)
-    
-    return None
+def preview_repeat_dates(repeat_str, from_date, count):
+    """
+    The next count dates a repeat would produce starting from from_date, assuming each
+    occurrence is completed on the day it lands on.
+    """
+    rule = compile_repeat(repeat_str)
+    dates = []
+    current = from_date
+    while rule and len(dates) < count:
+        next_date = rule.next_date(current, current)
+        if next_date == current:
+            # A zero day repeat would land on the same date forever, so look from the day after
+            next_date = rule.next_date(current + timedelta(days=1), current + timedelta(days=1))
+        if next_date is None:
+            break
+        dates.append(next_date)
+        current = next_date
+    return dates
 
 def next_repeat_task(task: Task) -> Task:
     repeat_completed_date = datetime.now().date() # TODO should we use the actual assigned date??
     repeat_start_date = task.start_date or repeat_completed_date
     repeat_due_date = task.due_date or repeat_completed_date
     # This will just give us None if there's a blank repeat_start/repeat_due, which makes sense (just clear the field for the next task)
-    next_start = next_repeat_date(repeat_start_date, repeat_completed_date, task.repeat_start)   
-    next_due = next_repeat_date(repeat_due_date, repeat_completed_date, task.repeat_due)         
+    next_start = next_repeat_date(repeat_start_date, repeat_completed_date, task.repeat_start_fields())
+    next_due = next_repeat_date(repeat_due_date, repeat_completed_date, task.repeat_due_fields())
     return Task(
         title=task.title,
         description=task.description,
@@ -66,5 +124,6 @@ def next_repeat_task(task: Task) -> Task:
         due_date=next_due,
         repeat_start=task.repeat_start,
         repeat_due=task.repeat_due,
-        priority=task.priority
+        priority=task.priority,
+        tasklist_id=task.tasklist_id
     )    
\ No newline at end of file
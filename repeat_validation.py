@@ -1,3 +1,6 @@
+from functools import lru_cache
+from typing import NamedTuple
+
 def validate_single_repeat(day, min, max):
     if day != '*':
         for d in day.split(','):
@@ -14,28 +17,47 @@ def validate_single_repeat(day, min, max):
 
     return True
 
-def validate_repeat(repeat_str):
+class RepeatFields(NamedTuple):
+    """
+    A repeat string split into its five fields (blank when missing), plus whether the whole string is valid.
+    Shared by validation, next date computation and the template so each string is only parsed once.
+    """
+    day_of_month: str = ''
+    month_of_year: str = ''
+    day_of_week: str = ''
+    days: str = ''
+    basis: str = '' # 'S' to repeat from the last start/due date, 'C' from completion
+    valid: bool = False
+
+EMPTY_REPEAT = RepeatFields()
+
+@lru_cache(maxsize=1024)
+def parse_repeat(repeat_str):
+    """Parse a repeat string into RepeatFields. Memoized by string."""
     if not repeat_str:
-        return False
-            
+        return EMPTY_REPEAT
     parts = repeat_str.split()
-    if len(parts) != 5:
-        return False
+    fields = RepeatFields(*parts[:5])
+    return fields._replace(valid=len(parts) == 5 and _validate_fields(fields))
 
+def _validate_fields(fields):
     # Validate day of month (1-31, *, ranges like 1-15, lists like 1,15, or */5)
-    if not validate_single_repeat(parts[0], 1, 31):
+    if not validate_single_repeat(fields.day_of_month, 1, 31):
         return False
 
-    if not validate_single_repeat(parts[1], 1, 12):
+    if not validate_single_repeat(fields.month_of_year, 1, 12):
         return False
 
-    if not validate_single_repeat(parts[2], 0, 6):
+    if not validate_single_repeat(fields.day_of_week, 0, 6):
         return False
 
-    if not parts[3].isdigit() or not (0 <= int(parts[3]) <= 999):
+    if not fields.days.isdigit() or not (0 <= int(fields.days) <= 999):
         return False
     
-    if parts[4] not in ['C', 'S']:
+    if fields.basis not in ['C', 'S']:
         return False
     
-    return True
\ No newline at end of file
+    return True
+
+def validate_repeat(repeat_str):
+    return parse_repeat(repeat_str).valid
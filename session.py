@@ -1,9 +1,199 @@
-from flask import session
+from flask import session, g
 from functools import wraps
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from contextlib import contextmanager
+import os
+import pickle
+import sqlite3
+import threading
+import time
 import uuid
+import zlib
 
-# In-memory session store to avoid large cookies
-session_store = {}
+# Sessions unused for this long are dropped, and each store keeps at most this many sessions
+SESSION_TTL_SECONDS = int(os.environ.get('SESSION_TTL_SECONDS', 7 * 24 * 60 * 60))
+SESSION_MAX_ENTRIES = int(os.environ.get('SESSION_MAX_ENTRIES', 1000))
+# Reading a session only rewrites its last access time once it's at least this old
+SESSION_TOUCH_SECONDS = int(os.environ.get('SESSION_TOUCH_SECONDS', 60))
+
+class SessionStore(ABC):
+    """Server-side storage for each session's user data dict, keyed by session id"""
+    # Whether other processes see the same sessions
+    shared = False
+
+    @abstractmethod
+    def load(self, session_id):
+        """Return the session's data dict, or None if there isn't one (or it expired)"""
+
+    @abstractmethod
+    def save(self, session_id, data):
+        """Store the session's data dict"""
+
+    @abstractmethod
+    def update(self, session_id, changes):
+        """Atomically set the changed keys in the session's data, leaving any others as they're stored now"""
+
+    @abstractmethod
+    def delete(self, session_id):
+        """Remove the session's data, if any"""
+
+    def __getitem__(self, session_id):
+        data = self.load(session_id)
+        if data is None:
+            raise KeyError(session_id)
+        return data
+
+    def __setitem__(self, session_id, data):
+        self.save(session_id, data)
+
+    def __contains__(self, session_id):
+        return self.load(session_id) is not None
+
+class MemorySessionStore(SessionStore):
+    """In-process store with LRU eviction and an idle TTL. Data lives only as long as the process."""
+    def __init__(self, max_entries=SESSION_MAX_ENTRIES, ttl=SESSION_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._sessions = OrderedDict()
+        self._accessed = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def load(self, session_id):
+        with self._lock:
+            data = self._live(session_id)
+            if data is None:
+                return None
+            self._touch(session_id)
+            # A copy of the dict, so keys a request sets only show once it's saved them. The values are the
+            # stored objects themselves though: changes made in place to e.g. the TaskList show straight away
+            return dict(data)
+
+    def save(self, session_id, data):
+        with self._lock:
+            self._store(session_id, data)
+
+    def update(self, session_id, changes):
+        with self._lock:
+            self._store(session_id, {**(self._live(session_id) or {}), **changes})
+
+    def delete(self, session_id):
+        with self._lock:
+            self._remove(session_id)
+
+    def clear(self):
+        with self._lock:
+            self._sessions.clear()
+            self._accessed.clear()
+
+    def _live(self, session_id):
+        data = self._sessions.get(session_id)
+        if data is not None and time.monotonic() - self._accessed[session_id] > self.ttl:
+            self._remove(session_id)
+            return None
+        return data
+
+    def _touch(self, session_id):
+        self._accessed[session_id] = time.monotonic()
+        self._sessions.move_to_end(session_id)
+
+    def _store(self, session_id, data):
+        self._sessions[session_id] = data
+        self._touch(session_id)
+        while len(self._sessions) > self.max_entries:
+            self._remove(next(iter(self._sessions)))
+
+    def _remove(self, session_id):
+        self._sessions.pop(session_id, None)
+        self._accessed.pop(session_id, None)
+
+class SqliteSessionStore(SessionStore):
+    """
+    On-disk store shared by every worker process using the same database file, so sessions
+    survive restarts. Session data is pickled and compressed. Like the memory store, sessions
+    expire after an idle TTL and the least recently used ones are pruned beyond max_entries.
+    """
+    shared = True
+
+    def __init__(self, path, max_entries=SESSION_MAX_ENTRIES, ttl=SESSION_TTL_SECONDS):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._local = threading.local()
+        with self._transaction() as connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS sessions (id TEXT PRIMARY KEY, data BLOB NOT NULL, accessed REAL NOT NULL)')
+            connection.execute('CREATE INDEX IF NOT EXISTS sessions_accessed ON sessions (accessed)')
+
+    def _connection(self):
+        # sqlite connections can't be shared between threads, so each thread gets its own.
+        # Transactions are begun explicitly, so that writes can take the lock before reading.
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            self._local.connection = connection
+        return connection
+
+    @contextmanager
+    def _transaction(self):
+        # BEGIN IMMEDIATE takes the write lock up front, so no other process can write between our read and write
+        connection = self._connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            yield connection
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+
+    def _read(self, connection, session_id, now):
+        row = connection.execute('SELECT data, accessed FROM sessions WHERE id = ?', (session_id,)).fetchone()
+        if row is None or now - row[1] > self.ttl:
+            return None, None
+        return row
+
+    def load(self, session_id):
+        connection = self._connection()
+        now = time.time()
+        data, accessed = self._read(connection, session_id, now)
+        if data is None:
+            return None
+        if now - accessed >= SESSION_TOUCH_SECONDS:
+            connection.execute('UPDATE sessions SET accessed = ? WHERE id = ?', (now, session_id))
+        return pickle.loads(zlib.decompress(data))
+
+    def save(self, session_id, data):
+        blob = zlib.compress(pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL))
+        with self._transaction() as connection:
+            self._write(connection, session_id, blob)
+
+    def update(self, session_id, changes):
+        with self._transaction() as connection:
+            stored, _ = self._read(connection, session_id, time.time())
+            data = pickle.loads(zlib.decompress(stored)) if stored is not None else {}
+            data.update(changes)
+            self._write(connection, session_id, zlib.compress(pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)))
+
+    def _write(self, connection, session_id, blob):
+        now = time.time()
+        connection.execute('INSERT OR REPLACE INTO sessions (id, data, accessed) VALUES (?, ?, ?)', (session_id, blob, now))
+        connection.execute('DELETE FROM sessions WHERE accessed < ?', (now - self.ttl,))
+        connection.execute('DELETE FROM sessions WHERE id NOT IN (SELECT id FROM sessions ORDER BY accessed DESC LIMIT ?)', (self.max_entries,))
+
+    def delete(self, session_id):
+        self._connection().execute('DELETE FROM sessions WHERE id = ?', (session_id,))
+
+def create_session_store():
+    """Create the session store backend picked by the SESSION_STORE environment variable ('memory' or 'sqlite')"""
+    if os.environ.get('SESSION_STORE', 'memory') == 'sqlite':
+        return SqliteSessionStore(os.environ.get('SESSION_DB', 'sessions.db'))
+    return MemorySessionStore()
+
+# Server-side session store to avoid large cookies
+session_store = create_session_store()
 
 def get_session_id():
     """Get or create session ID"""
@@ -11,33 +201,49 @@ def get_session_id():
         session['session_id'] = str(uuid.uuid4())
     return session['session_id']
 
+def load_user_data():
+    """Get all of the current session's user data, loaded from the store once per request"""
+    if 'user_data' not in g:
+        g.user_data = session_store.load(get_session_id()) or {}
+        g.user_data_changes = {}
+    return g.user_data
+
 def get_user_data(key, default=None):
     """Get user data from server-side session store"""
-    session_id = get_session_id()
-    if session_id not in session_store:
-        session_store[session_id] = {}
-    return session_store[session_id].get(key, default)
+    return load_user_data().get(key, default)
 
 def set_user_data(key, value):
-    """Set user data in server-side session store"""
-    session_id = get_session_id()
-    if session_id not in session_store:
-        session_store[session_id] = {}
-    session_store[session_id][key] = value
+    """Set user data for the session, which is saved to the store at the end of the request"""
+    load_user_data()[key] = value
+    g.user_data_changes[key] = value
+
+def save_user_data():
+    """Save the keys the current request set to the session store, if it set any"""
+    changes = g.pop('user_data_changes', None)
+    if changes:
+        session_store.update(get_session_id(), changes)
 
 def clear_user_data():
     """Clear user data from server-side session store"""
-    session_id = get_session_id()
-    if session_id in session_store:
-        del session_store[session_id]
+    session_store.delete(get_session_id())
+    g.pop('user_data', None)
+    g.pop('user_data_changes', None)
     session.clear()
 
+def init_app(app):
+    """Save each request's changes to the session's user data once it's handled"""
+    @app.after_request
+    def save_request_user_data(response):
+        save_user_data()
+        return response
+
 def require_auth(f):
     """Decorator to require authentication for a route"""
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        if not get_user_data('creds') or not get_user_data('tasks'):
+        user_data = load_user_data()
+        if not user_data.get('creds') or not user_data.get('tasks'):
             from flask import redirect
             return redirect('/auth')
         return f(*args, **kwargs)
-    return decorated_function
\ No newline at end of file
+    return decorated_function
@@ -1,29 +1,43 @@
-from datetime import datetime, timedelta
+from datetime import date
+import heapq
+import timing
 
-def task_sort_key(task):
-    start_date_str = task.start_date_str()
-    if not start_date_str:
-        start_date = datetime.now()
-    else:
-        start_date = datetime.strptime(start_date_str, '%Y-%m-%d')
-    
-    if start_date.date() < datetime.now().date():
-        start_date = datetime.now()
-    
-    sort_key = task.assigned_date_str() or task.due_date_str()
-    if not sort_key:
-        priority = task.priority
-        if priority == 3:
-            sort_key = (start_date + timedelta(days=7)).strftime('%Y-%m-%d')
-        elif priority == 2:
-            sort_key = (start_date + timedelta(days=14)).strftime('%Y-%m-%d')
-        elif priority == 1:
-            sort_key = (start_date + timedelta(days=30)).strftime('%Y-%m-%d')
-        elif priority == 0:
-            sort_key = (start_date + timedelta(days=-7)).strftime('%Y-%m-%d')
+# Implied due date offsets (in days from the start date) for tasks with no assigned or due date
+PRIORITY_OFFSETS = {3: 7, 2: 14, 1: 30, 0: -7}
+
+def task_sort_key(task, today=None):
+    """
+    Sort key for a task: (ordinal of its assigned/due/implied due date, inverted priority).
+    The key is cached on the task until its dates or priority change, or the day rolls over.
+    """
+    today = (today or date.today()).toordinal()
+    cached = task.sort_key_cache
+    if cached is not None and cached[0] == today:
+        return cached[1]
+
+    # Dates are ordinals, 0 when unset
+    day = task.assigned_day or task.due_day
+    if not day and task.priority in PRIORITY_OFFSETS:
+        # Tasks starting in the past are treated as starting today
+        start = max(task.start_day, today)
+        day = start + PRIORITY_OFFSETS[task.priority]
 
     # Add priority to the sort order as a tiebreaker for equal dates
-    return sort_key + '-' + str(3 - task.priority)
+    key = (day, 3 - task.priority)
+    task.sort_key_cache = (today, key)
+    return key
 
+@timing.timed('get_sorted_tasks')
 def get_sorted_tasks(tasks):
-    return sorted(tasks, key=task_sort_key)
\ No newline at end of file
+    today = date.today()
+    return sorted(tasks, key=lambda task: task_sort_key(task, today))
+
+@timing.timed('get_top_tasks')
+def get_top_tasks(tasks, count):
+    """
+    The first count tasks in sorted order, without sorting all of them. Equivalent to
+    get_sorted_tasks(tasks)[:count], but takes any iterable and only keeps count tasks in a heap.
+    When given a lazy filter, its span includes the filtering.
+    """
+    today = date.today()
+    return heapq.nsmallest(count, tasks, key=lambda task: task_sort_key(task, today))
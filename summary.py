@@ -1,16 +1,61 @@
-from datetime import datetime, timedelta
+from datetime import date
 from task import Task
+import timing
+
+STAT_KEYS = ('p3', 'p2', 'p1', 'p0', 'overdue', 'today', 'week', 'month')
+PRIORITY_KEYS = {3: 'p3', 2: 'p2', 1: 'p1', 0: 'p0'}
+
+class Stats:
+    """
+    Counts for the stats bar, as of the given day. Built in a single pass over the tasks and
+    kept up to date by add()/remove() as tasks change, rather than recounted on every render.
+    """
+    def __init__(self, tasks=(), today=None):
+        today = (today or date.today()).toordinal()
+        self.today = today
+        self.counts = dict.fromkeys(STAT_KEYS, 0)
+        # Due day boundaries (as ordinals) of the today/week/month buckets, worked out once
+        self._week_start = today + 1
+        self._week_end = today + 7
+        self._month_end = today + 30
+        for task in tasks:
+            self.add(task)
+
+    def _due_key(self, task):
+        due = task.due_day
+        if not due:
+            return None
+        if due < self.today:
+            return 'overdue'
+        if due < self._week_start:
+            return 'today'
+        if due <= self._week_end:
+            return 'week'
+        if due <= self._month_end:
+            return 'month'
+        return None
+
+    def add(self, task, count=1):
+        """Count a task that was added to the list"""
+        counts = self.counts
+        key = PRIORITY_KEYS.get(task.priority)
+        if key:
+            counts[key] += count
+        key = self._due_key(task)
+        if key:
+            counts[key] += count
+
+    def remove(self, task):
+        """Stop counting a task that was removed from the list"""
+        self.add(task, -1)
+
+    def as_dict(self):
+        return dict(self.counts)
 
 # TODO need to use the implied due dates from the sorting algo here?
+@timing.timed('summary.get_stats')
 def get_stats(tasks: list[Task]) -> dict:
-    today = datetime.now().date()
-    return {
-        'p3': sum(1 for task in tasks if task.priority == 3),
-        'p2': sum(1 for task in tasks if task.priority == 2),
-        'p1': sum(1 for task in tasks if task.priority == 1),
-        'p0': sum(1 for task in tasks if task.priority == 0),
-        'overdue': sum(1 for task in tasks if task.due_date and task.due_date < today),
-        'today': sum(1 for task in tasks if task.due_date and today <= task.due_date < today + timedelta(days=1)),
-        'week':  sum(1 for task in tasks if task.due_date and today + timedelta(days=1) <= task.due_date <= today + timedelta(days=7)),
-        'month': sum(1 for task in tasks if task.due_date and today + timedelta(days=7) < task.due_date <= today + timedelta(days=30))
-    }
\ No newline at end of file
+    stats = getattr(tasks, 'stats', None)
+    if stats is not None:
+        return stats().as_dict()
+    return Stats(tasks).as_dict()
@@ -1,9 +1,58 @@
 from datetime import datetime, timedelta, date
-from repeat_validation import validate_repeat
+from operator import attrgetter
+import sys
+from repeat_validation import parse_repeat
+
+# Metadata tags in task notes ("#TAG:value" lines), mapped to the field they set and how to parse the value
+NOTES_TAGS = {
+    'P': ('priority', int),
+    'D': ('due_date', date.fromisoformat),
+    'S': ('start_date', date.fromisoformat),
+    'R': ('repeat_start', str), # legacy import for old repeat fields
+    'RS': ('repeat_start', str),
+    'RD': ('repeat_due', str),
+}
+
+def _cache_invalidating_field(slot, cache):
+    """Property for a field that a cached value depends on, which drops the cached value when set"""
+    get_slot = attrgetter(slot)
+    def set(self, value):
+        setattr(self, slot, value)
+        setattr(self, cache, None)
+    return property(get_slot, set)
+
+def _date_field(slot):
+    """Property for a date field stored as an ordinal (0 when unset). Setting it drops the cached sort key."""
+    get_slot = attrgetter(slot)
+    def get(self):
+        day = get_slot(self)
+        return date.fromordinal(day) if day else None
+    def set(self, value):
+        setattr(self, slot, value.toordinal() if value else 0)
+        self.sort_key_cache = None
+    return property(get, set)
 
 class Task:
+    # Slotted to keep the per-task overhead down, since every session caches its whole task list
+    __slots__ = ('_title', '_description', '_priority', '_due_date', '_start_date', '_assigned_date', '_repeat_start', '_repeat_due',
+                 'notes', 'completed', '_status', 'id', 'parent_id', 'tasklist_id', 'position', '_children', 'deleted', 'sort_key_cache', '_search_text',
+                 '_repeat_start_fields', '_repeat_due_fields')
+
+    priority = _cache_invalidating_field('_priority', 'sort_key_cache')
+    title = _cache_invalidating_field('_title', '_search_text')
+    description = _cache_invalidating_field('_description', '_search_text')
+    repeat_start = _cache_invalidating_field('_repeat_start', '_repeat_start_fields')
+    repeat_due = _cache_invalidating_field('_repeat_due', '_repeat_due_fields')
+    due_date = _date_field('_due_date')
+    start_date = _date_field('_start_date')
+    assigned_date = _date_field('_assigned_date')
+    # Raw ordinals (0 when unset) for hot paths that compare dates without needing date objects
+    due_day = property(attrgetter('_due_date'))
+    start_day = property(attrgetter('_start_date'))
+    assigned_day = property(attrgetter('_assigned_date'))
+
     def __init__(self, title: str = '', description: str = '', priority: int = 0, due_date: date = None, id: str = '', deleted = False, status: str = 'needsAction', completed: str = '',
-                 start_date: date = None, assigned_date: date = None, repeat_start: str = '', repeat_due: str = '', parent_id: str = ''):
+                 start_date: date = None, assigned_date: date = None, repeat_start: str = '', repeat_due: str = '', parent_id: str = '', tasklist_id: str = '', position: str = ''):
         self.title = title
         self.description = description
         self.priority = priority
@@ -18,9 +67,71 @@ class Task:
         self.status = status
         self.id = id
         self.parent_id = parent_id
-        self.children = []
+        self.tasklist_id = tasklist_id # Which of the user's task lists it's in, '' for the default one
+        self.position = position # Google's position string among the tasks with the same parent, which sort as strings
+        self._children = None
         self.deleted = deleted
 
+    @property
+    def status(self):
+        return self._status
+
+    @status.setter
+    def status(self, value):
+        # There are only a couple of distinct statuses, so share one string object between all tasks
+        self._status = sys.intern(value) if value else value
+
+    @property
+    def children(self):
+        """Subtasks attached for display. Only created when first used, since most tasks never need one"""
+        if self._children is None:
+            self._children = []
+        return self._children
+
+    @children.setter
+    def children(self, value):
+        self._children = value
+
+    # Pickled (e.g. by the session store) as a bare tuple of field values, leaving out caches and the derived children list
+    _STATE_SLOTS = ('_title', '_description', '_priority', '_due_date', '_start_date', '_assigned_date', '_repeat_start', '_repeat_due',
+                    'notes', 'completed', '_status', 'id', 'parent_id', 'deleted', 'tasklist_id', 'position')
+
+    def __getstate__(self):
+        return tuple(getattr(self, slot) for slot in self._STATE_SLOTS)
+
+    def __setstate__(self, state):
+        # Tasks pickled before tasklist_id and position existed have a shorter state
+        self.tasklist_id = ''
+        self.position = ''
+        for slot, value in zip(self._STATE_SLOTS, state):
+            setattr(self, slot, value)
+        self.status = self._status
+        self._children = None
+        self.sort_key_cache = None
+        self._search_text = None
+        self._repeat_start_fields = None
+        self._repeat_due_fields = None
+
+    def copy(self):
+        """A copy of the task's fields (the same ones as pickled), without its caches or children"""
+        # Spelled out rather than looped over _STATE_SLOTS, since whole task lists get copied on reload
+        task = Task.__new__(Task)
+        (task._title, task._description, task._priority, task._due_date, task._start_date, task._assigned_date,
+         task._repeat_start, task._repeat_due, task.notes, task.completed, task._status, task.id, task.parent_id,
+         task.deleted, task.tasklist_id, task.position) = (
+            self._title, self._description, self._priority, self._due_date, self._start_date, self._assigned_date,
+            self._repeat_start, self._repeat_due, self.notes, self.completed, self._status, self.id, self.parent_id,
+            self.deleted, self.tasklist_id, self.position)
+        task._children = task.sort_key_cache = task._search_text = task._repeat_start_fields = task._repeat_due_fields = None
+        return task
+
+    @property
+    def search_text(self):
+        """Lowercased title and description for case-insensitive search, cached until either changes"""
+        if self._search_text is None:
+            self._search_text = f"{(self.title or '').lower()}\0{(self.description or '').lower()}"
+        return self._search_text
+
     # Getters used in the html template
     def start_date_str(self):
         return self.start_date.strftime('%Y-%m-%d') if self.start_date else ''
@@ -35,90 +146,78 @@ class Task:
         return self.assigned_date.strftime('%Y-%m-%dT%H:%M:%SZ') if self.assigned_date else ''
 
     def repeat_start_fields(self):
-        return self.repeat_start.split() if self.repeat_start else []
+        """Parsed repeat_start, cached until it's reassigned"""
+        if self._repeat_start_fields is None:
+            self._repeat_start_fields = parse_repeat(self.repeat_start)
+        return self._repeat_start_fields
     
     def repeat_start_dom(self):
-        fields = self.repeat_start_fields()
-        return fields[0] if len(fields) > 0 else ''
+        return self.repeat_start_fields().day_of_month
 
     def repeat_start_moy(self):
-        fields = self.repeat_start_fields()
-        return fields[1] if len(fields) > 1 else ''
+        return self.repeat_start_fields().month_of_year
 
     def repeat_start_dow(self):
-        fields = self.repeat_start_fields()
-        return fields[2] if len(fields) > 2 else ''
+        return self.repeat_start_fields().day_of_week
 
     def repeat_start_days(self):
-        fields = self.repeat_start_fields()
-        return fields[3] if len(fields) > 3 else ''
+        return self.repeat_start_fields().days
 
     def repeat_start_from(self):
-        fields = self.repeat_start_fields()
-        return fields[4] if len(fields) > 4 else ''
+        return self.repeat_start_fields().basis
 
     def repeat_due_fields(self):
-        return self.repeat_due.split() if self.repeat_due else []
+        """Parsed repeat_due, cached until it's reassigned"""
+        if self._repeat_due_fields is None:
+            self._repeat_due_fields = parse_repeat(self.repeat_due)
+        return self._repeat_due_fields
     
     def repeat_due_dom(self):
-        fields = self.repeat_due_fields()
-        return fields[0] if len(fields) > 0 else ''
+        return self.repeat_due_fields().day_of_month
 
     def repeat_due_moy(self):
-        fields = self.repeat_due_fields()
-        return fields[1] if len(fields) > 1 else ''
+        return self.repeat_due_fields().month_of_year
 
     def repeat_due_dow(self):
-        fields = self.repeat_due_fields()
-        return fields[2] if len(fields) > 2 else ''
+        return self.repeat_due_fields().day_of_week
 
     def repeat_due_days(self):
-        fields = self.repeat_due_fields()
-        return fields[3] if len(fields) > 3 else ''
+        return self.repeat_due_fields().days
 
     def repeat_due_from(self):
-        fields = self.repeat_due_fields()
-        return fields[4] if len(fields) > 4 else ''
+        return self.repeat_due_fields().basis
     
     @classmethod
-    def from_api_response(cls, response_data):
+    def from_api_response(cls, response_data, tasklist_id=''):
         task = cls()
         task.id = response_data.get('id', '')
+        task.tasklist_id = tasklist_id
         task.title = response_data.get('title', '')
         task.notes = response_data.get('notes', '')
         task.completed = response_data.get('completed', '') # TODO instead of defaults here, just use the default from __init__
         task.status = response_data.get('status', '')
         task.parent_id = response_data.get('parent', '')
+        task.position = response_data.get('position', '')
         
-        # Parse notes for special fields
-        desc_fields = [line.strip() for line in task.notes.splitlines() if line.strip().startswith('#')]
-        
-        for field in desc_fields:
-            try:
-                if field.startswith('#P:'):
-                    task.priority = int(field[3:].strip())
-                elif field.startswith('#D:'):
-                    date_str = field[3:].strip()
-                    task.due_date = datetime.strptime(date_str, '%Y-%m-%d').date()
-                elif field.startswith('#S:'):
-                    date_str = field[3:].strip()
-                    task.start_date = datetime.strptime(date_str, '%Y-%m-%d').date()
-                elif field.startswith('#R:'):
-                    task.repeat_start = field[3:].strip() # legacy import for old repeat fields
-                elif field.startswith('#RS:'):
-                    task.repeat_start = field[4:].strip()
-                elif field.startswith('#RD:'):
-                    task.repeat_due = field[4:].strip()
-            except ValueError:
-                pass
-                
-        # Set description excluding special fields
-        task.description = '\n'.join([line.strip() for line in task.notes.splitlines() 
-                                    if not line.strip().startswith('#')])
+        # Parse notes for special fields in one pass. Tag lines go to their field, everything else is the description
+        description_lines = []
+        for line in task.notes.splitlines():
+            line = line.strip()
+            if not line.startswith('#'):
+                description_lines.append(line)
+                continue
+            tag, separator, value = line[1:].partition(':')
+            field = NOTES_TAGS.get(tag) if separator else None
+            if field:
+                try:
+                    setattr(task, field[0], field[1](value.strip()))
+                except ValueError:
+                    pass
+        task.description = '\n'.join(description_lines)
         
         # Handle assigned date
         due_str = response_data.get('due', '')
-        task.assigned_date = datetime.strptime(due_str, '%Y-%m-%dT%H:%M:%S.%fZ').date() if due_str else ''
+        task.assigned_date = date.fromisoformat(due_str[:10]) if due_str else ''
         
         return task
 
@@ -130,6 +229,7 @@ class Task:
         task.description = form_data.get('description', '')
         task.priority = form_data.get('priority', type=int, default=0)
         task.parent_id = form_data.get('parent_id')
+        task.tasklist_id = form_data.get('tasklist_id', '')
 
         start_date_str = form_data.get('start_date', '')
         due_date_str = form_data.get('due_date', '')
@@ -168,7 +268,7 @@ class Task:
         repeat_start_days = form_data.get('repeat-start-days', '')
         repeat_start_from = form_data.get('repeat-start-from', '')
         task.repeat_start = f"{repeat_start_dom} {repeat_start_moy} {repeat_start_dow} {repeat_start_days} {repeat_start_from}"
-        if not validate_repeat(task.repeat_start):
+        if not task.repeat_start_fields().valid:
             task.repeat_start = ''        
 
         repeat_due_dom = form_data.get('repeat-due-dom', '')
@@ -177,7 +277,7 @@ class Task:
         repeat_due_days = form_data.get('repeat-due-days', '')
         repeat_due_from = form_data.get('repeat-due-from', '')
         task.repeat_due = f"{repeat_due_dom} {repeat_due_moy} {repeat_due_dow} {repeat_due_days} {repeat_due_from}"
-        if not validate_repeat(task.repeat_due):
+        if not task.repeat_due_fields().valid:
             task.repeat_due = ''
 
         return task
@@ -1,80 +1,554 @@
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
 from task import Task
 import api
-from typing import Dict, List
+import logging
+import os
+import threading
+import summary
+import timing
 from repeat import next_repeat_task
-from repeat_validation import validate_repeat
-from datetime import datetime, timedelta, date
+from datetime import datetime, timedelta, date, timezone
 
-# TODO maybe this could be a TaskList class, where it stores the creds inside it? That way we don't have to have the global creds we always pass in...
+logger = logging.getLogger(__name__)
 
-# TODO clean this up once we're sure it's working for a while
-def debug_ordering(items):
+SYNC_OVERLAP = timedelta(minutes=1)
+
+# Users whose last full load is kept, so their next one can ask Google for only the pages that changed
+MAX_CACHED_LOADS = int(os.environ.get('MAX_CACHED_LOADS', 100))
+
+def _mutator(method):
+    def mutate(self, *args, **kwargs):
+        self.version += 1
+        return method(self, *args, **kwargs)
+    mutate.__name__ = method.__name__
+    return mutate
+
+class TaskList(list):
+    """
+    A user's tasks in Google's order, along with the creds to save changes to them with.
+
+    Tracks a version number, bumped on every change. The summary stats are kept across versions,
+    updated incrementally by track_changes(), and recounted after any change it wasn't told about.
+
+    Google's order is by task list, then position, with each task's subtasks right after it in
+    their own position order (see order_key). The add/discard/take/replace/place methods keep the
+    list in that order, finding where a task goes by bisecting rather than re-sorting. They also
+    keep an id index and a parent index current, for get() and children_of(); any other change
+    to the list has them rebuilt the next time they're used.
+    """
+    def __init__(self, tasks=(), creds=None):
+        super().__init__(tasks)
+        # Google API credentials, for upsert() and reposition(). Not pickled, since sessions keep their own
+        self.creds = creds
+        self.version = 0
+        self._stats = None
+        self._stats_version = None
+        # The user's default task list, where new tasks that don't say otherwise go
+        self.default_tasklist_id = ''
+        # Task list id -> where its tasks go, in the order Google gives the lists
+        self.tasklist_ranks = {}
+        # Task id -> task, and parent id (or _TOP_LEVEL and a task list id) -> subtasks in order
+        self._by_id = {}
+        self._siblings = {}
+        self._indexes_version = None
+        # Id -> position of removed tasks whose subtasks are still in the list
+        self._removed_parents = {}
+
+    def __reduce__(self):
+        # The default list pickling appends the items before restoring attributes, which the mutators need.
+        # The indexes are left out, since they're quicker to rebuild than to pickle
+        state = {name: value for name, value in self.__dict__.items() if name not in _UNPICKLED}
+        return (TaskList, (list(self),), state)
+
+    __setitem__ = _mutator(list.__setitem__)
+    __delitem__ = _mutator(list.__delitem__)
+    __iadd__ = _mutator(list.__iadd__)
+    append = _mutator(list.append)
+    extend = _mutator(list.extend)
+    insert = _mutator(list.insert)
+    pop = _mutator(list.pop)
+    remove = _mutator(list.remove)
+    clear = _mutator(list.clear)
+    sort = _mutator(list.sort)
+    reverse = _mutator(list.reverse)
+
+    def stats(self):
+        """Get the summary.Stats for today, only recounting them if the list changed untracked or the day rolled over"""
+        today = date.today()
+        stats = getattr(self, '_stats', None)
+        if stats is None or self._stats_version != self.version or stats.today != today.toordinal():
+            stats = self._stats = summary.Stats(self, today)
+            self._stats_version = self.version
+        return stats
+
+    def track_changes(self, since_version, removed=(), added=()):
+        """
+        Update the stats for tasks removed and added since since_version. Does nothing if the stats
+        weren't current as of that version, since then they'll be recounted anyway.
+        """
+        stats = getattr(self, '_stats', None)
+        if stats is None or self._stats_version != since_version:
+            return
+        for task in removed:
+            stats.remove(task)
+        for task in added:
+            stats.add(task)
+        self._stats_version = self.version
+
+    # Indexes
+
+    def _indexes(self):
+        """The id and parent indexes, rebuilt if the list changed other than through the ordered methods"""
+        if getattr(self, '_indexes_version', None) != self.version:
+            self._by_id = {}
+            self._siblings = {}
+            for task in self:
+                if task.id:
+                    self._by_id[task.id] = task
+                self._siblings.setdefault(self._siblings_key(task), []).append(task)
+            self._indexes_version = self.version
+        return self._by_id, self._siblings
+
+    def _siblings_key(self, task):
+        return task.parent_id or (_TOP_LEVEL, task.tasklist_id or self.default_tasklist_id)
+
+    def get(self, task_id):
+        """The task with this id, or None"""
+        return self._indexes()[0].get(task_id)
+
+    def children_of(self, parent_id):
+        """Get the subtasks of the given task, in list order"""
+        return self._indexes()[1].get(parent_id, []) if parent_id else []
+
+    def top_level(self, tasklist_id):
+        """The tasks in the given task list that aren't subtasks, in list order"""
+        return self._indexes()[1].get((_TOP_LEVEL, tasklist_id or self.default_tasklist_id), [])
+
+    def _changed(self, since_version, removed=(), added=(), sibling_index=None):
+        """
+        Bring the stats and the indexes up to date after an ordered change. sibling_index is where the
+        first added task goes among its siblings, when tasks with the same position don't settle it.
+        """
+        self.track_changes(since_version, removed, added)
+        if getattr(self, '_indexes_version', None) != since_version:
+            return
+        # Current from here, so the order keys below don't have them rebuilt
+        self._indexes_version = self.version
+        for task in removed:
+            if self._by_id.get(task.id) is task:
+                del self._by_id[task.id]
+            siblings = self._siblings.get(self._siblings_key(task), [])
+            index = _find(siblings, task, self.order_key)
+            if index is not None:
+                del siblings[index]
+        for i, task in enumerate(added):
+            if task.id:
+                self._by_id[task.id] = task
+            siblings = self._siblings.setdefault(self._siblings_key(task), [])
+            if i > 0 or sibling_index is None:
+                sibling_index = bisect_right(siblings, self.order_key(task), key=self.order_key)
+            siblings.insert(sibling_index, task)
+
+    def assign_id(self, task, task_id):
+        """Give a task that was added to the list without an id (e.g. inserted in a batch) the one Google assigned it"""
+        by_id, _ = self._indexes()
+        task.id = task_id
+        by_id[task_id] = task
+        # A new task has no subtasks yet, so nothing else is indexed by its id
+        version = self.version
+        self.version += 1
+        self.track_changes(version)
+        self._indexes_version = self.version
+
+    def rename(self, old_id, new_id):
+        """
+        Give the task with old_id a new one, along with its subtasks' parent ids, e.g. once Google has assigned it.
+
+        Returns:
+            Whether anything had the old id
+        """
+        by_id, siblings = self._indexes()
+        task = by_id.pop(old_id, None)
+        subtasks = siblings.pop(old_id, None)
+        if task is None and subtasks is None:
+            return False
+        if task is not None:
+            task.id = new_id
+            by_id[new_id] = task
+        if subtasks is not None:
+            for subtask in subtasks:
+                subtask.parent_id = new_id
+            siblings[new_id] = subtasks
+        if old_id in getattr(self, '_removed_parents', {}):
+            self._removed_parents[new_id] = self._removed_parents.pop(old_id)
+        # Same tasks in the same order, so the stats and indexes still hold
+        version = self.version
+        self.version += 1
+        self.track_changes(version)
+        self._indexes_version = self.version
+        return True
+
+    # Google's order
+
+    def _parent_of(self, task):
+        return self.get(task.parent_id) if task.parent_id else None
+
+    def order_key(self, task):
+        """Sort key for where the task goes in Google's order"""
+        ranks = getattr(self, 'tasklist_ranks', {})
+        rank = ranks.get(task.tasklist_id or self.default_tasklist_id, len(ranks))
+        parent = self._parent_of(task)
+        if parent is not None:
+            return _order_key(task, rank, parent.position)
+        # Subtasks of a removed task stay where they were
+        return _order_key(task, rank, getattr(self, '_removed_parents', {}).get(task.parent_id))
+
+    def _index_of(self, task):
+        """Index of this task object, found by bisecting on its order key"""
+        return _find(self, task, self.order_key)
+
+    def _block_end(self, index):
+        """Index just past the task at index and its subtasks"""
+        parent_id = self[index].id
+        end = index + 1
+        while parent_id and end < len(self) and self[end].parent_id == parent_id:
+            end += 1
+        return end
+
+    def _splice(self, index, end, block, sibling_index=None):
+        """Replace self[index:end] with block, keeping the stats and indexes current"""
+        removed = list.__getitem__(self, slice(index, end))
+        version = self.version
+        list.__setitem__(self, slice(index, end), block)
+        self.version += 1
+        self._changed(version, removed=removed, added=block, sibling_index=sibling_index)
+        return removed
+
+    def add(self, task):
+        """Add a task where its position puts it"""
+        index = bisect_right(self, self.order_key(task), key=self.order_key)
+        self._splice(index, index, [task])
+
+    def discard(self, task):
+        """Remove this task object, if it's in the list. Any subtasks it has stay where they are."""
+        index = self._index_of(task)
+        if index is None:
+            return
+        if self._block_end(index) > index + 1:
+            if getattr(self, '_removed_parents', None) is None:
+                self._removed_parents = {}
+            self._removed_parents[task.id] = task.position
+        self._splice(index, index + 1, [])
+
+    def take(self, task):
+        """
+        Remove this task object along with its subtasks, to place() them somewhere else.
+
+        Returns:
+            The removed tasks, the task first (empty if it wasn't in the list)
+        """
+        index = self._index_of(task)
+        if index is None:
+            return []
+        return self._splice(index, self._block_end(index), [])
+
+    def replace(self, old_task, new_task):
+        """Put new_task in place of old_task, moving old_task's subtasks along if new_task's position differs"""
+        index = self._index_of(old_task)
+        if index is not None and self.order_key(new_task) == self.order_key(old_task):
+            self._splice(index, index + 1, [new_task])
+            return
+        subtasks = self.take(old_task)[1:]
+        self.add(new_task)
+        for subtask in subtasks:
+            self.add(subtask)
+
+    def place(self, task, previous=None, subtasks=()):
+        """
+        Add a task (and its subtasks) right after previous, one of its siblings, or first among its siblings,
+        like Google's tasks.insert and tasks.move do. The task gets a position between its new neighbours',
+        until the next sync brings Google's.
+        """
+        parent = self._parent_of(task)
+        rank = self.order_key(task)[0]
+        if previous is not None:
+            index = self._block_end(self._index_of(previous))
+        elif parent is not None:
+            index = self._index_of(parent) + 1
+        else:
+            # First of the list's tasks
+            index = bisect_left(self, rank, key=lambda t: self.order_key(t)[0])
+
+        def bound(neighbour):
+            """The position the task's own has to sort after (or before) to go next to this neighbour in the list"""
+            key = self.order_key(neighbour)
+            if key[0] != rank:
+                return None
+            if parent is None:
+                # A top-level task, or the subtasks of one, or of a removed one, which all sort by the top-level position
+                return key[1]
+            return neighbour.position if self._parent_of(neighbour) is parent else None
+
+        before = lambda: (bound(self[index - 1]) if index > 0 else None) or ''
+        after = lambda: bound(self[index]) if index < len(self) else None
+        task.position = _position_between(before(), after())
+        if task.position is None:
+            # No room between them, e.g. after positions made here ran out of digits, or ones from before they were kept
+            self._renumber(task)
+            task.position = _position_between(before(), after())
+        sibling_index = 0
+        if previous is not None:
+            siblings = self._indexes()[1].get(self._siblings_key(task), [])
+            found = _find(siblings, previous, self.order_key)
+            sibling_index = found + 1 if found is not None else None
+        self._splice(index, index, [task, *subtasks], sibling_index)
+
+    def _renumber(self, task):
+        """
+        Spread out the positions of task's siblings (task itself isn't in the list), keeping their order, so
+        there's room between every two of them. Google's positions come back with the next sync.
+        """
+        parent = self._parent_of(task)
+        if parent is not None:
+            for i, sibling in enumerate(self.children_of(parent.id)):
+                sibling.position = _spaced_position(i)
+            return
+        # Top-level tasks of the list, along with where the subtasks of removed tasks sit between them
+        rank = self.order_key(task)[0]
+        rank_of = lambda t: self.order_key(t)[0]
+        start, end = bisect_left(self, rank, key=rank_of), bisect_right(self, rank, key=rank_of)
+        i = 0
+        orphaned = set()
+        for other in list.__getitem__(self, slice(start, end)):
+            if not other.parent_id:
+                other.position = _spaced_position(i)
+            elif other.parent_id in self._removed_parents and other.parent_id not in orphaned and self.get(other.parent_id) is None:
+                orphaned.add(other.parent_id)
+                self._removed_parents[other.parent_id] = _spaced_position(i)
+            else:
+                continue
+            i += 1
+        logger.debug("Renumbered %d tasks to make room for %s", i, task.title)
+
+    # Saving changes
+
+    def upsert(self, task, batch=None, outbox=None):
+        """Save a task from the form with upsert_task, using the list's creds"""
+        upsert_task(self.creds, self, task, batch, outbox)
+
+    def reposition(self, task, batch=None, outbox=None):
+        """Move a saved task to where its sort key puts it with reorder.reposition_updated_task"""
+        # reorder imports this module
+        from reorder import reposition_updated_task
+        reposition_updated_task(self.creds, self, task, batch, outbox)
+
+def _order_key(task, rank, parent_position=None):
+    """Subtasks sort right after their parent (by the parent's position), in their own position order"""
+    if parent_position is None:
+        return (rank, task.position, 0, '')
+    return (rank, parent_position, 1, task.position)
+
+def _position_between(before, after=None):
+    """
+    A position string that sorts after before and before after (None for no bound). Positions are
+    strings of digits like Google's, so there's nearly always one in between, e.g. '015' between
+    '01' and '02'. Returns None if there isn't: when after isn't past before, or is before and a '0'.
+    """
+    if after is not None and after <= before:
+        return None
+    position = ''
+    for i in range(len(before) + 1):
+        # -1 once past the end of before, where any digit sorts after it
+        low = int(before[i]) if i < len(before) else -1
+        high = int(after[i]) if after is not None else 10
+        if high - low > 1:
+            return position + str((low + high + 1) // 2)
+        if low < 0:
+            # after carries on with a 0 here: if there's more of it, that 0 is a prefix of after that sorts between them
+            position += '0'
+            return position if len(after) > len(position) else None
+        position += str(low)
+        if low < high:
+            # Now below after whatever follows, so only before bounds the rest
+            after = None
+    # Unreachable: the loop always returns once past the end of before
+    return None
+
+def _spaced_position(index):
+    """Position of the index'th of a run of renumbered siblings, leaving room between each"""
+    return f'{(index + 1) * 1000:020d}'
+
+_TOP_LEVEL = 'top level'
+_UNPICKLED = ('creds', '_by_id', '_siblings', '_indexes_version')
+
+def _find(tasks, task, key):
+    """Index of this task object in tasks, which are sorted by key"""
+    task_key = key(task)
+    index = bisect_left(tasks, task_key, key=key)
+    while index < len(tasks) and tasks[index] is not task and key(tasks[index]) == task_key:
+        index += 1
+    if index < len(tasks) and tasks[index] is task:
+        return index
+    # Out of order (e.g. a session from before positions were kept), so look for it
+    return next((i for i, t in enumerate(tasks) if t is task), None)
+
+# User -> {task list id -> [(page stub, tasks parsed from the page)]} for the pages of each user's last full load.
+# A stub is just the page's etag and next page token, all api.get_all_tasks needs to ask for the page only if it
+# changed, and to carry on past it if it didn't. Kept for the last MAX_CACHED_LOADS users
+_listings = OrderedDict()
+_listings_lock = threading.Lock()
+
+def _cached_listings(creds):
+    user = api.user_key(creds)
+    with _listings_lock:
+        return _listings.get(user, {}) if user is not None else {}
+
+def _page_stub(page):
+    return {name: page[name] for name in ('etag', 'nextPageToken') if name in page}
+
+def _parse_pages(creds, responses_by_tasklist, previous):
+    """
+    The tasks of every response page. Pages Google reported unchanged since the user's previous load come back
+    as its stubs, and their tasks are copied from it rather than parsed again; the cached tasks themselves are
+    never handed out, since loaded tasks get changed in place.
+    """
+    # The previous load's stubs are all still referenced, so their ids are unique
+    parsed_by_stub = {id(stub): parsed for pages in previous.values() for stub, parsed in pages}
+    listings = {}
+    tasks = []
+    for tasklist_id, api_responses in responses_by_tasklist.items():
+        pages = listings[tasklist_id] = []
+        for page in api_responses:
+            parsed = parsed_by_stub.get(id(page))
+            if parsed is None:
+                parsed = [Task.from_api_response(item, tasklist_id) for item in page.get('items', [])]
+                page = _page_stub(page)
+            pages.append((page, parsed))
+            tasks.extend(task.copy() for task in parsed)
+    user = api.user_key(creds)
+    if user is not None:
+        with _listings_lock:
+            _listings[user] = listings
+            _listings.move_to_end(user)
+            while len(_listings) > MAX_CACHED_LOADS:
+                _listings.popitem(last=False)
+    return tasks
+
+def evict_listings(creds):
+    """Forget this user's last full load, e.g. when the session ends"""
+    with _listings_lock:
+        _listings.pop(api.user_key(creds), None)
+
+def from_api(creds) -> TaskList:
+    previous = _cached_listings(creds)
+    cached_listings = {tasklist_id: [stub for stub, _ in pages] for tasklist_id, pages in previous.items()}
+    responses_by_tasklist = api.get_all_tasklists_tasks(creds, cached_listings=cached_listings)
+    with timing.timer('parse'):
+        tasks = TaskList(_parse_pages(creds, responses_by_tasklist, previous))
+    tasks.creds = creds
+    tasks.tasklist_ranks = ranks = {tasklist_id: rank for rank, tasklist_id in enumerate(responses_by_tasklist)}
+    tasks.default_tasklist_id = next(iter(responses_by_tasklist), '')
+    # Google API returns tasks by last updated, so put them in its order: each list's tasks together, in the
+    # order of the lists, by position, with subtasks right after their parent
+    with timing.timer('sort'):
+        positions = {task.id: task.position for task in tasks}
+        tasks.sort(key=lambda task: _order_key(task, ranks[task.tasklist_id], positions.get(task.parent_id)))
+    logger.debug("Fetched %d tasks from %d lists", len(tasks), len(responses_by_tasklist))
+    return tasks
+
+def sync(creds, tasks=None, synced_at=None):
+    """
+    Bring the cached tasks up to date with Google.
+
+    With a warm cache only the tasks changed since the last sync are fetched and merged in by id,
+    otherwise this falls back to a full from_api fetch.
+
+    Args:
+        creds: Google API credentials
+        tasks: Cached list of tasks from the last sync, if any
+        synced_at: Timestamp returned by the last sync, if any
+
+    Returns:
+        Tuple of the up to date task list and the timestamp to pass to the next sync
+    """
+    # Overlap a little with the previous sync so clock skew between us and google can't drop changes
+    next_synced_at = (datetime.now(timezone.utc) - SYNC_OVERLAP).strftime('%Y-%m-%dT%H:%M:%S.000Z')
+    # Sessions cached before TaskList, or before positions were kept, can't be merged into in order
+    if not tasks or not synced_at or not isinstance(tasks, TaskList) or not getattr(tasks, 'tasklist_ranks', None):
+        return from_api(creds), next_synced_at
+
+    responses_by_tasklist = api.get_all_tasklists_tasks(creds, updated_min=synced_at)
+    with timing.timer('merge'):
+        for tasklist_id, api_responses in responses_by_tasklist.items():
+            changed_items = [item for response in api_responses for item in response.get("items", [])]
+            merge_changes(tasks, changed_items, tasklist_id)
+            logger.debug("Merged %d changed tasks from list %s", len(changed_items), tasklist_id)
+    tasks.creds = creds
+    return tasks, next_synced_at
+
+def merge_changes(tasks, changed_items, tasklist_id=''):
     """
-    Debug function to analyze task ordering from Google Tasks API.
-    
+    Merge changed task items from the API into the task list in place, matching by id.
+
+    Completed, deleted and hidden tasks are removed, and changed and new tasks go where their
+    position puts them.
+
     Args:
-        items: List of task items from API responses
+        tasks: TaskList to update
+        changed_items: Task dictionaries from the API
+        tasklist_id: ID of the task list the items are from
     """
-    print("=== DEBUG: Task Ordering Analysis ===")
-    
-    print(f"Total tasks fetched: {len(items)}")
-    
-    # Print first 10 tasks for comparison with UI
-    print("\nFirst 10 tasks from API:")
-    for i, task in enumerate(items[:10]):
-        print(f"{i+1}. {task.get('title', 'No title')} (ID: {task.get('id', 'No ID')})")
-    
-    # Count tasks with position field and print first 10 position values
-    tasks_with_position = [task for task in items if 'position' in task]
-    print(f"\nTasks with position field: {len(tasks_with_position)} out of {len(items)}")
-    
-    print("\nFirst 10 position values:")
-    for i, task in enumerate(tasks_with_position[:10]):
-        print(f"{i+1}. {task.get('title', 'No title')} - Position: {task.get('position')}")
-    
-    # Check if tasks are in position field order
-    positions = [task.get('position') for task in items if 'position' in task]
-    is_in_order = all(positions[i] <= positions[i+1] for i in range(len(positions)-1))
-    print(f"\nTasks in position field order: {is_in_order}")
-    
-    print("=== END DEBUG ===\n")
-
-def from_api(creds) -> List[Task]:
-    api_responses = api.get_all_tasks(creds)
-    items = [item for response in api_responses for item in response.get("items", [])]
-    # Sort by position field to maintain proper order (Google API returns by last updated, not position)
-    # TODO might be better to store position on Task and sort when needed so we don't have to worry about keeping tasks in the correct UI order
-    items.sort(key=lambda x: x.get('position', ''))
-    debug_ordering(items)
-    return [Task.from_api_response(item) for item in items]
-
-def upsert_task(creds, tasks, task):
+    # Parents first, so their subtasks can go under them
+    for item in sorted(changed_items, key=lambda item: bool(item.get('parent'))):
+        old_task = tasks.get(item.get('id'))
+        if item.get('deleted') or item.get('hidden') or item.get('status') == 'completed':
+            if old_task is not None:
+                tasks.discard(old_task)
+        elif old_task is not None:
+            tasks.replace(old_task, Task.from_api_response(item, tasklist_id))
+        else:
+            tasks.add(Task.from_api_response(item, tasklist_id))
+
+def upsert_task(creds, tasks, task, batch=None, outbox=None):
     if task.id:
         if task.deleted:
-            delete_task(creds, tasks, task)
+            delete_task(creds, tasks, task, batch, outbox)
         else:
-            update_task(creds, tasks, task)
+            update_task(creds, tasks, task, batch, outbox)
     else:
-        insert_task(creds, tasks, task)
-
-def update_task(creds, tasks, task):
-    api.patch_task(creds, task)
-    # Remove old task from the array, and only replace it if not completed
-    tasks[:] = [t for t in tasks if t.id != task.id]
-    if not task.completed:
-        tasks.append(task)
-    if task.completed and (validate_repeat(task.repeat_start) or validate_repeat(task.repeat_due)):
-        insert_task(creds, tasks, next_repeat_task(task))
-
-def insert_task(creds, tasks, task):
-    result = api.insert_task(creds, task)
-    task.id = result['id']
-    if task.parent_id:
-        api.move_task(creds, task.id, task.parent_id, None)
-        # TODO we don't want to prepend child tasks, we want to insert them in the array right after the parent (this is how google sorts them by default)
-    tasks.insert(0, task)
-
-def delete_task(creds, tasks, task):
+        insert_task(creds, tasks, task, batch, outbox)
+
+def update_task(creds, tasks, task, batch=None, outbox=None):
+    api.patch_task(creds, task, batch=batch, outbox=outbox)
+    # Patching doesn't move a task, so it stays where the old one was
+    old_task = tasks.get(task.id)
+    if old_task is not None and not task.position:
+        task.position = old_task.position
+    if task.completed:
+        if old_task is not None:
+            tasks.discard(old_task)
+    elif old_task is not None:
+        tasks.replace(old_task, task)
+    else:
+        tasks.add(task)
+    if task.completed and (task.repeat_start_fields().valid or task.repeat_due_fields().valid):
+        insert_task(creds, tasks, next_repeat_task(task), batch, outbox)
+
+def insert_task(creds, tasks, task, batch=None, outbox=None):
+    # Subtasks are created directly under their parent, so no separate move is needed.
+    # When batched, the new id is filled in on the task once the batch is sent. When deferred, it gets a temporary one
+    if not task.tasklist_id:
+        task.tasklist_id = tasks.default_tasklist_id
+    result = api.insert_task(creds, task, batch=batch, outbox=outbox)
+    if result:
+        task.id = result['id']
+    elif batch is not None:
+        batch.on_created(task, tasks.assign_id)
+    # Google puts new tasks first among their siblings
+    tasks.place(task)
+
+def delete_task(creds, tasks, task, batch=None, outbox=None):
     # FIXME this throws a 500 internal server error on google's side...
     # api.delete_task(creds, task)
     # tasks[:] = [t for t in tasks if t.id != task.id]
@@ -82,5 +556,5 @@ def delete_task(creds, tasks, task):
     task.assigned_date = ''
     task.completed = datetime.now().date().strftime('%Y-%m-%dT%H:%M:%SZ')
     task.status = 'completed'
-    update_task(creds, tasks, task)
+    update_task(creds, tasks, task, batch, outbox)
     # TODO make sure repeat doens't create a new one when deleting here
@@ -1,3 +1,291 @@
 import pytest
 from unittest.mock import Mock, patch
-import api
\ No newline at end of file
+import api
+from google.oauth2.credentials import Credentials
+
+@pytest.fixture(autouse=True)
+def clear_service_cache():
+    api._service_cache.clear()
+    yield
+    api._service_cache.clear()
+
+def test_get_service__reuses_service_for_same_creds():
+    creds = Credentials(token='token1')
+    assert api.get_service(creds) is api.get_service(creds)
+
+def test_get_service__separate_services_for_different_creds():
+    assert api.get_service(Credentials(token='token1')) is not api.get_service(Credentials(token='token1'))
+
+def test_get_service__rebuilds_after_refresh():
+    creds = Credentials(token='token1')
+    service = api.get_service(creds)
+    creds.token = 'token2'
+    assert api.get_service(creds) is not service
+
+def test_get_service__uses_bundled_discovery_document():
+    with patch('api._build_service', wraps=api._build_service) as mock_build:
+        creds = Credentials(token='token1')
+        api.get_service(creds)
+        api.get_service(creds)
+        mock_build.assert_called_once_with(creds)
+
+def test_get_service__dict_creds_not_cached():
+    with patch('api._build_service') as mock_build:
+        api.get_service({'token': 'token1'})
+        api.get_service({'token': 'token1'})
+        assert mock_build.call_count == 2
+
+def test_evict_service():
+    creds = Credentials(token='token1')
+    service = api.get_service(creds)
+    api.evict_service(creds)
+    assert creds not in api._service_cache
+    assert api.get_service(creds) is not service
+
+class FakeBatchRequest:
+    """Stand-in for googleapiclient's BatchHttpRequest that answers each request from a list of responses."""
+    def __init__(self, callback, responses):
+        self.callback = callback
+        self.responses = responses
+        self.request_ids = []
+        self.execute_count = 0
+
+    def add(self, request, request_id=None):
+        self.request_ids.append(request_id)
+
+    def execute(self):
+        self.execute_count += 1
+        for request_id, (response, exception) in zip(self.request_ids, self.responses):
+            self.callback(request_id, response, exception)
+
+@pytest.fixture
+def fake_batch(monkeypatch):
+    batch_requests = []
+    def new_batch_http_request(callback):
+        batch_requests.append(FakeBatchRequest(callback, responses))
+        return batch_requests[-1]
+    responses = []
+    service = Mock()
+    service.new_batch_http_request.side_effect = new_batch_http_request
+    monkeypatch.setattr(api, 'get_service', lambda creds: service)
+    return responses, batch_requests
+
+def test_batch__sends_all_mutations_in_one_request(fake_batch):
+    from task import Task
+    responses, batch_requests = fake_batch
+    responses.extend([({'id': 'task1'}, None), ({'id': 'new'}, None), ({'id': 'task1'}, None)])
+    patched, inserted = Task(id='task1'), Task(title='New')
+    with api.Batch(Mock()) as batch:
+        assert api.patch_task(batch.creds, patched, batch=batch) is None
+        api.insert_task(batch.creds, inserted, batch=batch)
+        api.move_task(batch.creds, 'task1', None, None, batch=batch)
+        assert len(batch) == 3
+    assert len(batch_requests) == 1
+    assert batch_requests[0].execute_count == 1
+    assert inserted.id == 'new'
+    assert patched.id == 'task1'
+
+def test_batch__raises_sub_request_error(fake_batch):
+    from task import Task
+    responses, _ = fake_batch
+    responses.append((None, ValueError('bad request')))
+    batch = api.Batch(Mock())
+    api.patch_task(batch.creds, Task(id='task1'), batch=batch)
+    with pytest.raises(ValueError):
+        batch.execute()
+
+def test_batch__inserted_task_indexed_by_its_new_id(fake_batch):
+    from task import Task
+    from tasklist import TaskList
+    responses, _ = fake_batch
+    responses.append(({'id': 'newid'}, None))
+    tasks = TaskList([Task(id='task1', title='Task 1', priority=3)])
+    new_task = Task(title='New', priority=0)
+    with api.Batch(None) as batch:
+        tasks.upsert(new_task, batch=batch)
+        tasks.reposition(new_task, batch=batch)
+    assert new_task.id == 'newid'
+    assert tasks.get('newid') is new_task
+    assert tasks.top_level(None)[0] is new_task
+
+def test_batch__results_in_order_added(fake_batch):
+    from task import Task
+    responses, _ = fake_batch
+    error = ValueError('bad request')
+    responses.extend([({'id': 'task1'}, None), (None, error)])
+    batch = api.Batch(Mock())
+    api.patch_task(batch.creds, Task(id='task1'), batch=batch)
+    api.patch_task(batch.creds, Task(id='task2'), batch=batch)
+    batch.execute(raise_errors=False)
+    assert batch.results == [({'id': 'task1'}, None), (None, error)]
+
+def test_batch__empty_batch_sends_nothing(fake_batch):
+    _, batch_requests = fake_batch
+    with api.Batch(Mock()):
+        pass
+    assert batch_requests == []
+
+class FakeListRequest:
+    def __init__(self, result, next_request=None):
+        self.result = result
+        self.next_request = next_request
+
+    def execute(self):
+        return self.result
+
+def test_get_tasklists__follows_pages(monkeypatch):
+    service = Mock()
+    service.tasklists().list.return_value = FakeListRequest(
+        {'items': [{'id': 'default'}]}, FakeListRequest({'items': [{'id': 'work'}]}))
+    service.tasklists().list_next.side_effect = lambda request, result: request.next_request
+    monkeypatch.setattr(api, 'get_service', lambda creds: service)
+    assert api.get_tasklists(Mock()) == ['default', 'work']
+
+def test_get_all_tasklists_tasks__fetches_lists_concurrently(monkeypatch):
+    import threading
+    # Every list's fetch waits for all the others to start, so this only finishes if they run at once
+    barrier = threading.Barrier(3, timeout=5)
+    threads = {}
+    def get_all_tasks(creds, updated_min, tasklist_id, cached_pages):
+        threads[tasklist_id] = threading.current_thread()
+        barrier.wait()
+        return [{'items': [{'id': tasklist_id + '-task'}]}]
+    monkeypatch.setattr(api, 'get_all_tasks', get_all_tasks)
+
+    result = api.get_all_tasklists_tasks(Mock(), tasklist_ids=['a', 'b', 'c'])
+    assert list(result) == ['a', 'b', 'c']
+    assert result['b'] == [{'items': [{'id': 'b-task'}]}]
+    assert len(set(threads.values())) == 3
+
+    # The next reload runs on the same threads, so their cached services are reused
+    first_threads = set(threads.values())
+    api.get_all_tasklists_tasks(Mock(), tasklist_ids=['a', 'b', 'c'])
+    assert set(threads.values()) == first_threads
+
+def test_get_all_tasklists_tasks__discovers_lists(monkeypatch):
+    monkeypatch.setattr(api, 'get_tasklists', lambda creds: ['default'])
+    monkeypatch.setattr(api, 'get_all_tasks', lambda creds, updated_min, tasklist_id, cached_pages: [{'items': []}])
+    assert api.get_all_tasklists_tasks(Mock(), updated_min='2024-01-01T00:00:00.000Z') == {'default': [{'items': []}]}
+
+def test_mutations_target_the_tasks_list(fake_batch):
+    from task import Task
+    service = api.get_service(None)
+    api.patch_task(None, Task(id='task1', tasklist_id='work'))
+    assert service.tasks().patch.call_args.kwargs['tasklist'] == 'work'
+    api.insert_task(None, Task(title='New'))
+    assert service.tasks().insert.call_args.kwargs['tasklist'] == api.DEFAULT_TASKLIST
+
+from googleapiclient.discovery import build_from_document
+from googleapiclient.http import HttpMockSequence
+
+TASKS_PAGE = '{"items": [{"id": "task1", "title": "Task 1"}]}'
+
+@pytest.fixture
+def fake_http(monkeypatch):
+    """Serve API requests from a sequence of canned (headers, body) responses instead of Google"""
+    sleeps = []
+    monkeypatch.setattr(api, '_sleep', sleeps.append)
+    monkeypatch.setattr(api, '_rate_limiters', api.OrderedDict())
+    def serve(*responses):
+        http = HttpMockSequence(list(responses))
+        monkeypatch.setattr(api, 'get_service', lambda creds: build_from_document(api._discovery_doc, http=http))
+        return http
+    serve.sleeps = sleeps
+    return serve
+
+def test_execute__retries_server_errors(fake_http):
+    http = fake_http(({'status': '503'}, ''), ({'status': '500'}, ''), ({'status': '200'}, TASKS_PAGE))
+    assert api.get_tasks(None)['items'][0]['id'] == 'task1'
+    assert len(http.request_sequence) == 3
+    assert len(fake_http.sleeps) == 2
+    assert fake_http.sleeps[1] <= api.RETRY_DELAY_SECONDS * 2
+
+def test_execute__honors_retry_after(fake_http):
+    fake_http(({'status': '429', 'retry-after': '7'}, ''), ({'status': '200'}, TASKS_PAGE))
+    api.get_tasks(None)
+    assert fake_http.sleeps == [7.0]
+
+def test_execute__gives_up_on_long_retry_after(fake_http):
+    http = fake_http(({'status': '503', 'retry-after': '3600'}, ''), ({'status': '200'}, TASKS_PAGE))
+    with pytest.raises(api.HttpError):
+        api.get_tasks(None)
+    assert len(http.request_sequence) == 1
+    assert fake_http.sleeps == []
+
+def test_execute__gives_up_after_max_retries(fake_http, monkeypatch):
+    monkeypatch.setattr(api, 'MAX_RETRIES', 2)
+    http = fake_http(*[({'status': '503'}, '')] * 3)
+    with pytest.raises(api.HttpError):
+        api.get_tasks(None)
+    assert len(http.request_sequence) == 3
+
+def test_execute__client_errors_not_retried(fake_http):
+    http = fake_http(({'status': '400'}, ''), ({'status': '200'}, TASKS_PAGE))
+    with pytest.raises(api.HttpError):
+        api.get_tasks(None)
+    assert len(http.request_sequence) == 1
+
+def test_execute__refreshes_creds_on_401(fake_http):
+    creds = Mock(refresh_token='refresh', token='token')
+    fake_http(({'status': '401'}, ''), ({'status': '200'}, TASKS_PAGE))
+    assert api.get_tasks(creds)['items']
+    creds.refresh.assert_called_once()
+
+def test_execute__second_401_raises(fake_http):
+    creds = Mock(refresh_token='refresh', token='token')
+    fake_http(({'status': '401'}, ''), ({'status': '401'}, ''))
+    with pytest.raises(api.HttpError):
+        api.get_tasks(creds)
+    creds.refresh.assert_called_once()
+
+def test_execute__waits_for_rate_limit(fake_http, monkeypatch):
+    monkeypatch.setattr(api, 'BURST', 2)
+    monkeypatch.setattr(api, 'RATE_PER_SECOND', 4)
+    creds = Mock(refresh_token='refresh', token='token')
+    fake_http(*[({'status': '200'}, TASKS_PAGE)] * 3)
+    for _ in range(3):
+        api.get_tasks(creds)
+    assert len(fake_http.sleeps) == 1
+    assert 0 < fake_http.sleeps[0] <= 0.25
+
+def test_get_all_tasks__conditional_on_last_listing(fake_http):
+    creds = Mock(refresh_token='refresh', token='token')
+    page1 = '{"etag": "\\"e1\\"", "nextPageToken": "p2", "items": [{"id": "task1"}]}'
+    page2 = '{"etag": "\\"e2\\"", "items": [{"id": "task2"}]}'
+    http = fake_http(({'status': '200'}, page1), ({'status': '200'}, page2))
+    first = api.get_all_tasks(creds)
+    assert 'If-None-Match' not in http.request_sequence[0][3]
+
+    # Only the stubs of the last listing's pages are needed
+    stubs = [{'etag': '"e1"', 'nextPageToken': 'p2'}, {'etag': '"e2"'}]
+    changed_page2 = '{"etag": "\\"e3\\"", "items": [{"id": "task2", "title": "Changed"}]}'
+    http = fake_http(({'status': '304'}, ''), ({'status': '200'}, changed_page2))
+    second = api.get_all_tasks(creds, cached_pages=stubs)
+    assert [headers.get('If-None-Match') for _, _, _, headers in http.request_sequence] == ['"e1"', '"e2"']
+    assert second[0] is stubs[0]
+    assert second[1]['items'][0]['title'] == 'Changed'
+    assert first[1]['items'][0]['id'] == 'task2'
+
+    # Changes only listings aren't conditional
+    http = fake_http(({'status': '200'}, page2))
+    api.get_all_tasks(creds, updated_min='2025-01-01T00:00:00.000Z', cached_pages=stubs)
+    assert 'If-None-Match' not in http.request_sequence[0][3]
+
+def test_token_bucket():
+    now = [0.0]
+    bucket = api.TokenBucket(rate=2, capacity=2, clock=lambda: now[0])
+    assert [bucket.reserve() for _ in range(3)] == [0.0, 0.0, 0.5]
+    now[0] = 2.0
+    assert bucket.reserve() == 0.0
+
+def test_rate_limiter_per_user():
+    assert api._rate_limiter(Mock(refresh_token='a')) is api._rate_limiter(Mock(refresh_token='a'))
+    assert api._rate_limiter(Mock(refresh_token='a')) is not api._rate_limiter(Mock(refresh_token='b'))
+    assert api._rate_limiter(None) is None
+
+def test_retry_after_http_date():
+    from email.utils import format_datetime
+    from datetime import datetime, timedelta, timezone
+    later = format_datetime(datetime.now(timezone.utc) + timedelta(seconds=30), usegmt=True)
+    error = api.HttpError(Mock(status=503, get=lambda header: later), b'')
+    assert 25 < api._retry_after(error) <= 30
@@ -8,6 +8,7 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
 import app
 import session
 import api
+import tasklist
 from task import Task
 
 @pytest.fixture
@@ -84,9 +85,11 @@ class TestSessionManagement:
         assert session.session_store['client2-session']['tasks'][0].title == 'Client 2 Task'
 
 class TestRouteOperations:
+    @patch('app.Outbox')
+    @patch('reorder.reposition_updated_task')
     @patch('app.get_session_creds')
     @patch('app.tasklist.upsert_task')
-    def test_update_task_with_session(self, mock_upsert, mock_get_creds, client, mock_creds, mock_tasks):
+    def test_update_task_with_session(self, mock_upsert, mock_get_creds, mock_reposition, mock_outbox, client, mock_creds, mock_tasks):
         """Test task update uses session credentials"""
         mock_creds_obj = Mock()
         mock_get_creds.return_value = mock_creds_obj
@@ -103,6 +106,28 @@ class TestRouteOperations:
         assert response.status_code == 302
         mock_get_creds.assert_called_once_with(mock_creds)
         mock_upsert.assert_called_once()
+        # Saved through the session's TaskList, with its creds
+        assert mock_upsert.call_args.args[0] is mock_creds_obj
+        assert isinstance(mock_upsert.call_args.args[1], tasklist.TaskList)
+
+    @patch('app.Outbox')
+    @patch('reorder.reposition_updated_task')
+    @patch('app.get_session_creds')
+    @patch('app.tasklist.upsert_task')
+    def test_update_task_sent_straight_away_with_shared_sessions(self, mock_upsert, mock_get_creds, mock_reposition, mock_outbox, client, mock_creds, mock_tasks, monkeypatch):
+        """Other processes can't see the write-behind queue, so it isn't used when they share the sessions"""
+        monkeypatch.setattr(session.session_store, 'shared', True)
+        with client.session_transaction() as sess:
+            sess['session_id'] = 'test-session-id'
+        session.session_store['test-session-id'] = {'creds': mock_creds, 'tasks': mock_tasks}
+
+        response = client.post('/update', data={'title': 'New Task'})
+        assert response.status_code == 302
+        mock_outbox.assert_not_called()
+        batch = mock_upsert.call_args.args[3]
+        assert isinstance(batch, api.Batch)
+        assert mock_upsert.call_args.args[4] is None
+        assert mock_reposition.call_args.args[3:] == (batch, None)
 
     def test_reload_tasks_with_session(self, client, mock_creds, mock_tasks):
         """Test reload route requires authentication and redirects properly"""
@@ -204,4 +229,88 @@ class TestSessionSizeAndLoops:
         # Second request should still work
         with patch('summary.get_stats'), patch('filter.filter_tasks'), patch('sort.get_sorted_tasks'):
             response2 = client.get('/')
-            assert response2.status_code == 200
\ No newline at end of file
+            assert response2.status_code == 200
+class TestDebugTimings:
+    def test_debug_timings_disabled_by_default(self, client, mock_creds, mock_tasks):
+        with client.session_transaction() as sess:
+            sess['session_id'] = 'test-session-id'
+        session.session_store['test-session-id'] = {'creds': mock_creds, 'tasks': mock_tasks}
+        assert client.get('/debug/timings').status_code == 404
+
+    def test_reload_records_stage_timings(self, client, mock_creds, mock_tasks, monkeypatch):
+        import timing
+        monkeypatch.setattr(timing, 'enabled', True)
+        with client.session_transaction() as sess:
+            sess['session_id'] = 'test-session-id'
+        session.session_store['test-session-id'] = {'creds': mock_creds, 'tasks': mock_tasks}
+
+        def fake_sync(creds, tasks, synced_at):
+            with timing.timer('parse'):
+                pass
+            return tasks, '2024-01-01T00:00:00.000Z'
+
+        with patch('app.get_session_creds'), patch('app.tasklist.sync', side_effect=fake_sync):
+            reload_response = client.get('/reload')
+        # The request's own profile still has the reload's stages
+        assert reload_response.headers['Server-Timing'].startswith('parse;dur=')
+        response = client.get('/debug/timings')
+        assert response.status_code == 200
+        assert [entry['stage'] for entry in response.get_json()['reload']] == ['parse']
+
+class TestRequestProfiling:
+    def test_no_server_timing_when_disabled(self, client, mock_creds, mock_tasks):
+        with client.session_transaction() as sess:
+            sess['session_id'] = 'test-session-id'
+        session.session_store['test-session-id'] = {'creds': mock_creds, 'tasks': mock_tasks}
+        response = client.get('/')
+        assert 'Server-Timing' not in response.headers
+        assert client.get('/metrics').status_code == 404
+
+    def test_index_server_timing_and_metrics(self, client, mock_creds, mock_tasks, monkeypatch):
+        import timing
+        monkeypatch.setattr(timing, 'enabled', True)
+        monkeypatch.setattr(timing, 'histograms', {})
+        with client.session_transaction() as sess:
+            sess['session_id'] = 'test-session-id'
+        session.session_store['test-session-id'] = {'creds': mock_creds, 'tasks': mock_tasks}
+
+        response = client.get('/')
+        spans = [entry.split(';')[0] for entry in response.headers['Server-Timing'].split(', ')]
+        assert spans == ['summary.get_stats', 'get_top_tasks', 'render_template', 'request.index']
+
+        metrics = client.get('/metrics')
+        assert metrics.status_code == 200
+        assert metrics.mimetype == 'text/plain'
+        assert 'todo_span_seconds{span="render_template",quantile="0.5"}' in metrics.get_data(as_text=True)
+        assert 'todo_span_seconds_count{span="request.index"} 1' in metrics.get_data(as_text=True)
+
+class TestWriteBehind:
+    def test_update_returns_before_google_is_called(self, client, mock_creds, monkeypatch):
+        import writeback
+        queue = writeback.WriteBehindQueue()
+        queued = []
+        monkeypatch.setattr(queue, 'put', queued.extend)
+        monkeypatch.setattr(writeback, 'write_queue', queue)
+        monkeypatch.setattr('app.write_queue', queue)
+        with client.session_transaction() as sess:
+            sess['session_id'] = 'test-session-id'
+        session.session_store['test-session-id'] = {'creds': mock_creds, 'tasks': [Task(id='1', title='Task 1')]}
+
+        with patch('app.get_session_creds'), patch('api.get_service') as mock_get_service:
+            response = client.post('/update', data={'task_id': '1', 'title': 'Edited'})
+        assert response.status_code == 302
+        mock_get_service.assert_not_called()
+        assert [pending.call.__name__ for pending in queued] == ['patch_task', 'move_task']
+        assert session.session_store['test-session-id']['tasks'][0].title == 'Edited'
+
+    def test_index_shows_write_failures_once(self, client, mock_creds, mock_tasks, monkeypatch):
+        import writeback
+        queue = writeback.WriteBehindQueue()
+        queue._failures['test-session-id'] = ["Couldn't patch task Task 1: HTTP 400"]
+        monkeypatch.setattr('app.write_queue', queue)
+        with client.session_transaction() as sess:
+            sess['session_id'] = 'test-session-id'
+        session.session_store['test-session-id'] = {'creds': mock_creds, 'tasks': mock_tasks}
+
+        assert "Couldn&#39;t patch task Task 1: HTTP 400" in client.get('/').get_data(as_text=True)
+        assert "Couldn&#39;t patch task" not in client.get('/').get_data(as_text=True)
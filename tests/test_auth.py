@@ -7,8 +7,11 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
 
 import app
 import session
-from auth import get_session_creds, complete_oauth_flow, _oauth_flows, SCOPES
+from auth import get_session_creds, complete_oauth_flow, _oauth_flows, SCOPES, CredsCache, creds_cache
 from task import Task
+from datetime import datetime, timedelta, timezone
+import api
+import auth
 
 @pytest.fixture
 def client():
@@ -45,6 +48,12 @@ def clear_oauth_flows():
     yield
     _oauth_flows.clear()
 
+@pytest.fixture(autouse=True)
+def clear_creds_cache():
+    creds_cache.clear()
+    yield
+    creds_cache.clear()
+
 class TestAuthentication:
     def test_index_redirects_without_auth(self, client):
         """Test that index route redirects to /auth when not authenticated"""
@@ -77,6 +86,34 @@ class TestAuthentication:
         assert response.status_code == 302
         assert response.location == '/'
 
+    @patch('auth.get_session_creds')
+    @patch('app.tasklist.sync')
+    def test_auth_transient_error_keeps_session(self, mock_sync, mock_get_creds, client, mock_creds):
+        """A Google outage while loading tasks shouldn't log the user out"""
+        from googleapiclient.errors import HttpError
+        mock_get_creds.return_value = mock_creds
+        mock_sync.side_effect = HttpError(Mock(status=503), b'')
+        with client.session_transaction() as sess:
+            sess['session_id'] = 'test-session-id'
+        session.session_store['test-session-id'] = {'creds': mock_creds}
+
+        response = client.get('/auth')
+        assert response.status_code == 503
+        assert session.session_store['test-session-id']['creds'] == mock_creds
+
+    @patch('auth.get_session_creds')
+    @patch('app.tasklist.sync')
+    def test_auth_client_error_ends_session(self, mock_sync, mock_get_creds, client, mock_creds):
+        from googleapiclient.errors import HttpError
+        mock_get_creds.return_value = mock_creds
+        mock_sync.side_effect = HttpError(Mock(status=403), b'')
+        with client.session_transaction() as sess:
+            sess['session_id'] = 'test-session-id'
+        session.session_store['test-session-id'] = {'creds': mock_creds}
+
+        assert client.get('/auth').status_code == 500
+        assert 'test-session-id' not in session.session_store
+
     @patch('auth.get_session_creds')
     def test_auth_redirects_to_google(self, mock_get_creds, client):
         """Test authentication flow redirects to Google when new auth is needed"""
@@ -269,4 +306,70 @@ class TestOAuthFlow:
         
         assert result == mock_creds
         mock_flow.fetch_token.assert_called_once_with(authorization_response=authorization_response)
-        assert state not in _oauth_flows
\ No newline at end of file
+        assert state not in _oauth_flows
+def make_creds(refresh_token='refresh', expires_in=timedelta(hours=1)):
+    from google.oauth2.credentials import Credentials
+    return Credentials(token='token', refresh_token=refresh_token, expiry=datetime.now(timezone.utc).replace(tzinfo=None) + expires_in)
+
+class TestCredsCache:
+    def test_dict_creds_reuse_cached_object(self):
+        creds_dict = {'token': 'token', 'refresh_token': 'refresh', 'client_id': 'id', 'client_secret': 'secret'}
+        with patch('google.oauth2.credentials.Credentials.from_authorized_user_info', return_value=make_creds()) as mock_from_info:
+            first = get_session_creds(creds_dict)
+            assert get_session_creds(creds_dict) is first
+        mock_from_info.assert_called_once()
+
+    def test_session_copy_uses_fresher_cached_creds(self):
+        cached = make_creds()
+        creds_cache.put(cached)
+        stale_copy = make_creds(expires_in=timedelta(hours=-1))
+        stale_copy.refresh = Mock()
+        assert get_session_creds(stale_copy) is cached
+        stale_copy.refresh.assert_not_called()
+
+    def test_refresh_due_only_refreshes_expiring_creds(self):
+        cache = CredsCache()
+        expiring, fresh = make_creds('a', timedelta(minutes=2)), make_creds('b', timedelta(minutes=30))
+        expiring.refresh, fresh.refresh = Mock(), Mock()
+        cache.put(expiring)
+        cache.put(fresh)
+        assert cache.refresh_due() == 1
+        expiring.refresh.assert_called_once_with(api.auth_request)
+        fresh.refresh.assert_not_called()
+
+    def test_refresh_due_drops_revoked_creds(self):
+        from google.auth.exceptions import RefreshError
+        cache = CredsCache()
+        creds = make_creds(expires_in=timedelta(0))
+        creds.refresh = Mock(side_effect=RefreshError('invalid_grant'))
+        cache.put(creds)
+        assert cache.refresh_due() == 0
+        assert cache.get('refresh') is None
+
+    def test_refresh_due_keeps_creds_after_network_error(self):
+        cache = CredsCache()
+        creds = make_creds(expires_in=timedelta(0))
+        creds.refresh = Mock(side_effect=OSError('connection reset'))
+        cache.put(creds)
+        cache.refresh_due()
+        assert cache.get('refresh') is creds
+
+    def test_idle_creds_dropped(self):
+        now = [0.0]
+        cache = CredsCache(clock=lambda: now[0])
+        cache.put(make_creds())
+        now[0] = auth.CREDS_IDLE_SECONDS + 1
+        cache.refresh_due()
+        assert cache.get('refresh') is None
+
+    def test_end_session_evicts_creds(self, client):
+        creds = make_creds()
+        creds_cache.put(creds)
+        with client.session_transaction() as sess:
+            sess['session_id'] = 'test-session-id'
+        session.session_store['test-session-id'] = {'creds': creds}
+        with app.app.test_request_context():
+            from flask import session as flask_session
+            flask_session['session_id'] = 'test-session-id'
+            auth.end_session()
+        assert creds_cache.get('refresh') is None
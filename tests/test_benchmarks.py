@@ -0,0 +1,81 @@
+import io
+import pytest
+from datetime import date
+
+import api
+import tasklist
+from benchmarks import hot_paths
+from benchmarks.fake_tasks_api import FakeTasksBackend, FakeCreds
+from benchmarks.synthetic import generate_tasklists
+from task import Task
+
+@pytest.fixture
+def backend():
+    backend = FakeTasksBackend()
+    backend.load({
+        'list0': [{'id': 'a', 'title': 'A'}, {'id': 'b', 'title': 'B'}, {'id': 'b1', 'title': 'B1', 'parent': 'b'}],
+        'list1': [{'id': 'c', 'title': 'C'}],
+    })
+    with backend.installed():
+        yield backend
+
+def test_fake_backend_lists_pages_by_update(backend):
+    backend.load({'list0': [{'id': f'extra{i}', 'title': f'Extra {i}'} for i in range(150)]})
+    pages = api.get_all_tasks(FakeCreds(), tasklist_id='list0')
+    assert [len(page['items']) for page in pages] == [100, 53]
+    items = [item for page in pages for item in page['items']]
+    assert items[0]['id'] == 'extra149'
+    assert [item['updated'] for item in items] == sorted((item['updated'] for item in items), reverse=True)
+    positions = {item['id']: item['position'] for item in items}
+    assert positions['a'] < positions['b'] < positions['extra0']
+    assert positions['b1'] == positions['a']
+
+def test_from_api_against_fake_backend(backend):
+    tasks = tasklist.from_api(FakeCreds())
+    assert {task.id: task.tasklist_id for task in tasks} == {'a': 'list0', 'b': 'list0', 'b1': 'list0', 'c': 'list1'}
+    assert [task.id for task in tasks if not task.parent_id] == ['a', 'b', 'c']
+    assert tasks.children_of('b')[0].id == 'b1'
+
+def test_unchanged_pages_not_sent_again(backend):
+    creds = FakeCreds()
+    first = tasklist.from_api(creds)
+    api.patch_task(creds, Task(id='c', title='C edited', tasklist_id='list1'))
+    second = tasklist.from_api(creds)
+    assert backend.request_counts['not_modified'] == 1
+    assert second[0] is not first[0] and second[0].id == first[0].id
+    assert second[3].title == 'C edited'
+
+def test_mutations_against_fake_backend(backend):
+    creds = FakeCreds()
+    new_id = api.insert_task(creds, Task(title='New', tasklist_id='list1'))['id']
+    api.move_task(creds, new_id, None, 'c', tasklist_id='list1')
+    api.patch_task(creds, Task(id='a', title='A edited', tasklist_id='list0'))
+    tasks = tasklist.from_api(creds)
+    assert [task.id for task in tasks if not task.parent_id] == ['a', 'b', 'c', new_id]
+    assert tasks[0].title == 'A edited'
+    assert backend.request_counts['tasks.insert'] == backend.request_counts['tasks.move'] == 1
+
+def test_injected_failures_are_retried(backend, monkeypatch):
+    monkeypatch.setattr(api, '_sleep', lambda seconds: None)
+    backend.fail_next(503, count=2, retry_after=0)
+    assert api.get_tasklists(FakeCreds()) == ['list0', 'list1']
+    assert backend.request_counts['tasklists.list'] == 1
+
+def test_synthetic_tasks_are_reproducible():
+    today = date(2025, 6, 1)
+    first = generate_tasklists(1000, seed=3, today=today)
+    assert first == generate_tasklists(1000, seed=3, today=today)
+    assert first != generate_tasklists(1000, seed=4, today=today)
+    items = [item for items in first.values() for item in items]
+    assert len(items) == len({item['id'] for item in items}) == 1000
+    assert 0.1 < sum('parent' in item for item in items) / len(items) < 0.3
+
+def test_runner_reports_and_finds_regressions():
+    report = hot_paths.run(sizes=(100,), repeat=1)
+    names = {result['benchmark'] for result in report['results']}
+    assert {'tasklist.from_api', 'reorder.reposition_updated_task', 'app.index', 'tasklist.from_api memory'} <= names
+    hot_paths.print_report(report, io.StringIO())
+
+    assert hot_paths.regressions(report, report, 0.2) == []
+    faster = {'results': [dict(result, best_ms=result['best_ms'] / 2) for result in report['results'] if 'best_ms' in result]}
+    assert len(hot_paths.regressions(report, faster, 0.2)) == len(faster['results'])
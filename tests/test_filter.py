@@ -1,4 +1,5 @@
-from filter import filter_tasks_by_text, filter_tasks_by_children, filter_tasks_by_start, filter_tasks_by_priority
+from filter import filter_tasks, compile_filter, filter_tasks_by_text, filter_tasks_by_children, filter_tasks_by_start, filter_tasks_by_priority
+from filter_args import FilterArgs
 from task import Task
 from datetime import date, timedelta
 
@@ -108,3 +109,26 @@ def test_by_priority():
     result = filter_tasks_by_priority(tasks, 3)
     assert len(result) == 1
     assert result[0].title == "High priority"
+
+def test_filter_tasks__combines_all_filters():
+    today = date.today()
+    tasks = [
+        Task("Buy groceries", "Get milk", priority=2),
+        Task("Buy stamps", "Post office", priority=1),
+        Task("Buy milk", "Tomorrow", priority=2, start_date=today + timedelta(days=1)),
+        Task("Child milk", "Sub task", priority=2, parent_id="1"),
+        Task("Call mom", "Weekly check-in", priority=2),
+    ]
+    result = filter_tasks(tasks, FilterArgs({'search': 'MILK', 'priority': '2'}))
+    assert [task.title for task in result] == ["Buy groceries"]
+
+def test_compile_filter__no_active_filters():
+    predicate = compile_filter(FilterArgs({'hide_children': False, 'show_future': True}))
+    assert predicate(Task("Child task", parent_id="1", start_date=date.today() + timedelta(days=1)))
+
+def test_search_text__cached_until_title_changes():
+    task = Task("Buy Groceries", "Get MILK")
+    assert "milk" in task.search_text
+    task.title = "Call mom"
+    assert "groceries" not in task.search_text
+    assert "call mom" in task.search_text
@@ -0,0 +1,48 @@
+import pytest
+
+import app
+import fragments
+from filter_args import FilterArgs
+from fragments import FragmentCache
+from task import Task
+
+@pytest.fixture
+def cache(monkeypatch):
+    cache = FragmentCache(max_size=3)
+    monkeypatch.setattr(fragments, 'fragment_cache', cache)
+    with app.app.test_request_context():
+        yield cache
+
+def card(task, filter_args=None):
+    return str(fragments.task_card(task, filter_args or FilterArgs({})))
+
+def test_unchanged_card_not_rendered_again(cache):
+    task = Task(id='task1', title='Task 1')
+    task.children = [{}, Task(id='child1', title='Child 1', parent_id='task1')]
+    html = card(task)
+    assert 'Task 1' in html and 'Child 1' in html
+    # A copy, like the session store loads each request
+    copy = Task(id='task1', title='Task 1')
+    copy.children = [{}, Task(id='child1', title='Child 1', parent_id='task1')]
+    assert card(copy) == html
+    assert (cache.hits, cache.misses) == (1, 3)
+
+def test_changed_task_or_filter_rendered_again(cache):
+    task = Task(id='task1', title='Task 1')
+    card(task)
+    task.title = 'Edited'
+    assert 'Edited' in card(task)
+    assert '?search=x' in card(task, FilterArgs({'search': 'x'}))
+    assert cache.hits == 0
+
+def test_least_recently_used_evicted(cache):
+    tasks = [Task(id=f'task{i}', title=f'Task {i}') for i in range(4)]
+    for task in tasks[:3]:
+        card(task)
+    card(tasks[0])
+    card(tasks[3])
+    assert len(cache) == 3
+    misses = cache.misses
+    card(tasks[0])
+    card(tasks[1])
+    assert cache.misses == misses + 1
@@ -2,6 +2,7 @@ import pytest
 from unittest.mock import Mock, patch
 from task import Task
 from reorder import reposition_updated_task
+from tasklist import TaskList
 
 def create_test_task(task_id, title, priority=1):
     """Create a test task with minimal required fields."""
@@ -29,7 +30,7 @@ def test_reordering_main_example(mock_move_task):
     
     # Google-sorted tasks array (current order): [1, 2, 5, 3]
     # Note: task 4 is not in the array yet (it's being updated)
-    tasks = [task1, task2, task5, task3]
+    tasks = TaskList([task1, task2, task5, task3])
     
     # Mock credentials
     mock_creds = Mock()
@@ -44,7 +45,7 @@ def test_reordering_main_example(mock_move_task):
     assert actual_order == expected_order
     
     # Verify API call was made with correct parameters
-    mock_move_task.assert_called_once_with(mock_creds, "4", None, "2")
+    mock_move_task.assert_called_once_with(mock_creds, "4", None, "2", batch=None, tasklist_id="@default", outbox=None)
 
 @patch('reorder.api.move_task')
 def test_insert_at_beginning(mock_move_task):
@@ -53,7 +54,7 @@ def test_insert_at_beginning(mock_move_task):
     task2 = create_test_task("2", "Task 2", priority=1)
     task3 = create_test_task("3", "Task 3", priority=3)  # High priority - should go first
     
-    tasks = [task1, task2]
+    tasks = TaskList([task1, task2])
     reposition_updated_task(Mock(), tasks, task3)
     
     actual_order = [t.id for t in tasks]
@@ -67,7 +68,7 @@ def test_insert_at_end(mock_move_task):
     task2 = create_test_task("2", "Task 2", priority=3)
     task3 = create_test_task("3", "Task 3", priority=1)  # Low priority - should go last
     
-    tasks = [task1, task2]
+    tasks = TaskList([task1, task2])
     reposition_updated_task(Mock(), tasks, task3)
     
     actual_order = [t.id for t in tasks]
@@ -78,7 +79,7 @@ def test_insert_at_end(mock_move_task):
 def test_insert_into_empty_list(mock_move_task):
     """Test inserting a task into an empty list."""
     task1 = create_test_task("1", "Task 1", priority=2)
-    tasks = []
+    tasks = TaskList([])
     
     reposition_updated_task(Mock(), tasks, task1)
     
@@ -93,7 +94,7 @@ def test_replace_existing_task(mock_move_task):
     task3 = create_test_task("3", "Task 3", priority=2)
     
     # Initial order with task2 in wrong position
-    tasks = [task1, task2, task3]
+    tasks = TaskList([task1, task2, task3])
     
     # Update task2's priority to be higher
     updated_task2 = create_test_task("2", "Task 2", priority=3)
@@ -104,4 +105,61 @@ def test_replace_existing_task(mock_move_task):
     # Since both task1 and updated_task2 have priority 3, they should stay in order
     # but task2 should come before task3
     expected_order = ['1', '2', '3']
-    assert actual_order == expected_order
\ No newline at end of file
+    assert actual_order == expected_order
+
+@patch('reorder.api.move_task')
+def test_insert_before_first_later_task_in_unsorted_list(mock_move_task):
+    """Google's order isn't sorted, so the task goes before the first task that sorts after it."""
+    task1 = create_test_task("1", "Task 1", priority=3)
+    task2 = create_test_task("2", "Task 2", priority=1)  # sorts after the updated task
+    task3 = create_test_task("3", "Task 3", priority=3)
+    task4 = create_test_task("4", "Task 4", priority=2)
+    updated = create_test_task("5", "Task 5", priority=3)
+
+    tasks = TaskList([task1, task2, task3, task4])
+    reposition_updated_task(Mock(), tasks, updated)
+
+    assert [t.id for t in tasks] == ['1', '5', '2', '3', '4']
+    mock_move_task.assert_called_once_with(mock_move_task.call_args[0][0], "5", None, "1", batch=None, tasklist_id="@default", outbox=None)
+
+@patch('reorder.api.move_task')
+def test_equal_keys_go_after_existing_tasks(mock_move_task):
+    task1 = create_test_task("1", "Task 1", priority=2)
+    task2 = create_test_task("2", "Task 2", priority=2)
+    updated = create_test_task("3", "Task 3", priority=2)
+
+    tasks = TaskList([task1, updated, task2])
+    reposition_updated_task(Mock(), tasks, updated)
+
+    assert [t.id for t in tasks] == ['1', '2', '3']
+
+@patch('reorder.api.move_task')
+def test_only_repositions_within_own_list(mock_move_task):
+    home1 = create_test_task("h1", "Home 1", priority=1)
+    work1 = create_test_task("w1", "Work 1", priority=3)
+    home1.tasklist_id = "home"
+    work1.tasklist_id = "work"
+    updated = create_test_task("w2", "Work 2", priority=2)
+    updated.tasklist_id = "work"
+
+    tasks = TaskList([home1, work1, updated])
+    reposition_updated_task(Mock(), tasks, updated)
+
+    # The home list's later task doesn't count, so it stays after the work task it sorts after
+    assert [t.id for t in tasks] == ["h1", "w1", "w2"]
+    mock_move_task.assert_called_once_with(mock_move_task.call_args[0][0], "w2", None, "w1", batch=None, tasklist_id="work", outbox=None)
+
+@patch('reorder.api.move_task')
+def test_previous_task_is_from_same_list(mock_move_task):
+    work1 = create_test_task("w1", "Work 1", priority=3)
+    home1 = create_test_task("h1", "Home 1", priority=0)
+    work1.tasklist_id = "work"
+    home1.tasklist_id = "home"
+    updated = create_test_task("w2", "Work 2", priority=1)
+    updated.tasklist_id = "work"
+
+    tasks = TaskList([work1, home1, updated])
+    reposition_updated_task(Mock(), tasks, updated)
+
+    assert [t.id for t in tasks] == ["w1", "w2", "h1"]
+    assert mock_move_task.call_args[0][3] == "w1"
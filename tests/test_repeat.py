@@ -1,6 +1,6 @@
 import pytest
 from datetime import datetime, timedelta
-from repeat import next_repeat_date, matches_repeat_field
+from repeat import next_repeat_date, matches_repeat_field, compile_repeat, preview_repeat_dates
 from repeat_validation import validate_single_repeat, validate_repeat
 
 def test_validate_single_repeat():
@@ -60,3 +60,41 @@ def test_next_repeat_date():
     assert next_repeat_date(datetime(2023, 1, 1), datetime(2023, 1, 2), '* * 0 0 C') == datetime(2023, 1, 8)
     # Test invalid repeat string
     assert next_repeat_date(datetime(2023, 1, 1), datetime(2023, 1, 2), 'invalid') == None
+
+
+def brute_force_next_repeat_date(last_date, completion_date, repeat_str):
+    """The original day-by-day search, as a reference for the compiled rules"""
+    parts = repeat_str.split()
+    next_date = (completion_date if parts[4] == 'C' else last_date) + timedelta(days=int(parts[3]))
+    for i in range(1000):
+        if (matches_repeat_field(parts[0], next_date.day) and
+            matches_repeat_field(parts[1], next_date.month) and
+            matches_repeat_field(parts[2], (next_date.weekday() + 1) % 7)):
+            return next_date
+        next_date = next_date + timedelta(days=1)
+    return None
+
+def test_next_repeat_date__matches_day_by_day_search():
+    repeats = ['* * * 0 S', '31 * * 0 S', '29 2 * 0 C', '1-7 * 1 0 S', '*/10 */3 * 5 C', '13 * 5 0 S',
+               '15 6 * 30 S', '1,15 * 0-4 2 C', '31 2 * 0 S', '* 12 6 0 S', '30 * 1 1 C']
+    start = datetime(2023, 1, 1)
+    for repeat_str in repeats:
+        for offset in range(0, 800, 37):
+            last_date = start + timedelta(days=offset)
+            completion_date = last_date + timedelta(days=offset % 11)
+            assert next_repeat_date(last_date, completion_date, repeat_str) == brute_force_next_repeat_date(last_date, completion_date, repeat_str), repeat_str
+
+def test_compile_repeat__memoized_and_immutable():
+    rule = compile_repeat('1,15 * * 0 S')
+    assert rule is compile_repeat('1,15 * * 0 S')
+    assert rule.days_of_month == (1 << 1) | (1 << 15)
+    assert rule.from_completion is False
+    assert compile_repeat('invalid') is None
+    with pytest.raises(AttributeError):
+        rule.days = 3
+
+def test_preview_repeat_dates():
+    assert preview_repeat_dates('15 * * 0 S', datetime(2023, 1, 1), 3) == [datetime(2023, 1, 15), datetime(2023, 2, 15), datetime(2023, 3, 15)]
+    assert preview_repeat_dates('* * * 7 C', datetime(2023, 1, 1), 2) == [datetime(2023, 1, 8), datetime(2023, 1, 15)]
+    assert preview_repeat_dates('31 2 * 0 S', datetime(2023, 1, 1), 3) == []
+    assert preview_repeat_dates('invalid', datetime(2023, 1, 1), 3) == []
@@ -1,2 +1,26 @@
 import pytest
-import repeat_validation
\ No newline at end of file
+import repeat_validation
+from repeat_validation import parse_repeat, RepeatFields, EMPTY_REPEAT
+from task import Task
+
+def test_parse_repeat():
+    assert parse_repeat('1-15 */2 0,1 30 S') == RepeatFields('1-15', '*/2', '0,1', '30', 'S', True)
+    assert parse_repeat('* * 9 0 C') == RepeatFields('*', '*', '9', '0', 'C', False)
+    assert parse_repeat('* *') == RepeatFields('*', '*', valid=False)
+    assert parse_repeat('') is EMPTY_REPEAT
+    assert parse_repeat(None) is EMPTY_REPEAT
+
+def test_parse_repeat__memoized():
+    assert parse_repeat('* * * 3 C') is parse_repeat('* * * 3 C')
+
+def test_task_repeat_fields_cached_until_reassigned():
+    task = Task(repeat_start='1 * * 0 S')
+    fields = task.repeat_start_fields()
+    assert task.repeat_start_fields() is fields
+    assert task.repeat_start_dom() == '1'
+    assert task.repeat_start_from() == 'S'
+    assert task.repeat_due_days() == ''
+
+    task.repeat_start = '* * * 7 C'
+    assert task.repeat_start_days() == '7'
+    assert task.repeat_start_from() == 'C'
@@ -26,7 +26,7 @@ def client(app):
 class TestSessionStore:
     def test_session_store_initialization(self):
         """Test that session store is properly initialized"""
-        assert isinstance(session.session_store, dict)
+        assert isinstance(session.session_store, session.SessionStore)
 
     def test_session_store_clear(self):
         """Test that session store can be cleared"""
@@ -82,6 +82,8 @@ class TestSessionFunctions:
             from flask import session as flask_session
             flask_session['session_id'] = 'test-session'
             session.set_user_data('test_key', 'test_value')
+            assert 'test-session' not in session.session_store
+            session.save_user_data()
             assert 'test-session' in session.session_store
             assert session.session_store['test-session']['test_key'] == 'test_value'
 
@@ -108,10 +110,29 @@ class TestSessionFunctions:
         assert session.session_store['session2']['key'] == 'value2'
         
         # Modify one session
-        session.session_store['session1']['key'] = 'modified'
+        session.session_store.update('session1', {'key': 'modified'})
         assert session.session_store['session1']['key'] == 'modified'
         assert session.session_store['session2']['key'] == 'value2'
 
+    def test_loads_once_and_saves_once_per_request(self, app):
+        session.init_app(app)
+
+        @app.route('/touch')
+        def touch():
+            session.get_user_data('a')
+            session.set_user_data('a', 1)
+            session.set_user_data('b', 2)
+            return 'ok'
+
+        with patch.object(session.session_store, 'load', wraps=session.session_store.load) as load, \
+                patch.object(session.session_store, 'update', wraps=session.session_store.update) as update:
+            with app.test_client() as client:
+                with client.session_transaction() as sess:
+                    sess['session_id'] = 'once'
+                client.get('/touch')
+        assert load.call_count == 1
+        update.assert_called_once_with('once', {'a': 1, 'b': 2})
+
 class TestRequireAuthDecorator:
     def test_require_auth_with_valid_session(self, client):
         """Test require_auth decorator allows access with valid credentials and tasks"""
@@ -208,6 +229,7 @@ class TestSessionDataPersistence:
             flask_session['session_id'] = 'persist-test'
             # Set data
             session.set_user_data('persistent_key', 'persistent_value')
+            session.save_user_data()
             
             # Get data in same context
             result1 = session.get_user_data('persistent_key')
@@ -237,9 +259,81 @@ class TestSessionDataPersistence:
             assert session.get_user_data('key3') == {'nested': 'object'}
             
             # Verify all keys exist in session store
+            session.save_user_data()
             assert 'multi-key-test' in session.session_store
             session_data = session.session_store['multi-key-test']
             assert len(session_data) == 3
             assert 'key1' in session_data
             assert 'key2' in session_data
-            assert 'key3' in session_data
\ No newline at end of file
+            assert 'key3' in session_data
+
+class TestMemorySessionStore:
+    def test_evicts_least_recently_used(self):
+        store = session.MemorySessionStore(max_entries=2)
+        store.save('a', {'key': 1})
+        store.save('b', {'key': 2})
+        store.load('a')
+        store.save('c', {'key': 3})
+        assert store.load('b') is None
+        assert store.load('a') == {'key': 1}
+        assert store.load('c') == {'key': 3}
+
+    def test_expires_idle_sessions(self):
+        store = session.MemorySessionStore(ttl=60)
+        with patch('session.time.monotonic', return_value=1000):
+            store.save('a', {'key': 1})
+        with patch('session.time.monotonic', return_value=1030):
+            assert store.load('a') == {'key': 1}
+        with patch('session.time.monotonic', return_value=1100):
+            assert store.load('a') is None
+        assert 'a' not in store
+
+    def test_delete(self):
+        store = session.MemorySessionStore()
+        store.save('a', {'key': 1})
+        store.delete('a')
+        store.delete('missing')
+        assert store.load('a') is None
+
+class TestSqliteSessionStore:
+    def test_round_trips_tasks_and_survives_reopen(self, tmp_path):
+        from task import Task
+        from datetime import date
+        path = str(tmp_path / 'sessions.db')
+        tasks = [Task(id='1', title='Task 1', priority=2, due_date=date(2024, 1, 15), repeat_start='* * * 3 C')]
+        tasks[0].children = [Task(id='2')]
+        session.SqliteSessionStore(path).save('a', {'creds': {'token': 'token'}, 'tasks': tasks})
+
+        data = session.SqliteSessionStore(path).load('a')
+        assert data['creds'] == {'token': 'token'}
+        loaded = data['tasks'][0]
+        assert (loaded.id, loaded.title, loaded.priority, loaded.due_date, loaded.repeat_start) == ('1', 'Task 1', 2, date(2024, 1, 15), '* * * 3 C')
+        assert loaded.children == []
+
+    def test_expires_and_bounds_sessions(self, tmp_path):
+        store = session.SqliteSessionStore(str(tmp_path / 'sessions.db'), max_entries=2, ttl=60)
+        with patch('session.time.time', return_value=1000):
+            store.save('a', {'key': 1})
+        with patch('session.time.time', return_value=1001):
+            store.save('b', {'key': 2})
+        with patch('session.time.time', return_value=1002):
+            store.save('c', {'key': 3})
+            assert store.load('a') is None
+            assert store.load('b') == {'key': 2}
+        with patch('session.time.time', return_value=2000):
+            assert store.load('c') is None
+
+    def test_update_keeps_keys_saved_by_another_process(self, tmp_path):
+        path = str(tmp_path / 'sessions.db')
+        store = session.SqliteSessionStore(path)
+        store.save('a', {'tasks': 1, 'synced_at': 1})
+        # Both requests loaded the session before either saved
+        session.SqliteSessionStore(path).update('a', {'synced_at': 2})
+        store.update('a', {'tasks': 2})
+        assert store.load('a') == {'tasks': 2, 'synced_at': 2}
+
+    def test_delete(self, tmp_path):
+        store = session.SqliteSessionStore(str(tmp_path / 'sessions.db'))
+        store.save('a', {'key': 1})
+        store.delete('a')
+        assert store.load('a') is None
@@ -1,6 +1,6 @@
 import pytest
 from datetime import datetime, timedelta
-from sort import task_sort_key, get_sorted_tasks
+from sort import task_sort_key, get_sorted_tasks, get_top_tasks
 from task import Task
 
 # def test_should_display_task_no_dates():
@@ -37,14 +37,14 @@ def test_task_sort_key_with_due_date():
     due_date = (datetime.now() + timedelta(days=5)).date()
     task = Task(title='Due Task', due_date=due_date, start_date=start_date, priority=2)
     sort_key = task_sort_key(task)
-    assert sort_key.startswith(due_date.strftime('%Y-%m-%d'))
+    assert sort_key == (due_date.toordinal(), 1)
 
 def test_task_sort_key_with_assigned_date():
     due_date = (datetime.now() + timedelta(days=1)).date()
     assigned_date = (datetime.now() + timedelta(days=3)).date()
     task = Task(title='Assigned Task', assigned_date=assigned_date, due_date=due_date, priority=2)
     sort_key = task_sort_key(task)
-    assert sort_key.startswith(assigned_date.strftime('%Y-%m-%d'))
+    assert sort_key == (assigned_date.toordinal(), 1)
 
 def test_task_sort_key_priority_tiebreaker():
     today = datetime.now().date()
@@ -65,16 +65,16 @@ def test_task_sort_key_priority_fallback():
 
     today = datetime.now()
     expected_dates = [
-        (today + timedelta(days=7)).strftime('%Y-%m-%d'),
-        (today + timedelta(days=14)).strftime('%Y-%m-%d'),
-        (today + timedelta(days=30)).strftime('%Y-%m-%d')
+        (today + timedelta(days=7)).date().toordinal(),
+        (today + timedelta(days=14)).date().toordinal(),
+        (today + timedelta(days=30)).date().toordinal()
     ]
     
     keys = [task_sort_key(task) for task in tasks]
     
     # Check that each key starts with the expected implied date based on priority
     for i, key in enumerate(keys):
-        assert key.startswith(expected_dates[i])
+        assert key[0] == expected_dates[i]
 
 def test_get_sorted_tasks():
     tasks = [
@@ -111,3 +111,36 @@ def test_p3_tasks_with_different_date_configurations():
     assert sorted_tasks[0].title == 'P3 no dates'
     assert sorted_tasks[1].title == 'P3 with start tomorrow'
     assert sorted_tasks[2].title == 'P3 with due date'
+
+
+def test_task_sort_key_past_start_date_treated_as_today():
+    today = datetime.now().date()
+    task = Task(title='Started last week', priority=3, start_date=today - timedelta(days=7))
+    assert task_sort_key(task) == ((today + timedelta(days=7)).toordinal(), 0)
+
+def test_task_sort_key_cached_until_fields_change():
+    today = datetime.now().date()
+    task = Task(title='Task', priority=3)
+    key = task_sort_key(task, today)
+    assert task.sort_key_cache == (today.toordinal(), key)
+    assert task_sort_key(task, today) is key
+
+    task.priority = 1
+    assert task.sort_key_cache is None
+    assert task_sort_key(task, today) == ((today + timedelta(days=30)).toordinal(), 2)
+
+    task.due_date = today
+    assert task_sort_key(task, today) == (today.toordinal(), 2)
+
+def test_task_sort_key_recomputed_on_new_day():
+    today = datetime.now().date()
+    task = Task(title='Task', priority=2)
+    task_sort_key(task, today)
+    tomorrow = today + timedelta(days=1)
+    assert task_sort_key(task, tomorrow) == ((tomorrow + timedelta(days=14)).toordinal(), 1)
+
+def test_get_top_tasks_matches_sorted_prefix():
+    today = datetime.now().date()
+    tasks = [Task(title=f'Task {i}', priority=i % 4, due_date=today + timedelta(days=i % 3) if i % 5 else None) for i in range(40)]
+    for count in (0, 1, 5, 40, 100):
+        assert get_top_tasks(iter(tasks), count) == get_sorted_tasks(tasks)[:count]
@@ -1,2 +1,111 @@
+import pickle
 import pytest
-import summary
\ No newline at end of file
+from datetime import date, timedelta
+from unittest.mock import MagicMock
+
+import api
+import summary
+from task import Task
+from tasklist import TaskList, upsert_task, merge_changes
+from reorder import reposition_updated_task
+
+TODAY = date.today()
+
+def make_tasks():
+    return [
+        Task(id="overdue", priority=3, due_date=TODAY - timedelta(days=2)),
+        Task(id="today", priority=2, due_date=TODAY),
+        Task(id="tomorrow", priority=2, due_date=TODAY + timedelta(days=1)),
+        Task(id="week", priority=1, due_date=TODAY + timedelta(days=7)),
+        Task(id="month", priority=0, due_date=TODAY + timedelta(days=8)),
+        Task(id="later", priority=0, due_date=TODAY + timedelta(days=31)),
+        Task(id="undated", priority=1),
+    ]
+
+def recount(tasks):
+    return summary.Stats(list(tasks)).as_dict()
+
+@pytest.fixture
+def mock_api(monkeypatch):
+    mock_api = MagicMock()
+    mock_api.insert_task.return_value = {"id": "newtask"}
+    monkeypatch.setattr(api, 'insert_task', mock_api.insert_task)
+    monkeypatch.setattr(api, 'move_task', mock_api.move_task)
+    monkeypatch.setattr(api, 'patch_task', mock_api.patch_task)
+    return mock_api
+
+def test_get_stats_buckets():
+    assert summary.get_stats(make_tasks()) == {
+        'p3': 1, 'p2': 2, 'p1': 2, 'p0': 2,
+        'overdue': 1, 'today': 1, 'week': 2, 'month': 1,
+    }
+
+def test_get_stats_empty():
+    assert summary.get_stats([]) == dict.fromkeys(summary.STAT_KEYS, 0)
+
+def test_tasklist_stats_reused_until_untracked_change():
+    tasks = TaskList(make_tasks())
+    stats = tasks.stats()
+    assert tasks.stats() is stats
+    tasks.append(Task(id="extra", priority=3))
+    assert tasks.stats() is not stats
+    assert tasks.stats().as_dict()['p3'] == 2
+
+def test_tasklist_stats_recounted_on_new_day():
+    tasks = TaskList(make_tasks())
+    stats = tasks.stats()
+    stats.today -= 1
+    assert tasks.stats() is not stats
+
+def test_upsert_updates_stats_incrementally(mock_api):
+    tasks = TaskList(make_tasks())
+    stats = tasks.stats()
+
+    upsert_task(None, tasks, Task(id="later", priority=3, due_date=TODAY))
+    upsert_task(None, tasks, Task(title="New", priority=1, due_date=TODAY - timedelta(days=1)))
+    upsert_task(None, tasks, Task(id="overdue", priority=3, due_date=TODAY, completed="2024-01-01T00:00:00Z"))
+
+    assert tasks.stats() is stats
+    assert stats.as_dict() == recount(tasks)
+
+def test_completed_repeat_updates_stats_incrementally(mock_api):
+    tasks = TaskList(make_tasks())
+    stats = tasks.stats()
+    upsert_task(None, tasks, Task(id="today", title="Today", priority=2, due_date=TODAY, repeat_due="* * * 1 C",
+                                  completed="2024-01-01T00:00:00Z"))
+    # The completed task is replaced by its next repeat, which is counted in the stats
+    mock_api.insert_task.assert_called_once()
+    repeat = tasks.get("newtask")
+    assert repeat is not None and tasks.get("today") is None
+    assert (repeat.title, repeat.priority) == ("Today", 2)
+    assert repeat.due_date > TODAY
+    assert tasks.stats() is stats
+    assert stats.as_dict() == recount(tasks)
+    assert stats.as_dict()['p2'] == 2
+
+def test_reposition_keeps_stats(mock_api):
+    tasks = TaskList(make_tasks())
+    stats = tasks.stats()
+    task = Task(id="month", priority=3, due_date=TODAY)
+    upsert_task(None, tasks, task)
+    reposition_updated_task(None, tasks, task)
+    assert tasks.stats() is stats
+    assert stats.as_dict() == recount(tasks)
+
+def test_merge_changes_updates_stats_incrementally():
+    tasks = TaskList(make_tasks())
+    stats = tasks.stats()
+    merge_changes(tasks, [
+        {'id': 'today', 'title': 'Today', 'status': 'completed'},
+        {'id': 'undated', 'title': 'Undated', 'notes': 'P: 3'},
+        {'id': 'new', 'title': 'New', 'due': TODAY.isoformat() + 'T00:00:00.000Z'},
+    ])
+    assert tasks.stats() is stats
+    assert stats.as_dict() == recount(tasks)
+
+def test_stats_survive_pickling():
+    tasks = TaskList(make_tasks())
+    expected = tasks.stats().as_dict()
+    restored = pickle.loads(pickle.dumps(tasks))
+    assert restored._stats_version == restored.version
+    assert restored.stats().as_dict() == expected
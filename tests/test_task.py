@@ -87,7 +87,7 @@ def test_from_form_submission_clears_past_start_date():
     ])
     task = Task.from_form_submission(form_data)
     assert task.title == 'Test Task'
-    assert task.start_date == ''
+    assert task.start_date is None
 
 def test_from_form_submission_complete_action():
     form_data = MultiDict([
@@ -151,3 +151,62 @@ def test_to_api_format():
     assert api_format['completed'] == ''
     assert api_format['status'] == 'needsAction'
     assert api_format['due'] == '2024-01-20T00:00:00Z'
+
+def test_task_is_slotted():
+    task = Task(title='Test Task')
+    assert not hasattr(task, '__dict__')
+    with pytest.raises(AttributeError):
+        task.unknown_field = 1
+
+def test_dates_stored_as_ordinals():
+    task = Task(due_date=date(2024, 1, 15))
+    assert task.due_day == date(2024, 1, 15).toordinal()
+    assert task.due_date == date(2024, 1, 15)
+    task.due_date = ''
+    assert task.due_day == 0
+    assert task.due_date is None
+
+def test_status_interned():
+    status = ''.join(['needs', 'Action'])
+    assert Task(status=status).status is Task(status='needsAction').status
+
+def test_pickle_round_trip():
+    import pickle
+    task = Task(id='task123', title='Test Task', priority=2, due_date=date(2024, 1, 15), repeat_start='* * * 3 C', parent_id='parent123')
+    task.children = [Task(id='child')]
+    loaded = pickle.loads(pickle.dumps(task))
+    assert (loaded.id, loaded.title, loaded.priority, loaded.due_date, loaded.repeat_start, loaded.parent_id) == \
+        ('task123', 'Test Task', 2, date(2024, 1, 15), '* * * 3 C', 'parent123')
+    assert loaded.children == []
+    assert loaded.status is task.status
+
+def test_copy():
+    task = Task(id='task123', title='Test Task', priority=2, due_date=date(2024, 1, 15), parent_id='parent123', tasklist_id='work', position='1')
+    task.children = [Task(id='child')]
+    task.search_text
+    copy = task.copy()
+    assert copy is not task
+    assert copy.__getstate__() == task.__getstate__()
+    assert copy.children == []
+    copy.title = 'Edited'
+    assert task.title == 'Test Task' and copy.search_text.startswith('edited')
+
+def test_setstate_from_before_tasklist_id():
+    # Before tasklist_id, and then position, were added to the end of the state
+    old_state = Task(id='task123', tasklist_id='work', position='1').__getstate__()[:-2]
+    loaded = Task.__new__(Task)
+    loaded.__setstate__(old_state)
+    assert (loaded.id, loaded.tasklist_id, loaded.position) == ('task123', '', '')
+
+def test_from_api_response__tags_and_description_in_one_pass():
+    api_response = {
+        'id': 'task123',
+        'notes': '  First line  \n#P: 3\n#X:unknown tag\n#D:not-a-date\nSecond line\n#RD:1 * * 0 S',
+        'due': '2024-01-20T00:00:00.000Z'
+    }
+    task = Task.from_api_response(api_response)
+    assert task.description == 'First line\nSecond line'
+    assert task.priority == 3
+    assert task.due_date is None
+    assert task.repeat_due == '1 * * 0 S'
+    assert task.assigned_date == date(2024, 1, 20)
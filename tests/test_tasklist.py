@@ -3,9 +3,10 @@ from unittest.mock import patch, MagicMock
 from datetime import datetime, date
 import json
 
-from tasklist import upsert_task, update_task, insert_task, delete_task
+from tasklist import upsert_task, update_task, insert_task, delete_task, sync, merge_changes, from_api, TaskList
 from task import Task
 import api
+import tasklist
 
 TEST_CREDS = {"token": "test_token"}
 
@@ -15,11 +16,11 @@ def task():
 
 @pytest.fixture
 def tasks():
-    return [
+    return TaskList([
         Task(id="task1", title="Task 1", description="Notes 1"),
         Task(id="task2", title="Task 2", description="Notes 2"),
         Task(id="task3", title="Task 3", description="Notes 3")
-    ]
+    ])
 
 @pytest.fixture
 def mock_api(monkeypatch):
@@ -33,17 +34,20 @@ def mock_api(monkeypatch):
 
 def test_upsert_task__new_task(mock_api, tasks, task):    
     upsert_task(TEST_CREDS, tasks, task)
-    mock_api.insert_task.assert_called_once_with(TEST_CREDS, task)
+    mock_api.insert_task.assert_called_once_with(TEST_CREDS, task, batch=None, outbox=None)
     assert len(tasks) == 4
     assert any(t.id == "newtask" for t in tasks)
     
 def test_upsert_task__new_subtask(mock_api, tasks, task):
     task.parent_id = tasks[0].id
+    parent_id = tasks[0].id
     upsert_task(TEST_CREDS, tasks, task)
-    mock_api.insert_task.assert_called_once_with(TEST_CREDS, task)
-    mock_api.move_task.assert_called_once_with(TEST_CREDS, "newtask", tasks[0].id, None)
+    # Subtasks are inserted directly under their parent, without a separate move
+    mock_api.insert_task.assert_called_once_with(TEST_CREDS, task, batch=None, outbox=None)
+    mock_api.move_task.assert_not_called()
     assert len(tasks) == 4
-    assert tasks[3].parent_id == tasks[0].id
+    assert task.id == "newtask"
+    assert task.parent_id == parent_id
 
 def test_upsert_task__edit_task():
     return
@@ -58,4 +62,240 @@ def test_upsert_task__complete_repeat_due():
     return
 
 def test_upsert_task__delete_task():
-    return
\ No newline at end of file
+    return
+def test_upsert_task__batched(mock_api, tasks, task):
+    batch = MagicMock()
+    mock_api.insert_task.return_value = None
+    upsert_task(TEST_CREDS, tasks, task, batch)
+    mock_api.insert_task.assert_called_once_with(TEST_CREDS, task, batch=batch, outbox=None)
+    assert tasks[0] is task
+
+def test_sync__cold_cache_does_full_fetch(monkeypatch, tasks):
+    mock_from_api = MagicMock(return_value=tasks)
+    monkeypatch.setattr('tasklist.from_api', mock_from_api)
+    result, synced_at = sync(TEST_CREDS, [], None)
+    mock_from_api.assert_called_once_with(TEST_CREDS)
+    assert result is tasks
+    assert synced_at.endswith('Z')
+
+def test_sync__warm_cache_fetches_changes_only(monkeypatch, tasks):
+    mock_get_all = MagicMock(return_value={"list1": [{"items": [{"id": "task2", "title": "Task 2 edited", "status": "needsAction"}]}]})
+    monkeypatch.setattr(api, 'get_all_tasklists_tasks', mock_get_all)
+    tasks.default_tasklist_id = "list1"
+    tasks.tasklist_ranks = {"list1": 0}
+    result, _ = sync(TEST_CREDS, tasks, '2024-01-01T00:00:00.000Z')
+    mock_get_all.assert_called_once_with(TEST_CREDS, updated_min='2024-01-01T00:00:00.000Z')
+    assert [t.title for t in result] == ["Task 1", "Task 2 edited", "Task 3"]
+    assert result[1].tasklist_id == "list1"
+
+def test_from_api__tags_tasks_and_keeps_lists_together(monkeypatch):
+    monkeypatch.setattr(api, 'get_all_tasklists_tasks', MagicMock(return_value={
+        "default": [{"items": [{"id": "b", "title": "B", "position": "2"}]},
+                    {"items": [{"id": "a", "title": "A", "position": "1"}]}],
+        "work": [{"items": [{"id": "c", "title": "C", "position": "0"}]}],
+    }))
+    result = from_api(TEST_CREDS)
+    assert [(t.id, t.tasklist_id) for t in result] == [("a", "default"), ("b", "default"), ("c", "work")]
+    assert result.default_tasklist_id == "default"
+
+def test_from_api__reuses_tasks_of_unchanged_pages(monkeypatch):
+    monkeypatch.setattr('tasklist._listings', tasklist._listings.__class__())
+    pages = [{"etag": "e1", "nextPageToken": "p2", "items": [{"id": "a", "title": "A", "position": "1"}]},
+             {"items": [{"id": "b", "title": "B", "position": "2"}]}]
+    def get_all_tasklists_tasks(creds, cached_listings=None):
+        # Google reports the first page unchanged, as the api returns it: the stub it was given
+        cached = (cached_listings or {}).get("default")
+        return {"default": [cached[0] if cached else pages[0], pages[1]]}
+    monkeypatch.setattr(api, 'get_all_tasklists_tasks', get_all_tasklists_tasks)
+    parse = MagicMock(side_effect=Task.from_api_response)
+    monkeypatch.setattr('tasklist.Task.from_api_response', parse)
+    creds = MagicMock(refresh_token="user1")
+    first, second = from_api(creds), from_api(creds)
+    # The unchanged page is only parsed once, and each load gets its own copies of its tasks
+    assert parse.call_count == 3
+    assert [t.id for t in second] == ["a", "b"]
+    assert second[0] is not first[0]
+    first[0].title = "Changed"
+    assert from_api(creds)[0].title == "A"
+    # Only the pages' stubs are kept, not their items
+    assert [stub for stub, _ in tasklist._listings["user1"]["default"]] == [{"etag": "e1", "nextPageToken": "p2"}, {}]
+    # Other users' loads don't share them
+    from_api(MagicMock(refresh_token="user2"))
+    assert parse.call_count == 6
+    tasklist.evict_listings(creds)
+    from_api(creds)
+    assert parse.call_count == 8
+
+def test_insert_task__goes_to_default_list(mock_api):
+    tasks = TaskList()
+    tasks.default_tasklist_id = "default"
+    new_task = Task(title="New")
+    insert_task(TEST_CREDS, tasks, new_task)
+    assert new_task.tasklist_id == "default"
+    subtask = Task(title="Sub", parent_id="c", tasklist_id="work")
+    insert_task(TEST_CREDS, tasks, subtask)
+    assert subtask.tasklist_id == "work"
+
+def test_merge_changes(tasks):
+    merge_changes(tasks, [
+        {"id": "task1", "status": "completed"},
+        {"id": "task3", "deleted": True},
+        {"id": "task2", "title": "Task 2 edited", "status": "needsAction"},
+        {"id": "task4", "title": "Task 4", "status": "needsAction"},
+        {"id": "task5", "title": "Task 5", "hidden": True},
+    ])
+    # Without positions, new tasks go after the existing ones
+    assert [t.id for t in tasks] == ["task2", "task4"]
+    assert tasks[0].title == "Task 2 edited"
+
+def test_task_list__children_of():
+    tasks = TaskList([
+        Task(id="parent1"),
+        Task(id="child1", parent_id="parent1"),
+        Task(id="parent2"),
+        Task(id="child2", parent_id="parent1"),
+    ])
+    assert [t.id for t in tasks.children_of("parent1")] == ["child1", "child2"]
+    assert tasks.children_of("parent2") == []
+
+def test_task_list__children_index_follows_changes(mock_api):
+    tasks = TaskList([Task(id="parent1"), Task(id="child1", parent_id="parent1")])
+    assert len(tasks.children_of("parent1")) == 1
+    version = tasks.version
+
+    upsert_task(TEST_CREDS, tasks, Task(title="Child 2", parent_id="parent1"))
+    assert tasks.version > version
+    assert [t.id for t in tasks.children_of("parent1")] == ["newtask", "child1"]
+
+    update_task(TEST_CREDS, tasks, Task(id="child1", completed="2024-01-01T00:00:00Z"))
+    assert [t.id for t in tasks.children_of("parent1")] == ["newtask"]
+
+def in_order(tasks):
+    keys = [tasks.order_key(t) for t in tasks]
+    return keys == sorted(keys)
+
+@pytest.fixture
+def ordered_tasks(monkeypatch):
+    monkeypatch.setattr('tasklist._listings', tasklist._listings.__class__())
+    monkeypatch.setattr(api, 'get_all_tasklists_tasks', MagicMock(return_value={
+        "default": [{"items": [
+            {"id": "b1", "title": "B1", "parent": "b", "position": "00000000000000000001"},
+            {"id": "b", "title": "B", "position": "00000000000000000002"},
+            {"id": "a", "title": "A", "position": "00000000000000000001"},
+            {"id": "b0", "title": "B0", "parent": "b", "position": "00000000000000000000"},
+        ]}],
+        "work": [{"items": [{"id": "c", "title": "C", "position": "00000000000000000000"}]}],
+    }))
+    return from_api(TEST_CREDS)
+
+def test_from_api__puts_subtasks_after_their_parent(ordered_tasks):
+    assert [t.id for t in ordered_tasks] == ["a", "b", "b0", "b1", "c"]
+    assert ordered_tasks[2].position == "00000000000000000000"
+    assert in_order(ordered_tasks)
+
+def test_position_between():
+    assert tasklist._position_between("", None) == "5"
+    assert "01" < tasklist._position_between("01", "02") < "02"
+    assert "0199" < tasklist._position_between("0199", "02") < "02"
+    assert "" < tasklist._position_between("", "00000000000000000000") < "00000000000000000000"
+    assert "00000000000000000009" < tasklist._position_between("00000000000000000009", None)
+    assert tasklist._position_between("0", "000") == "00"
+    # No room
+    assert tasklist._position_between("1", "1") is None
+    assert tasklist._position_between("0", "00") is None
+    assert tasklist._position_between("2", "1") is None
+
+def test_insert_task__first_among_siblings(mock_api, ordered_tasks):
+    insert_task(TEST_CREDS, ordered_tasks, Task(title="New"))
+    subtask = Task(title="Sub", parent_id="b")
+    mock_api.insert_task.return_value = {"id": "newsub"}
+    insert_task(TEST_CREDS, ordered_tasks, subtask)
+    assert [t.id for t in ordered_tasks] == ["newtask", "a", "b", "newsub", "b0", "b1", "c"]
+    assert in_order(ordered_tasks)
+    assert ordered_tasks.children_of("b")[0] is subtask
+
+def test_update_task__stays_in_place(mock_api, ordered_tasks):
+    version = ordered_tasks.version
+    update_task(TEST_CREDS, ordered_tasks, Task(id="b", title="B edited"))
+    assert [t.title for t in ordered_tasks] == ["A", "B edited", "B0", "B1", "C"]
+    assert ordered_tasks.version == version + 1
+    # Completing a task leaves its subtasks where they were
+    update_task(TEST_CREDS, ordered_tasks, Task(id="b", completed="2024-01-01T00:00:00Z"))
+    assert [t.id for t in ordered_tasks] == ["a", "b0", "b1", "c"]
+    assert in_order(ordered_tasks)
+
+def test_merge_changes__in_order(ordered_tasks):
+    merge_changes(ordered_tasks, [
+        {"id": "b0", "title": "B0", "parent": "b", "position": "00000000000000000005"},
+        {"id": "d", "title": "D", "position": "00000000000000000003"},
+        {"id": "b", "title": "B", "position": "00000000000000000000"},
+        {"id": "a", "status": "completed"},
+    ], "default")
+    assert [t.id for t in ordered_tasks] == ["b", "b1", "b0", "d", "c"]
+    assert in_order(ordered_tasks)
+
+def test_task_list__indexes_follow_ordered_changes(mock_api, ordered_tasks):
+    # Built once, then kept current by the ordered methods rather than rebuilt
+    assert ordered_tasks.get("b").title == "B"
+    by_id = ordered_tasks._by_id
+    update_task(TEST_CREDS, ordered_tasks, Task(id="b", title="B edited"))
+    insert_task(TEST_CREDS, ordered_tasks, Task(title="Sub", parent_id="b"))
+    update_task(TEST_CREDS, ordered_tasks, Task(id="a", completed="2024-01-01T00:00:00Z"))
+    assert ordered_tasks._by_id is by_id
+    assert ordered_tasks.get("b").title == "B edited"
+    assert ordered_tasks.get("a") is None
+    assert [t.id for t in ordered_tasks.children_of("b")] == ["newtask", "b0", "b1"]
+    assert [t.id for t in ordered_tasks.top_level("default")] == ["b"]
+    assert [t.id for t in ordered_tasks.top_level("work")] == ["c"]
+
+    ordered_tasks.append(Task(id="e", tasklist_id="work"))
+    assert ordered_tasks.get("e").tasklist_id == "work"
+    assert ordered_tasks._by_id is not by_id
+
+def test_task_list__rename(ordered_tasks):
+    stats = ordered_tasks.stats()
+    assert ordered_tasks.rename("b", "real-b")
+    assert not ordered_tasks.rename("b", "real-b")
+    assert ordered_tasks.get("b") is None
+    assert ordered_tasks.get("real-b").title == "B"
+    assert [t.parent_id for t in ordered_tasks.children_of("real-b")] == ["real-b", "real-b"]
+    assert ordered_tasks.stats() is stats
+
+def test_task_list__creds_not_pickled(ordered_tasks):
+    import pickle
+    assert ordered_tasks.creds is TEST_CREDS
+    ordered_tasks.get("a")
+    copy = pickle.loads(pickle.dumps(ordered_tasks))
+    assert copy.creds is None
+    assert [t.id for t in copy] == [t.id for t in ordered_tasks]
+    assert copy.children_of("b")[0].id == "b0"
+
+@pytest.mark.parametrize("seed", range(50))
+def test_task_list__stays_in_order_through_random_edits(mock_api, seed):
+    import itertools, random
+    rng = random.Random(seed)
+    ids = itertools.count()
+    mock_api.insert_task.side_effect = lambda creds, task, batch=None, outbox=None: {"id": f"new{next(ids)}"}
+    tasks = TaskList([Task(id=f"t{i}", title=f"T{i}", priority=rng.randint(0, 3), position=f"{i:020d}") for i in range(5)])
+    tasks.default_tasklist_id = ""
+    for _ in range(40):
+        top_level = [t for t in tasks if not t.parent_id]
+        action = rng.choice(("new", "edit", "subtask", "complete"))
+        if action == "new" or not top_level:
+            task = Task(title="New", priority=rng.randint(0, 3))
+        elif action == "subtask":
+            task = Task(title="Sub", parent_id=rng.choice(top_level).id)
+        else:
+            old = rng.choice(tasks)
+            task = Task(id=old.id, title=old.title, priority=rng.randint(0, 3), parent_id=old.parent_id,
+                        completed="2024-01-01T00:00:00Z" if action == "complete" else "")
+        tasks.upsert(task)
+        if not task.parent_id and not task.completed:
+            tasks.reposition(task)
+
+        keys = [tasks.order_key(t) for t in tasks]
+        assert keys == sorted(keys)
+        assert all(tasks.get(t.id) is t for t in tasks)
+        for parent in tasks:
+            assert tasks.children_of(parent.id) == [t for t in tasks if t.parent_id == parent.id]
+        assert tasks.top_level("") == [t for t in tasks if not t.parent_id]
@@ -0,0 +1,72 @@
+import pytest
+import timing
+
+@pytest.fixture
+def timing_enabled(monkeypatch):
+    monkeypatch.setattr(timing, 'enabled', True)
+
+def test_timer_disabled_is_shared_no_op():
+    assert timing.timer('parse') is timing.timer('sort')
+    with timing.collect() as timings:
+        with timing.timer('parse'):
+            pass
+    assert timings is None
+
+def test_collect_records_stages(timing_enabled):
+    with timing.collect() as timings:
+        with timing.timer('fetch_page'):
+            pass
+        with timing.timer('parse'):
+            pass
+    assert [stage for stage, seconds in timings] == ['fetch_page', 'parse']
+    assert all(seconds >= 0 for stage, seconds in timings)
+
+def test_timer_outside_collect_records_nothing(timing_enabled):
+    with timing.timer('parse'):
+        pass
+    with timing.collect() as timings:
+        pass
+    assert timings == []
+
+def test_collect_nests(timing_enabled):
+    with timing.collect() as outer:
+        with timing.collect() as inner:
+            with timing.timer('parse'):
+                pass
+        with timing.timer('sort'):
+            pass
+    assert [stage for stage, seconds in inner] == ['parse']
+    assert [stage for stage, seconds in outer] == ['parse', 'sort']
+
+def test_timed_records_each_call(timing_enabled):
+    @timing.timed('api.get_tasks')
+    def get_tasks():
+        return 'tasks'
+
+    with timing.collect() as timings:
+        assert get_tasks() == 'tasks'
+        get_tasks()
+    assert [span for span, seconds in timings] == ['api.get_tasks', 'api.get_tasks']
+
+def test_server_timing_header_sums_repeated_spans():
+    header = timing.server_timing_header([('api.patch_task', 0.001), ('render_template', 0.0025), ('api.patch_task', 0.002)])
+    assert header == 'api.patch_task;dur=3.00;desc="2 calls", render_template;dur=2.50'
+
+def test_rolling_histogram_quantiles():
+    histogram = timing.RollingHistogram(window=100)
+    for i in range(1, 201):
+        histogram.observe(i / 1000)
+    assert histogram.quantiles(timing.QUANTILES) == {0.5: 0.151, 0.95: 0.196, 0.99: 0.2}
+    assert histogram.count == 200
+    assert histogram.sum == pytest.approx(20.1)
+
+def test_rolling_histogram_empty():
+    assert timing.RollingHistogram().quantiles((0.5,)) == {0.5: 0.0}
+
+def test_prometheus_text(monkeypatch):
+    monkeypatch.setattr(timing, 'histograms', {})
+    timing.observe('summary.get_stats', 0.5)
+    text = timing.prometheus_text()
+    assert '# TYPE todo_span_seconds summary' in text
+    assert 'todo_span_seconds{span="summary.get_stats",quantile="0.99"} 0.500000' in text
+    assert 'todo_span_seconds_count{span="summary.get_stats"} 1' in text
@@ -0,0 +1,243 @@
+import threading
+import time
+import pytest
+from unittest.mock import Mock
+from googleapiclient import errors
+
+import api
+import writeback
+from reorder import reposition_updated_task
+from task import Task
+from tasklist import TaskList, upsert_task
+from writeback import Outbox, WriteBehindQueue
+
+class HttpError(errors.HttpError):
+    def __init__(self, status):
+        super().__init__(Mock(status=status), b'')
+
+    def __str__(self):
+        return f'HTTP {self.resp.status}'
+
+class FakeBatch:
+    """Stand-in for api.Batch that makes its requests in order when executed"""
+    def __init__(self, fake_api, creds):
+        self.fake_api = fake_api
+        self.creds = creds
+        self.results = []
+        self._requests = []
+
+    def add(self, request):
+        self._requests.append(request)
+
+    def execute(self, raise_errors=True):
+        requests, self._requests = self._requests, []
+        self.fake_api.batches.append(len(requests))
+        self.results = []
+        for request in requests:
+            try:
+                self.results.append((request(), None))
+            except Exception as error:
+                self.results.append((None, error))
+
+class FakeApi:
+    """Records the mutations the worker makes, optionally failing the first few of them"""
+    def __init__(self, monkeypatch, failures=()):
+        self.calls = []
+        self.batches = []
+        self.failures = list(failures)
+        self.next_id = 0
+        self.release = threading.Event()
+        self.release.set()
+        # Holds up just the calls for tasks titled 'Slow'
+        self.slow = threading.Event()
+        self.slow.set()
+
+        def send(request, batch):
+            if batch is None:
+                return request()
+            batch.add(request)
+
+        def patch_task(creds, task, batch=None):
+            return send(lambda: self.record('patch', task.id, task.title), batch)
+
+        def insert_task(creds, task, batch=None):
+            def insert():
+                self.record('insert', task.parent_id or None, task.title)
+                self.next_id += 1
+                return {'id': f'real{self.next_id}'}
+            return send(insert, batch)
+
+        def move_task(creds, task_id, parent_id, previous_id=None, batch=None, tasklist_id=None):
+            return send(lambda: self.record('move', task_id, previous_id), batch)
+
+        for f in (patch_task, insert_task, move_task):
+            monkeypatch.setattr(api, f.__name__, api._deferrable(f))
+        monkeypatch.setattr(api, 'Batch', lambda creds: FakeBatch(self, creds))
+
+    def record(self, *call):
+        self.release.wait(5)
+        if call[-1] == 'Slow':
+            self.slow.wait(5)
+        if self.failures:
+            raise self.failures.pop(0)
+        self.calls.append(call)
+        return {'id': call[1]}
+
+@pytest.fixture
+def queue(monkeypatch):
+    queue = WriteBehindQueue()
+    monkeypatch.setattr(writeback, 'write_queue', queue)
+    return queue
+
+def test_outbox_defers_calls_until_submitted(monkeypatch, queue):
+    fake_api = FakeApi(monkeypatch)
+    tasks = TaskList([Task(id='task1', title='Task 1')])
+    outbox = Outbox(Mock(), 'session')
+    upsert_task(None, tasks, Task(id='task1', title='Edited'), outbox=outbox)
+    assert len(outbox) == 1
+    assert tasks[0].title == 'Edited'
+    assert fake_api.calls == []
+
+    outbox.submit()
+    assert queue.drain(5)
+    assert fake_api.calls == [('patch', 'task1', 'Edited')]
+
+def test_submission_sent_as_one_batch(monkeypatch, queue):
+    fake_api = FakeApi(monkeypatch)
+    with Outbox(Mock(), 'session') as outbox:
+        api.patch_task(None, Task(id='task1', title='Task 1'), outbox=outbox)
+        api.patch_task(None, Task(id='task2', title='Task 2'), outbox=outbox)
+        api.insert_task(None, Task(title='New'), outbox=outbox)
+    assert queue.drain(5)
+    assert fake_api.batches == [3]
+    assert fake_api.calls == [('patch', 'task1', 'Task 1'), ('patch', 'task2', 'Task 2'), ('insert', None, 'New')]
+
+def test_new_task_gets_temp_id_then_real_id(monkeypatch, queue):
+    fake_api = FakeApi(monkeypatch)
+    tasks = TaskList([Task(id='task1', title='Task 1', priority=3)])
+    new_task = Task(title='New', priority=0)
+    with Outbox(Mock(), 'session') as outbox:
+        upsert_task(None, tasks, new_task, outbox=outbox)
+        reposition_updated_task(None, tasks, new_task, outbox=outbox)
+        temp_id = new_task.id
+        assert writeback.is_temp_id(temp_id)
+    assert queue.drain(5)
+
+    assert fake_api.calls == [('insert', None, 'New'), ('move', 'real1', None)]
+    # The worker leaves the task in the session's list alone, for resolve_ids to rename
+    assert new_task.id == temp_id
+    assert tasks.get(temp_id) is new_task
+    # The move needed the insert's response for the new id, so went in a batch of its own
+    assert fake_api.batches == [1, 1]
+    assert queue.resolve_id(temp_id) == 'real1'
+    # A copy of the list, as the session store would load it
+    stored = TaskList([Task(id=temp_id, title='New'), Task(id='child', parent_id=temp_id)])
+    assert queue.resolve_ids(stored)
+    assert [(t.id, t.parent_id) for t in stored] == [('real1', ''), ('child', 'real1')]
+    assert not queue.resolve_ids(stored)
+
+def test_calls_for_temp_id_resolved_when_made(monkeypatch, queue):
+    fake_api = FakeApi(monkeypatch)
+    fake_api.release.clear()
+    tasks = TaskList()
+    parent = Task(title='Parent')
+    with Outbox(Mock(), 'session') as outbox:
+        upsert_task(None, tasks, parent, outbox=outbox)
+    # Edit the new task and add a subtask to it before its insert has gone through
+    with Outbox(Mock(), 'session') as outbox:
+        upsert_task(None, tasks, Task(id=parent.id, title='Parent edited'), outbox=outbox)
+        upsert_task(None, tasks, Task(title='Child', parent_id=parent.id), outbox=outbox)
+    fake_api.release.set()
+    assert queue.drain(5)
+    assert fake_api.calls == [('insert', None, 'Parent'), ('patch', 'real1', 'Parent edited'), ('insert', 'real1', 'Child')]
+
+def test_repeated_patches_coalesce(monkeypatch, queue):
+    fake_api = FakeApi(monkeypatch)
+    fake_api.release.clear()
+    tasks = TaskList([Task(id='task1'), Task(id='task2')])
+    with Outbox(Mock(), 'session') as outbox:
+        upsert_task(None, tasks, Task(id='task2', title='Blocker'), outbox=outbox)
+    # Wait for the worker to be held up making it
+    deadline = time.monotonic() + 5
+    while queue.pending('session') and time.monotonic() < deadline:
+        time.sleep(0.01)
+    for title in ('First', 'Second', 'Third'):
+        with Outbox(Mock(), 'session') as outbox:
+            upsert_task(None, tasks, Task(id='task1', title=title), outbox=outbox)
+    assert queue.pending('session') == 1
+    fake_api.release.set()
+    assert queue.drain(5)
+    assert fake_api.calls == [('patch', 'task2', 'Blocker'), ('patch', 'task1', 'Third')]
+
+def test_resends_transient_batch_errors_alone(monkeypatch, queue):
+    fake_api = FakeApi(monkeypatch, failures=[HttpError(503)])
+    with Outbox(Mock(), 'session') as outbox:
+        api.patch_task(None, Task(id='task1', title='Task 1'), outbox=outbox)
+    assert queue.drain(5)
+    assert fake_api.calls == [('patch', 'task1', 'Task 1')]
+    assert queue.pop_failures('session') == []
+
+def test_doesnt_retry_errors_api_execute_gave_up_on(monkeypatch, queue):
+    # api.execute has already retried these, so the worker shouldn't multiply its attempts
+    fake_api = FakeApi(monkeypatch, failures=[HttpError(503), ValueError('bad'), HttpError(503)])
+    with Outbox(Mock(), 'session') as outbox:
+        api.patch_task(None, Task(id='task1', title='Task 1'), outbox=outbox)
+        api.patch_task(None, Task(id='task2', title='Task 2'), outbox=outbox)
+    assert queue.drain(5)
+    assert fake_api.calls == []
+    assert len(queue.pop_failures('session')) == 2
+
+def test_slow_session_doesnt_hold_up_others(monkeypatch, queue):
+    fake_api = FakeApi(monkeypatch)
+    fake_api.slow.clear()
+    with Outbox(Mock(), 'slow session') as outbox:
+        api.patch_task(None, Task(id='task1', title='Slow'), outbox=outbox)
+    with Outbox(Mock(), 'session') as outbox:
+        api.patch_task(None, Task(id='task2', title='Fast'), outbox=outbox)
+    deadline = time.monotonic() + 5
+    while ('patch', 'task2', 'Fast') not in fake_api.calls and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert fake_api.calls == [('patch', 'task2', 'Fast')]
+    fake_api.slow.set()
+    assert queue.drain(5)
+    assert fake_api.calls[-1] == ('patch', 'task1', 'Slow')
+
+def test_records_failures_for_the_session(monkeypatch, queue):
+    fake_api = FakeApi(monkeypatch, failures=[HttpError(400)])
+    with Outbox(Mock(), 'session') as outbox:
+        api.patch_task(None, Task(id='task1', title='Task 1'), outbox=outbox)
+    assert queue.drain(5)
+    assert fake_api.calls == []
+    assert queue.pop_failures('other session') == []
+    assert queue.pop_failures('session') == ["Couldn't patch task Task 1: HTTP 400"]
+    assert queue.pop_failures('session') == []
+
+def test_calls_depending_on_failed_insert_fail(monkeypatch, queue):
+    fake_api = FakeApi(monkeypatch, failures=[HttpError(500)] * 2)
+    new_task = Task(title='New')
+    with Outbox(Mock(), 'session') as outbox:
+        api.insert_task(None, new_task, outbox=outbox)
+        api.move_task(None, new_task.id, None, None, outbox=outbox)
+    assert queue.drain(5)
+    assert fake_api.calls == []
+    failures = queue.pop_failures('session')
+    assert len(failures) == 2
+    assert 'never created' in failures[1]
+
+def test_resolve_ids_renames_the_sessions_new_tasks(monkeypatch, queue):
+    FakeApi(monkeypatch)
+    tasks = TaskList([Task(id='task1', title='Task 1')])
+    new_task = Task(title='New')
+    with Outbox(Mock(), 'session') as outbox:
+        upsert_task(None, tasks, new_task, outbox=outbox)
+    temp_id = new_task.id
+    assert queue.drain(5)
+
+    stored = TaskList([Task(id=temp_id, title='New'), Task(id='child', parent_id=temp_id)])
+    assert not queue.resolve_ids(stored, 'other session')
+    assert queue.resolve_ids(stored, 'session')
+    assert stored.get('real1').title == 'New'
+    assert [t.parent_id for t in stored.children_of('real1')] == ['real1']
+    # Once the stored list has the real id, the temp id is forgotten
+    assert not queue.resolve_ids(stored, 'session')
+    assert queue._temp_ids == {}
@@ -0,0 +1,186 @@
+"""
+Stage timing instrumentation. Off unless the TIMING environment variable is set to 1,
+and when off a timer is a shared no-op so instrumented code pays next to nothing.
+
+Timers record into the collection started by collect() on the current thread, if any:
+
+    with timing.collect() as timings:
+        with timing.timer('parse'):
+            ...
+    timings  # [('parse', seconds)]
+
+init_app() adds per-request profiling to a Flask app on top of this: every request's spans
+are sent back in a Server-Timing header and fed into rolling histograms served at /metrics.
+"""
+from collections import deque
+from functools import wraps
+import logging
+import os
+import threading
+import time
+
+from flask import g, request, abort, Response
+
+logger = logging.getLogger(__name__)
+
+enabled = os.environ.get('TIMING') == '1'
+
+_local = threading.local()
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        return False
+
+_NULL_TIMER = _NullTimer()
+
+class _Timer:
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        elapsed = time.perf_counter() - self.start
+        logger.debug("%s took %.1fms", self.stage, elapsed * 1000)
+        timings = getattr(_local, 'timings', None)
+        if timings is not None:
+            timings.append((self.stage, elapsed))
+        return False
+
+def timer(stage):
+    """Context manager that times the block as the given stage"""
+    return _Timer(stage) if enabled else _NULL_TIMER
+
+class collect:
+    """
+    Context manager that collects the (stage, seconds) timings recorded on this thread inside the block.
+    Collections nest: when the block ends, its timings are added to the collection around it too.
+    """
+    def __enter__(self):
+        self.previous = getattr(_local, 'timings', None)
+        _local.timings = [] if enabled else None
+        return _local.timings
+
+    def __exit__(self, exc_type, exc, traceback):
+        timings, _local.timings = _local.timings, self.previous
+        if timings and self.previous is not None:
+            self.previous.extend(timings)
+        return False
+
+def bind(f):
+    """Wrap f so that, on whichever thread it runs, it records into the calling thread's current collection"""
+    timings = getattr(_local, 'timings', None)
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        previous = getattr(_local, 'timings', None)
+        _local.timings = timings
+        try:
+            return f(*args, **kwargs)
+        finally:
+            _local.timings = previous
+    return wrapper
+
+def timed(span):
+    """Decorator that times every call of the function as the given span"""
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return f(*args, **kwargs)
+            with _Timer(span):
+                return f(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def summarize(timings):
+    """Total seconds and call count per span, in the order spans first appeared"""
+    totals = {}
+    for span, seconds in timings:
+        total, count = totals.get(span, (0.0, 0))
+        totals[span] = (total + seconds, count + 1)
+    return totals
+
+class RollingHistogram:
+    """Quantiles over the most recent window of samples, plus a running count and sum of all of them"""
+    def __init__(self, window=1000):
+        self.samples = deque(maxlen=window)
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        with self._lock:
+            self.samples.append(seconds)
+            self.count += 1
+            self.sum += seconds
+
+    def quantiles(self, qs):
+        with self._lock:
+            samples = sorted(self.samples)
+        if not samples:
+            return {q: 0.0 for q in qs}
+        return {q: samples[min(len(samples) - 1, int(q * len(samples)))] for q in qs}
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+histograms = {}
+_histograms_lock = threading.Lock()
+
+def observe(span, seconds):
+    histogram = histograms.get(span)
+    if histogram is None:
+        with _histograms_lock:
+            histogram = histograms.setdefault(span, RollingHistogram())
+    histogram.observe(seconds)
+
+def server_timing_header(timings):
+    """Server-Timing header value for a request's spans, with repeated spans added together"""
+    return ', '.join(f'{span};dur={total * 1000:.2f}' + (f';desc="{count} calls"' if count > 1 else '')
+                     for span, (total, count) in summarize(timings).items())
+
+def prometheus_text():
+    """The span histograms in Prometheus text exposition format"""
+    lines = ['# HELP todo_span_seconds Time spent in each instrumented span per request', '# TYPE todo_span_seconds summary']
+    for span, histogram in sorted(histograms.items()):
+        for q, seconds in histogram.quantiles(QUANTILES).items():
+            lines.append(f'todo_span_seconds{{span="{span}",quantile="{q}"}} {seconds:.6f}')
+        lines.append(f'todo_span_seconds_sum{{span="{span}"}} {histogram.sum:.6f}')
+        lines.append(f'todo_span_seconds_count{{span="{span}"}} {histogram.count}')
+    return '\n'.join(lines) + '\n'
+
+def init_app(app):
+    """Profile each request of the Flask app while timing is enabled, and serve the histograms at /metrics"""
+    @app.before_request
+    def start_request_timing():
+        if enabled:
+            g.request_timing = collect()
+            g.request_timings = g.request_timing.__enter__()
+            g.request_start = time.perf_counter()
+
+    @app.after_request
+    def finish_request_timing(response):
+        timings = g.get('request_timings')
+        if timings is None:
+            return response
+        timings.append((f'request.{request.endpoint}', time.perf_counter() - g.request_start))
+        for span, (total, count) in summarize(timings).items():
+            observe(span, total)
+        response.headers['Server-Timing'] = server_timing_header(timings)
+        return response
+
+    @app.teardown_request
+    def stop_request_timing(exc):
+        request_timing = g.pop('request_timing', None)
+        if request_timing is not None:
+            request_timing.__exit__(None, None, None)
+
+    @app.route('/metrics')
+    def metrics():
+        if not enabled:
+            abort(404)
+        return Response(prometheus_text(), mimetype='text/plain; version=0.0.4')
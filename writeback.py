@@ -0,0 +1,342 @@
+"""
+Write-behind queue for task mutations, so saving a task doesn't wait on Google.
+
+Routes update the local task list straight away and hand the API calls to an Outbox (passed
+as the mutations' outbox argument). When the Outbox is submitted its calls are queued for a
+small pool of background workers, which send each session's queued calls in order, together as
+api.Batch requests. Retrying transient errors is left to api.execute:
+
+    with writeback.Outbox(creds, session_id) as outbox:
+        tasklist.upsert_task(creds, tasks, task, outbox=outbox)
+
+New tasks get a temporary id until their insert has gone through; later calls that refer to
+them are given the real id, and resolve_ids() swaps it into the session's task list.
+Calls that fail for good are kept per session, for the UI to show with pop_failures().
+"""
+from collections import OrderedDict, deque
+import atexit
+import logging
+import os
+import threading
+import time
+import uuid
+
+import api
+from task import Task
+from tasklist import TaskList
+
+logger = logging.getLogger(__name__)
+
+TEMP_ID_PREFIX = 'pending-'
+
+# Worker threads making queued calls. Each session's calls are made by one worker at a time, in order
+WORKERS = int(os.environ.get('WRITEBACK_WORKERS', 4))
+
+# Most calls sent in one batch request
+BATCH_SIZE = int(os.environ.get('WRITEBACK_BATCH_SIZE', 50))
+
+# How many temp id -> real id mappings and failures per session to remember
+MAX_RESOLVED_IDS = 10000
+MAX_FAILURES = 20
+
+def is_temp_id(task_id):
+    return bool(task_id) and task_id.startswith(TEMP_ID_PREFIX)
+
+def _call_key(call, args):
+    """Calls with the same key supersede each other, e.g. two patches of the same task"""
+    if call.__name__ == 'insert_task' or not args:
+        return None
+    target = args[0]
+    return (call.__name__, target.id if isinstance(target, Task) else target)
+
+class _PendingCall:
+    __slots__ = ('session_id', 'creds', 'call', 'args', 'kwargs', 'key', 'temp_id', 'cancelled')
+
+    def __init__(self, session_id, creds, call, args, kwargs):
+        self.session_id = session_id
+        self.creds = creds
+        self.call = call
+        self.args = args
+        self.kwargs = kwargs
+        self.key = _call_key(call, args)
+        # The temporary id of the task this call creates, if it's an insert of one. Kept, since
+        # the task itself is the session's, and gets the real id when its list is resolved
+        task = args[0] if args and isinstance(args[0], Task) else None
+        creating = call.__name__ == 'insert_task' and task is not None and is_temp_id(task.id)
+        self.temp_id = task.id if creating else None
+        self.cancelled = False
+
+    def describe(self):
+        target = self.args[0] if self.args else ''
+        if isinstance(target, Task):
+            target = target.title or target.id
+        return f"{self.call.__name__.replace('_', ' ')} {target}".strip()
+
+class Outbox:
+    """
+    Collects one submission's API calls for the write-behind queue.
+    Use as a context manager (the calls are queued on exit) or call submit() directly.
+    """
+    def __init__(self, creds, session_id, queue=None):
+        self.creds = creds
+        self.session_id = session_id
+        self.queue = queue or write_queue
+        self._calls = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is None:
+            self.submit()
+
+    def __len__(self):
+        return len(self._calls)
+
+    def defer(self, call, creds, *args, **kwargs):
+        """
+        Record an API call to make later. A task being created gets a temporary id,
+        so the rest of the submission can refer to it.
+        """
+        task = args[0] if args and isinstance(args[0], Task) else None
+        if task is not None and not task.id:
+            task.id = TEMP_ID_PREFIX + uuid.uuid4().hex
+        self._calls.append(_PendingCall(self.session_id, creds, call, args, kwargs))
+
+    def submit(self):
+        """Queue the recorded calls"""
+        calls, self._calls = self._calls, []
+        self.queue.put(calls)
+
+class WriteBehindQueue:
+    """
+    Makes queued API calls on a pool of background worker threads. Each session's calls are made
+    in the order they were queued, a batch request at a time, so one user waiting out rate limits
+    only holds up their own calls. A call still waiting when another with the same key arrives is
+    dropped in its favour.
+    """
+    def __init__(self, workers=WORKERS):
+        self.workers = workers
+        # Session id -> its calls not taken by a worker yet
+        self._calls = {}
+        # Sessions with calls waiting and no worker on them, in the order they'll be picked up
+        self._ready = deque()
+        # Sessions a worker is making calls for
+        self._active = set()
+        self._waiting = {}
+        self._condition = threading.Condition()
+        self._workers = []
+        self._resolved = OrderedDict()
+        # Session id -> temp ids of the tasks it created, until they're gone from its task list
+        self._temp_ids = {}
+        self._failures = {}
+
+    def put(self, calls):
+        with self._condition:
+            for pending in calls:
+                if pending.key is not None:
+                    superseded = self._waiting.get((pending.session_id, pending.key))
+                    if superseded is not None:
+                        superseded.cancelled = True
+                    self._waiting[(pending.session_id, pending.key)] = pending
+                session_calls = self._calls.get(pending.session_id)
+                if session_calls is None:
+                    session_calls = self._calls[pending.session_id] = deque()
+                    if pending.session_id not in self._active:
+                        self._ready.append(pending.session_id)
+                session_calls.append(pending)
+                if pending.temp_id:
+                    self._temp_ids.setdefault(pending.session_id, set()).add(pending.temp_id)
+            self._workers = [worker for worker in self._workers if worker.is_alive()]
+            if len(self._workers) < min(self.workers, len(self._ready) + len(self._active)):
+                worker = threading.Thread(target=self._run, name=f'writeback-{len(self._workers)}', daemon=True)
+                worker.start()
+                self._workers.append(worker)
+            self._condition.notify_all()
+
+    def pending(self, session_id):
+        """Number of this session's calls not made yet"""
+        with self._condition:
+            return sum(1 for pending in self._calls.get(session_id, ()) if not pending.cancelled)
+
+    def drain(self, timeout=None):
+        """Wait until every queued call has been made (or given up on). Returns whether it finished in time."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            while self._calls or self._active:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+        return True
+
+    def resolve_id(self, task_id):
+        """The real id of a task created with a temporary id, once it's known (otherwise the id unchanged)"""
+        with self._condition:
+            return self._resolved.get(task_id, task_id)
+
+    def resolve_ids(self, tasks, session_id=None):
+        """
+        Swap real ids in for any temporary ids in the task list whose inserts have gone through.
+        Given the session the list belongs to, a TaskList only has the session's own new tasks
+        renamed, by id, rather than every task checked. Returns whether any ids changed.
+        """
+        if isinstance(tasks, TaskList) and session_id is not None:
+            return self._resolve_session_ids(tasks, session_id)
+        version = getattr(tasks, 'version', None)
+        changed = False
+        for index, task in enumerate(tasks):
+            if is_temp_id(task.id) or is_temp_id(task.parent_id):
+                task_id, parent_id = self.resolve_id(task.id), self.resolve_id(task.parent_id)
+                if (task_id, parent_id) != (task.id, task.parent_id):
+                    task.id, task.parent_id = task_id, parent_id
+                    changed = True
+                    # Reassign so a TaskList rebuilds anything indexed by id
+                    tasks[index] = task
+        if isinstance(tasks, TaskList):
+            # Same tasks, so the stats still hold
+            tasks.track_changes(version)
+        return changed
+
+    def _resolve_session_ids(self, tasks, session_id):
+        with self._condition:
+            temp_ids = self._temp_ids.get(session_id, set())
+            resolved = {temp_id: self._resolved[temp_id] for temp_id in temp_ids if temp_id in self._resolved}
+        changed = False
+        for temp_id, real_id in resolved.items():
+            if tasks.rename(temp_id, real_id):
+                changed = True
+            else:
+                # Already renamed in the stored list, which this one was loaded from
+                self._forget_temp_id(session_id, temp_id)
+        return changed
+
+    def _forget_temp_id(self, session_id, temp_id):
+        with self._condition:
+            temp_ids = self._temp_ids.get(session_id)
+            if temp_ids is not None:
+                temp_ids.discard(temp_id)
+                if not temp_ids:
+                    del self._temp_ids[session_id]
+
+    def pop_failures(self, session_id):
+        """Descriptions of this session's calls that failed for good since the last time they were popped"""
+        with self._condition:
+            return list(self._failures.pop(session_id, ()))
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._ready:
+                    self._condition.wait()
+                session_id = self._ready.popleft()
+                session_calls = self._calls[session_id]
+                calls = []
+                while session_calls and len(calls) < BATCH_SIZE:
+                    pending = session_calls.popleft()
+                    if self._waiting.get((session_id, pending.key)) is pending:
+                        del self._waiting[(session_id, pending.key)]
+                    if not pending.cancelled:
+                        calls.append(pending)
+                if not session_calls:
+                    del self._calls[session_id]
+                self._active.add(session_id)
+            try:
+                if calls:
+                    self._make_calls(calls)
+            finally:
+                with self._condition:
+                    self._active.discard(session_id)
+                    if session_id in self._calls:
+                        # Queued while this batch was being made, so they go after it
+                        self._ready.append(session_id)
+                    self._condition.notify_all()
+
+    def _resolve(self, value):
+        if isinstance(value, Task):
+            # A copy, since the task is still in the session's list, which only request threads change
+            value = value.copy()
+            value.id = self.resolve_id(value.id)
+            value.parent_id = self.resolve_id(value.parent_id)
+            return value
+        if isinstance(value, str) and is_temp_id(value):
+            return self.resolve_id(value)
+        return value
+
+    def _arguments(self, pending):
+        """The call's arguments with real ids swapped in, and the temporary ids still left in them"""
+        args = [self._resolve(arg) for arg in pending.args]
+        kwargs = {name: self._resolve(value) for name, value in pending.kwargs.items()}
+        task = args[0] if args and isinstance(args[0], Task) else None
+        unresolved = {value for value in [*args, *kwargs.values()] if isinstance(value, str) and is_temp_id(value)}
+        if task is not None:
+            creating = pending.call.__name__ == 'insert_task'
+            unresolved.update(task_id for task_id in (task.parent_id, None if creating else task.id) if is_temp_id(task_id))
+        return args, kwargs, unresolved
+
+    def _make_calls(self, calls):
+        """
+        Send the session's calls in one batch request. A call needing the id of a task whose insert
+        is in the batch can't be built until the insert's response is back, so the batch so far is sent first.
+        """
+        batch, batched, creating = api.Batch(calls[0].creds), [], set()
+        for pending in calls:
+            args, kwargs, unresolved = self._arguments(pending)
+            if unresolved & creating:
+                self._send(batch, batched)
+                batch, batched, creating = api.Batch(pending.creds), [], set()
+                args, kwargs, unresolved = self._arguments(pending)
+            if unresolved:
+                # Depends on an insert that failed
+                self._fail(pending, "the task it refers to was never created")
+                continue
+            try:
+                pending.call(pending.creds, *args, **{**kwargs, 'batch': batch})
+            except Exception as error:
+                self._fail(pending, error)
+                continue
+            batched.append((pending, args, kwargs))
+            if pending.temp_id:
+                creating.add(pending.temp_id)
+        self._send(batch, batched)
+
+    def _send(self, batch, batched):
+        if not batched:
+            return
+        try:
+            batch.execute(raise_errors=False)
+            sent = True
+        except Exception as error:
+            # Already retried as a whole by api.execute, so every call in it has failed
+            logger.warning("Giving up on a batch of %d calls: %s", len(batched), error)
+            sent = False
+        for (pending, args, kwargs), (result, error) in zip(batched, batch.results):
+            if sent and error is not None and api.is_transient_error(error):
+                # Requests within a batch aren't retried, so send this one again on its own, where api.execute retries it
+                try:
+                    result, error = pending.call(pending.creds, *args, **kwargs), None
+                except Exception as call_error:
+                    error = call_error
+            if error is not None:
+                self._fail(pending, error)
+                continue
+            if pending.temp_id and result:
+                # The session's list gets the real id from resolve_ids, on a request thread
+                with self._condition:
+                    self._resolved[pending.temp_id] = result['id']
+                    while len(self._resolved) > MAX_RESOLVED_IDS:
+                        self._resolved.popitem(last=False)
+
+    def _fail(self, pending, error):
+        logger.warning("Giving up on %s: %s", pending.describe(), error)
+        if pending.temp_id:
+            # Never going to have a real id to swap in
+            self._forget_temp_id(pending.session_id, pending.temp_id)
+        with self._condition:
+            failures = self._failures.setdefault(pending.session_id, deque(maxlen=MAX_FAILURES))
+            failures.append(f"Couldn't {pending.describe()}: {error}")
+
+write_queue = WriteBehindQueue()
+
+# Give queued changes a moment to go out when the app shuts down
+atexit.register(write_queue.drain, 5)